@@ -9,3 +9,20 @@ try:
     __version__ = importlib_metadata.version(__name__)
 except importlib_metadata.PackageNotFoundError:
     print("not found package")
+
+from .api import (
+    EasyWrkException, ConfigException, BenchmarkException,
+    load_context, get_api_config, build_prepared_request,
+    run_benchmark, run_benchmark_async, run_benchmarks_async,
+)
+from .result import BenchmarkResult
+from .records import RecordFile, open_request_records, query_requests, query_ranges
+
+__all__ = [
+    '__version__',
+    'EasyWrkException', 'ConfigException', 'BenchmarkException',
+    'load_context', 'get_api_config', 'build_prepared_request',
+    'run_benchmark', 'run_benchmark_async', 'run_benchmarks_async',
+    'BenchmarkResult',
+    'RecordFile', 'open_request_records', 'query_requests', 'query_ranges',
+]
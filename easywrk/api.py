@@ -0,0 +1,525 @@
+# coding:utf8
+
+"""
+Library api to run easywrk benchmarks from python code, for example a test suite.
+
+    context = load_context("easywrk.toml", ".env")
+    result = run_benchmark(context, "get", engine="builtin", duration="5s")
+    assert result.total_errors() == 0
+
+All errors are raised as EasyWrkException, nothing calls sys.exit.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import functools
+import itertools
+import subprocess
+
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit
+from typing import List, Tuple, Union, Optional, Iterable
+
+import attr
+from tomlkit import parse
+from tomlkit.exceptions import ParseError
+from jinja2 import TemplateError
+from requests import PreparedRequest
+
+from .common import load_dotenv, render_config_file
+from .common import EasyWrkContext, ApiConfig, WrkConfig, create_easywrk_context
+from .common import EasyWrkException, ConfigException
+from .common import build_request, make_config_hash, BuildRequestException
+from .wrk import Wrk
+from .engine import BuiltinEngine, EngineRequest, EngineRun, parse_duration, ENGINE_THREAD_PREFIX
+from .engine import snapshot_counts
+from .connect import ConnectEngine, ConnectException
+from .schedule import arrival_times, get_arrival_duration, ScheduleException
+from .profiling import TaskCpuSampler, SamplingProfiler, diagnose
+from .converge import ConvergenceMonitor, RecorderWindows, is_auto_duration
+from .result import BenchmarkResult, parse_wrk_output, merge_results
+from .result import save_result, get_git_commit, get_results_dir, make_run_id
+from .records import RecordStream
+from .history import HistoryStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG_FILE = "./easywrk.toml"
+DEFAULT_ENV_FILE = "./.env"
+
+ENGINES = ('wrk', 'builtin', 'connect')
+
+
+class BenchmarkException(EasyWrkException):
+    """
+    The load generator failed to run.
+    """
+
+
+def render_config(config_file:str = DEFAULT_CONFIG_FILE, env_file:Optional[str] = DEFAULT_ENV_FILE) -> str:
+    """
+    Load the env file into os.environ and render the config template.
+    """
+    if not os.path.isfile(config_file):
+        raise ConfigException(f"config file [{config_file}] does not exist")
+
+    if env_file:
+        if os.path.isfile(env_file):
+            load_dotenv(env_file)
+        else:
+            logger.info(f"env file [{env_file}] does not exist")
+
+    try:
+        return render_config_file(config_file)
+    except (OSError, TemplateError) as e:
+        raise ConfigException(f"render config file [{config_file}] failed: {e}") from e
+
+def load_config(config_file:str = DEFAULT_CONFIG_FILE, env_file:Optional[str] = DEFAULT_ENV_FILE):
+    text = render_config(config_file, env_file)
+    try:
+        return parse(text)
+    except ParseError as e:
+        raise ConfigException(f"parse config file [{config_file}] failed: {e}") from e
+
+def get_base_url(base_url:Optional[str] = None) -> str:
+    base_url = base_url or os.environ.get('BASE_URL', '')
+    if not base_url:
+        raise ConfigException("not define environ [BASE_URL]")
+
+    return base_url
+
+def load_context(config_file:str = DEFAULT_CONFIG_FILE, env_file:Optional[str] = DEFAULT_ENV_FILE,
+        base_url:Optional[str] = None) -> EasyWrkContext:
+    """
+    Load config and env file, `base_url` overrides BASE_URL in env. BASE_URL
+    may be empty when every api has a base url in config.
+    """
+    config = load_config(config_file, env_file)
+    base_url = base_url or os.environ.get('BASE_URL', '')
+    config_file_dir = Path(os.path.dirname(config_file))
+
+    try:
+        return create_easywrk_context(base_url, config_file_dir, config)
+    except (ValueError, TypeError, KeyError) as e:
+        raise ConfigException(f"invalid config file [{config_file}]: {e}") from e
+
+def get_api_config(context:EasyWrkContext, api:Union[str, ApiConfig]) -> ApiConfig:
+    if isinstance(api, ApiConfig):
+        return api
+
+    api_config = context.api_config_map.get(api, None)
+    if api_config is None:
+        raise ConfigException(f"not found api [{api}]")
+    return api_config
+
+def build_prepared_request(context:EasyWrkContext, api:Union[str, ApiConfig]) -> PreparedRequest:
+    api_config = get_api_config(context, api)
+    try:
+        return build_request(context, api_config).build()
+    except (BuildRequestException, OSError, TemplateError, ValueError) as e:
+        # 字段类型转换失败时是 ValueError
+        raise ConfigException(f"build request of api [{api_config.name}] failed: {e}") from e
+
+def to_engine_request(prepare_req:PreparedRequest) -> Tuple[str, EngineRequest]:
+    """
+    (base url, request) for the built-in engines.
+    """
+    u = urlsplit(prepare_req.url)
+    body = prepare_req.body
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+
+    req = EngineRequest(
+        method = prepare_req.method,
+        url = urlunsplit(('', '', u.path or '/', u.query, '')),
+        headers = dict(prepare_req.headers),
+        body = body,
+    )
+    return f"{u.scheme}://{u.netloc}", req
+
+def select_engine(api_config:ApiConfig, engine:Optional[str] = None) -> str:
+    """
+    Connect and arrival apis always use their own engine, others use
+    `engine` and default to wrk.
+    """
+    if api_config.connect is not None:
+        return 'connect'
+    if api_config.arrival is not None:
+        return 'builtin'
+    if engine and engine not in ENGINES:
+        raise ConfigException(f"not support engine [{engine}]")
+    return engine or 'wrk'
+
+def get_ca_file(context:EasyWrkContext, api_config:ApiConfig) -> Optional[str]:
+    connect = api_config.connect
+    if connect is None or not connect.ca_file:
+        return None
+    return str(context.config_file_dir.joinpath(connect.ca_file).absolute())
+
+
+def save_benchmark_result(context:EasyWrkContext, result:BenchmarkResult,
+        labels=None, tag:str = "") -> BenchmarkResult:
+    """
+    Save the result file and add it to the history store.
+    """
+    if labels:
+        result.labels = dict(labels)
+    result.git_commit = get_git_commit(context.config_file_dir)
+    result.tag = tag
+
+    api_dir = context.get_api_dir(result.api_name)
+    p = save_result(api_dir, result)
+    logger.info("save benchmark result to %s", p)
+
+    with HistoryStore(context.get_history_file()) as store:
+        store.add_result(result)
+
+    return result
+
+def save_schedule_file(context:EasyWrkContext, result:BenchmarkResult, run:EngineRun):
+    # 记录文件里已经有每个请求的计划和实际发送时间
+    if 'schedule' not in result.extra or 'records' in result.extra:
+        return
+
+    results_dir = get_results_dir(context.get_api_dir(result.api_name))
+    p = results_dir.joinpath(f"{result.run_id}.schedule.csv")
+    run.write_schedule_file(p)
+    logger.info("save scheduled and actual send times to %s", p)
+
+def save_profile_file(context:EasyWrkContext, result:BenchmarkResult, profiler:Optional[SamplingProfiler]):
+    if profiler is None:
+        return
+
+    results_dir = get_results_dir(context.get_api_dir(result.api_name))
+    p = results_dir.joinpath(f"{result.run_id}.profile.folded")
+    profiler.dump(p)
+    logger.info("save profile of %d samples to %s", profiler.samples, p)
+
+
+def add_client_diagnosis(result:BenchmarkResult, cpu):
+    diagnosis = diagnose(cpu, result.engine)
+    if diagnosis:
+        result.extra['client_cpu'] = cpu
+        result.extra['diagnosis'] = diagnosis
+
+def run_engine(engine:BuiltinEngine, requests:Iterable[EngineRequest],
+        duration:Optional[float], profile:bool = False,
+        monitor:Optional[ConvergenceMonitor] = None,
+        records:Optional[RecordStream] = None):
+    """
+    Run the engine while sampling cpu usage of this process, and python
+    stacks when `profile` is set. Return (run, cpu stats, profiler or None).
+    With a `monitor` the run stops once it converged, with `records` the
+    requests are streamed to record files and the run reads its result
+    from them.
+    """
+    windows = None if monitor is None else RecorderWindows(monitor)
+
+    def on_interval(elapsed, recorders):
+        # 先统计窗口，再把记录移到文件，两者使用同一个记录数
+        counts = snapshot_counts(recorders)
+        stop = windows is not None and windows(elapsed, recorders, counts)
+        if records is not None:
+            records(elapsed, recorders, counts)
+        return stop
+
+    callback = on_interval if windows is not None or records is not None else None
+    profiler = SamplingProfiler(thread_prefix=ENGINE_THREAD_PREFIX) if profile else None
+    with TaskCpuSampler(os.getpid()) as sampler:
+        if profiler is not None:
+            profiler.start()
+        try:
+            run = engine.run(requests, duration, callback)
+        finally:
+            if profiler is not None:
+                profiler.stop()
+
+    if records is not None:
+        run = records.finish(run)
+    return run, sampler.stats(), profiler
+
+def make_record_stream(context:EasyWrkContext, api_name:str) -> RecordStream:
+    start_time = time.time()
+    results_dir = get_results_dir(context.get_api_dir(api_name))
+    return RecordStream(results_dir, make_run_id(start_time), start_time)
+
+def make_monitor(api_config:ApiConfig, wrk_config:WrkConfig, duration:str) -> Optional[ConvergenceMonitor]:
+    """
+    A convergence monitor when `duration` is auto, otherwise None.
+    """
+    if not is_auto_duration(duration):
+        return None
+    try:
+        return ConvergenceMonitor.from_config(wrk_config)
+    except ValueError as e:
+        raise ConfigException(f"invalid auto duration config of api [{api_config.name}]: {e}") from e
+
+def finish_engine_result(result:BenchmarkResult, cpu, profiler:Optional[SamplingProfiler],
+        monitor:Optional[ConvergenceMonitor] = None, records:Optional[RecordStream] = None):
+    if records is not None:
+        # 结果文件和记录文件使用相同的 run id
+        result.run_id = records.run_id
+        result.extra['records'] = records.info()
+    if monitor is not None:
+        result.extra['convergence'] = monitor.stats()
+    if profiler is not None:
+        result.extra['profile'] = {
+            'interval': profiler.interval,
+            'samples': profiler.samples,
+            'top': profiler.top(),
+        }
+    add_client_diagnosis(result, cpu)
+
+
+def _run_wrk_once(api_config:ApiConfig, prepare_req:PreparedRequest, wrk_config:WrkConfig,
+        api_dir:Path, wrk_args:Optional[List[str]], dry_run:bool, echo:bool):
+    wrk_bin = os.environ.get('WRK_BIN', 'wrk')
+    start_time = time.time()
+
+    wrk = Wrk(
+        wrk_config,  wrk_bin,
+        prepare_req.url, prepare_req.method,
+        prepare_req.headers, prepare_req.body
+    )
+    try:
+        output = wrk.run(api_dir, wrk_args, dry_run, echo)
+    except subprocess.CalledProcessError as e:
+        raise BenchmarkException(f"wrk exit with code {e.returncode}") from e
+    except OSError as e:
+        raise BenchmarkException(f"run wrk [{wrk_bin}] failed: {e}") from e
+    if output is None:
+        return None, None
+
+    result = parse_wrk_output(api_config.name, output)
+    result.timestamp = start_time
+    return result, wrk.cpu_stats
+
+def _run_wrk(context:EasyWrkContext, api_config:ApiConfig, prepare_req:PreparedRequest,
+        wrk_config:WrkConfig, wrk_args:Optional[List[str]], dry_run:bool, echo:bool):
+    api_dir = context.get_api_dir(api_config.name)
+    monitor = make_monitor(api_config, wrk_config, wrk_config.duration)
+
+    if monitor is None:
+        result, cpu = _run_wrk_once(api_config, prepare_req, wrk_config, api_dir, wrk_args, dry_run, echo)
+        if result is None:
+            return None
+    else:
+        # wrk 不能输出中间结果，按窗口长度分段运行
+        # 收敛需要每个窗口的 p99，总是加上 --latency
+        if not wrk_config.latency:
+            logger.info("auto duration needs p99 of every window, run wrk with --latency")
+        window_config = attr.evolve(wrk_config, duration=wrk_config.window, latency=True)
+        logger.info(
+            "auto duration: %s windows, %s to %s",
+            wrk_config.window, wrk_config.min_duration, wrk_config.max_duration
+        )
+        windows = []
+        cpu = {}
+        elapsed = 0.0
+        while True:
+            result, window_cpu = _run_wrk_once(
+                api_config, prepare_req, window_config, api_dir, wrk_args, dry_run, False
+            )
+            if result is None:
+                return None
+
+            windows.append(result)
+            # 保留 CPU 使用率最高的窗口
+            if window_cpu and window_cpu['process_avg'] >= cpu.get('process_avg', -1):
+                cpu = window_cpu
+
+            elapsed += result.duration or monitor.window
+            p99 = result.latency_percentiles.get("99")
+            monitor.add_window(elapsed, result.requests_per_sec, p99)
+            logger.info(
+                "window %d: %.2f requests/sec, p99 %s",
+                len(windows), result.requests_per_sec,
+                "-" if p99 is None else "%.2fms" % (p99 * 1000)
+            )
+            if monitor.check(elapsed):
+                break
+
+        result = merge_results(api_config.name, windows)
+        result.extra['convergence'] = monitor.stats()
+
+    result.wrk_config = attr.asdict(wrk_config)
+    result.config_hash = make_config_hash(wrk_config, api_config)
+    add_client_diagnosis(result, cpu)
+    return result
+
+def _run_builtin(context:EasyWrkContext, api_config:ApiConfig, prepare_req:PreparedRequest,
+        wrk_config:WrkConfig, dry_run:bool, profile:bool, record:bool):
+    connections = wrk_config.thread_connections * wrk_config.threads
+    arrival = api_config.arrival
+
+    # arrival 配置了时长时不使用 wrk 的 duration
+    arrival_duration = arrival is not None and bool(arrival.stages or arrival.duration)
+
+    monitor = None
+    duration = None
+    if not arrival_duration:
+        monitor = make_monitor(api_config, wrk_config, wrk_config.duration)
+        try:
+            duration = monitor.max_duration if monitor else parse_duration(wrk_config.duration)
+        except ValueError as e:
+            raise ConfigException(f"invalid duration of api [{api_config.name}]: {e}") from e
+
+    if arrival is not None:
+        if arrival.max_connections > 0:
+            connections = arrival.max_connections
+        try:
+            duration = get_arrival_duration(arrival, duration)
+            times = arrival_times(arrival, duration)
+        except (ScheduleException, ValueError) as e:
+            raise ConfigException(f"invalid arrival config of api [{api_config.name}]: {e}") from e
+        logger.info(
+            "open model: %s arrival, max connections: %d, duration: %ss",
+            arrival.process, connections, duration
+        )
+    else:
+        logger.info("total connections: %d, duration: %ss", connections, duration)
+
+    base_url, req = to_engine_request(prepare_req)
+    try:
+        engine = BuiltinEngine(base_url, connections)
+    except ValueError as e:
+        raise ConfigException(str(e)) from e
+
+    if dry_run:
+        return None, None, None
+
+    if arrival is not None:
+        requests = (
+            EngineRequest(req.method, req.url, req.headers, req.body, t)
+            for t in times
+        )
+    else:
+        requests = itertools.repeat(req)
+
+    records = make_record_stream(context, api_config.name) if record else None
+    logger.info("start benchmark...")
+    run, cpu, profiler = run_engine(engine, requests, duration, profile, monitor, records)
+
+    result = run.to_result(api_config.name)
+    result.wrk_config = attr.asdict(wrk_config)
+    result.config_hash = make_config_hash(wrk_config, api_config)
+    if arrival is not None:
+        result.extra['arrival'] = attr.asdict(arrival)
+    finish_engine_result(result, cpu, profiler, monitor, records)
+    return result, run, profiler
+
+def _run_connect(context:EasyWrkContext, api_config:ApiConfig, prepare_req:PreparedRequest,
+        wrk_config:WrkConfig, dry_run:bool, profile:bool):
+    connect = api_config.connect
+    connections = connect.connections or wrk_config.thread_connections * wrk_config.threads
+
+    base_url, req = to_engine_request(prepare_req)
+    duration_text = connect.duration or wrk_config.duration
+    monitor = make_monitor(api_config, wrk_config, duration_text)
+    try:
+        duration = monitor.max_duration if monitor else parse_duration(duration_text)
+        engine = ConnectEngine(
+            base_url, connections, connect.timeout, connect.tls_verify,
+            get_ca_file(context, api_config),
+            connect.mode, connect.resumption, connect.server_name
+        )
+    except (ConnectException, ValueError, OSError) as e:
+        raise ConfigException(f"invalid connect config of api [{api_config.name}]: {e}") from e
+
+    logger.info(
+        "connect mode: %s, tls resumption: %s, concurrency: %d, duration: %ss",
+        connect.mode, connect.resumption if engine.tls else "-", connections, duration
+    )
+    if dry_run:
+        return None, None, None
+
+    logger.info("start benchmark...")
+    run, cpu, profiler = run_engine(engine, itertools.repeat(req), duration, profile, monitor)
+
+    result = run.to_result(api_config.name)
+    result.wrk_config = attr.asdict(wrk_config)
+    result.config_hash = make_config_hash(wrk_config, api_config)
+    finish_engine_result(result, cpu, profiler, monitor)
+    return result, run, profiler
+
+def run_benchmark(context:EasyWrkContext, api:Union[str, ApiConfig], engine:Optional[str] = None,
+        wrk_config:Optional[WrkConfig] = None, duration:Optional[str] = None,
+        tag:str = "", save:bool = True, profile:bool = False,
+        wrk_args:Optional[List[str]] = None, dry_run:bool = False,
+        prepare_req:Optional[PreparedRequest] = None, echo:bool = False,
+        record:bool = False) -> Optional[BenchmarkResult]:
+    """
+    Benchmark `api` (name or config) and return its result, None on dry run.
+
+    `wrk_config` and `duration` override the [wrk] config, `save` stores the
+    result file and adds it to the history store, `echo` prints wrk output.
+    `record` streams every request of the builtin engine to binary record
+    files next to the result, for long runs.
+    """
+    api_config = get_api_config(context, api)
+    engine = select_engine(api_config, engine)
+
+    if wrk_config is None:
+        wrk_config = context.wrk_config
+    if duration:
+        wrk_config = attr.evolve(wrk_config, duration=duration)
+    if prepare_req is None:
+        prepare_req = build_prepared_request(context, api_config)
+
+    run = None
+    profiler = None
+    if engine == 'wrk':
+        if profile:
+            logger.warning("profile only works with the builtin engine, ignored")
+        if record:
+            logger.warning("record only works with the builtin engine, ignored")
+        result = _run_wrk(context, api_config, prepare_req, wrk_config, wrk_args, dry_run, echo)
+    elif engine == 'connect':
+        if record:
+            logger.warning("record only works with the builtin engine, ignored")
+        result, run, profiler = _run_connect(context, api_config, prepare_req, wrk_config, dry_run, profile)
+    else:
+        result, run, profiler = _run_builtin(
+            context, api_config, prepare_req, wrk_config, dry_run, profile, record
+        )
+
+    if result is None or not save:
+        return result
+
+    save_benchmark_result(context, result, api_config.labels, tag)
+    if run is not None:
+        save_schedule_file(context, result, run)
+    save_profile_file(context, result, profiler)
+    return result
+
+
+async def run_benchmark_async(context:EasyWrkContext, api:Union[str, ApiConfig],
+        executor=None, **kwargs) -> Optional[BenchmarkResult]:
+    """
+    run_benchmark in `executor`, the default executor of the loop when None.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor, functools.partial(run_benchmark, context, api, **kwargs)
+    )
+
+async def run_benchmarks_async(context:EasyWrkContext, apis:Iterable[Union[str, ApiConfig]],
+        max_concurrency:int = 0, executor=None, **kwargs) -> List[Optional[BenchmarkResult]]:
+    """
+    Run benchmarks of `apis` concurrently, at most `max_concurrency` at the
+    same time when it is positive. Results are in the order of `apis`.
+
+    Runs in the same process share its cpu, so cpu stats and profiles of
+    the built-in engines cover all of them.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency > 0 else None
+
+    async def run_one(api):
+        if semaphore is None:
+            return await run_benchmark_async(context, api, executor, **kwargs)
+        async with semaphore:
+            return await run_benchmark_async(context, api, executor, **kwargs)
+
+    return await asyncio.gather(*(run_one(api) for api in apis))
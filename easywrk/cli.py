@@ -7,7 +7,10 @@ import logging
 
 import easywrk
 from easywrk.commands import help_command, request_command, run_command, view_config_command
-from easywrk.commands import list_command, init_command
+from easywrk.commands import list_command, init_command, export_command, history_command
+from easywrk.commands import report_command, watch_command, run_all_command
+from easywrk.commands import import_command, replay_command, records_command
+from easywrk.corpus import CORPUS_FORMATS
 from easywrk.commands import register_cmd_help
 
 
@@ -85,6 +88,33 @@ def setup_argparse():
         default=False,
         help="use request mock to response data and do not call wrk tool"
     )
+    run_parser.add_argument(
+        "--tag",
+        dest="tag",
+        default="",
+        help="tag of the benchmark result, used to query history"
+    )
+    run_parser.add_argument(
+        "--engine",
+        dest="engine",
+        choices=("wrk", "builtin"),
+        default="wrk",
+        help="load generator, default is wrk"
+    )
+    run_parser.add_argument(
+        "--profile",
+        dest="profile",
+        action="store_true",
+        default=False,
+        help="sample python stacks of the builtin engine and save them with the result"
+    )
+    run_parser.add_argument(
+        "--record",
+        dest="record",
+        action="store_true",
+        default=False,
+        help="stream every request of the builtin engine to binary record files, for long runs"
+    )
     run_parser.add_argument(
         "--no-print-response-body", 
         dest="print_response_body",
@@ -112,6 +142,55 @@ def setup_argparse():
         help="print request body"
     )
 
+    # run-all command
+    name = "run-all"
+    run_all_parser = subparsers.add_parser(
+        name,
+        help="run benchmarks of many apis concurrently, each on its own cpus"
+    )
+    run_all_parser.set_defaults(handle=run_all_command)
+    register_cmd_help(name, run_all_parser)
+
+    run_all_parser.add_argument(
+        "names", nargs="*",
+        help="api names, default is all apis"
+    )
+    setup_config_argparse(run_all_parser)
+    run_all_parser.add_argument(
+        "-g", "--group",
+        dest="groups",
+        action="append",
+        default=[],
+        help="only run apis of the group, can be repeated"
+    )
+    run_all_parser.add_argument(
+        "--engine",
+        dest="engine",
+        choices=("wrk", "builtin"),
+        default=None,
+        help="load generator, default is wrk"
+    )
+    run_all_parser.add_argument(
+        "--max-parallel",
+        dest="max_parallel",
+        type=int,
+        default=0,
+        help="max benchmarks running at the same time, default is limited by cpus only"
+    )
+    run_all_parser.add_argument(
+        "--tag",
+        dest="tag",
+        default="",
+        help="tag of all benchmark results, default is run-all-<time>"
+    )
+    run_all_parser.add_argument(
+        "--dry-run",
+        dest="dry_run",
+        action="store_true",
+        default=False,
+        help="show how apis would be scheduled without running them"
+    )
+
     # request command
     name = "request"
     request_parser = subparsers.add_parser(
@@ -182,6 +261,322 @@ def setup_argparse():
 
     setup_config_argparse(list_parser)
 
+    # export command
+    name = "export"
+    export_parser = subparsers.add_parser(
+        name,
+        help="export benchmark results to OpenMetrics and InfluxDB line protocol files"
+    )
+    export_parser.set_defaults(handle=export_command)
+    register_cmd_help(name, export_parser)
+
+    export_parser.add_argument(
+        "name", nargs="*",
+        help="api name, default is all api"
+    )
+    setup_config_argparse(export_parser)
+    export_parser.add_argument(
+        "-o", "--output-dir",
+        dest="output_dir",
+        default="",
+        help="output directory, default is benchmark/export in config file directory"
+    )
+    export_parser.add_argument(
+        "--all-runs",
+        dest="all_runs",
+        action="store_true",
+        default=False,
+        help="export all stored runs, default only export latest run"
+    )
+    export_parser.add_argument(
+        "--push-url",
+        dest="push_url",
+        default="",
+        help="push latest results to pushgateway compatible endpoint"
+    )
+    export_parser.add_argument(
+        "--job",
+        dest="job",
+        default="easywrk",
+        help="pushgateway job name, default is easywrk"
+    )
+
+    # history command
+    name = "history"
+    history_parser = subparsers.add_parser(
+        name,
+        help="query benchmark history of api"
+    )
+    history_parser.set_defaults(handle=history_command)
+    register_cmd_help(name, history_parser)
+
+    history_parser.add_argument(
+        "name", nargs="?",
+        help="api name"
+    )
+    setup_config_argparse(history_parser)
+    history_parser.add_argument(
+        "--tag",
+        dest="tag",
+        default="",
+        help="only show runs with the tag"
+    )
+    history_parser.add_argument(
+        "--config-hash",
+        dest="config_hash",
+        default="",
+        help="only show runs with the config hash"
+    )
+    history_parser.add_argument(
+        "--days",
+        dest="days",
+        type=float,
+        default=0,
+        help="only show runs in recent days"
+    )
+    history_parser.add_argument(
+        "--limit",
+        dest="limit",
+        type=int,
+        default=20,
+        help="max number of runs to show, default is 20"
+    )
+    history_parser.add_argument(
+        "--trend",
+        dest="trend",
+        action="store_true",
+        default=False,
+        help="show daily trend instead of runs"
+    )
+    history_parser.add_argument(
+        "--import",
+        dest="import_results",
+        action="store_true",
+        default=False,
+        help="import stored run result files into history"
+    )
+    history_parser.add_argument(
+        "--compact-days",
+        dest="compact_days",
+        type=float,
+        default=0,
+        help="compact runs older than the days into daily summaries"
+    )
+
+    # records command
+    name = "records"
+    records_parser = subparsers.add_parser(
+        name,
+        help="query request records of recorded runs"
+    )
+    records_parser.set_defaults(handle=records_command)
+    register_cmd_help(name, records_parser)
+
+    records_parser.add_argument(
+        "name", nargs=1,
+        help="api name"
+    )
+    setup_config_argparse(records_parser)
+    records_parser.add_argument(
+        "--run",
+        dest="run_ids",
+        action="append",
+        default=[],
+        help="run id to query, can be repeated to compare runs; default is the latest recorded run"
+    )
+    records_parser.add_argument(
+        "--start",
+        dest="start",
+        default="",
+        help="only count requests completed after the time from the run start, like 1h"
+    )
+    records_parser.add_argument(
+        "--end",
+        dest="end",
+        default="",
+        help="only count requests completed before the time from the run start"
+    )
+    records_parser.add_argument(
+        "--interval",
+        dest="interval",
+        default="",
+        help="split the time range into intervals, like 10m"
+    )
+    records_parser.add_argument(
+        "-p", "--percentile",
+        dest="percentiles",
+        action="append",
+        default=[],
+        help="latency percentile to show, can be repeated; default is 50, 75, 90, 99 and 99.9"
+    )
+
+    # report command
+    name = "report"
+    report_parser = subparsers.add_parser(
+        name,
+        help="generate html report from benchmark history"
+    )
+    report_parser.set_defaults(handle=report_command)
+    register_cmd_help(name, report_parser)
+
+    setup_config_argparse(report_parser)
+    report_parser.add_argument(
+        "-o", "--output",
+        dest="output",
+        default="",
+        help="output html file, default is benchmark/report.html in config file directory"
+    )
+    report_parser.add_argument(
+        "--tag",
+        dest="tag",
+        default="",
+        help="only report runs with the tag"
+    )
+    report_parser.add_argument(
+        "--max-runs",
+        dest="max_runs",
+        type=int,
+        default=100,
+        help="max number of runs in trend charts, default is 100"
+    )
+
+    # watch command
+    name = "watch"
+    watch_parser = subparsers.add_parser(
+        name,
+        help="re-run benchmark of affected api when config or body files change"
+    )
+    watch_parser.set_defaults(handle=watch_command)
+    register_cmd_help(name, watch_parser)
+
+    watch_parser.add_argument(
+        "name", nargs="*",
+        help="api name, default is all api"
+    )
+    setup_config_argparse(watch_parser)
+    watch_parser.add_argument(
+        "-d", "--duration",
+        dest="duration",
+        default="3s",
+        help="duration of each benchmark, default is 3s"
+    )
+    watch_parser.add_argument(
+        "--tag",
+        dest="tag",
+        default="watch",
+        help="tag of the benchmark results, default is watch"
+    )
+    watch_parser.add_argument(
+        "--initial",
+        dest="initial",
+        action="store_true",
+        default=False,
+        help="benchmark all watched api once at start"
+    )
+    watch_parser.add_argument(
+        "--polling",
+        dest="polling",
+        action="store_true",
+        default=False,
+        help="detect changes by polling instead of inotify"
+    )
+    watch_parser.add_argument(
+        "--interval",
+        dest="interval",
+        type=float,
+        default=1.0,
+        help="polling interval in seconds, default is 1"
+    )
+
+    # import command
+    name = "import"
+    import_parser = subparsers.add_parser(
+        name,
+        help="import requests from access log, HAR or jsonl file as replay corpus"
+    )
+    import_parser.set_defaults(handle=import_command)
+    register_cmd_help(name, import_parser)
+
+    import_parser.add_argument(
+        "source", nargs=1,
+        help="nginx access log, HAR or jsonl request capture file"
+    )
+    import_parser.add_argument(
+        "name", nargs=1,
+        help="corpus name"
+    )
+    setup_config_argparse(import_parser)
+    import_parser.add_argument(
+        "--format",
+        dest="format",
+        choices=CORPUS_FORMATS,
+        default="",
+        help="source file format, default is guessed by file name"
+    )
+
+    # replay command
+    name = "replay"
+    replay_parser = subparsers.add_parser(
+        name,
+        help="replay imported corpus as benchmark workload"
+    )
+    replay_parser.set_defaults(handle=replay_command)
+    register_cmd_help(name, replay_parser)
+
+    replay_parser.add_argument(
+        "name", nargs=1,
+        help="corpus name"
+    )
+    setup_config_argparse(replay_parser)
+    replay_parser.add_argument(
+        "--engine",
+        dest="engine",
+        choices=("wrk", "builtin"),
+        default="wrk",
+        help="load generator, default is wrk"
+    )
+    replay_parser.add_argument(
+        "--speedup",
+        dest="speedup",
+        type=float,
+        default=1.0,
+        help="divide original inter-arrival times by the factor, default is 1"
+    )
+    replay_parser.add_argument(
+        "--no-timing",
+        dest="no_timing",
+        action="store_true",
+        default=False,
+        help="send requests as fast as possible instead of original timing"
+    )
+    replay_parser.add_argument(
+        "-d", "--duration",
+        dest="duration",
+        default="",
+        help="benchmark duration, corpus is replayed in a loop; "
+            "default is wrk duration in config for wrk engine and one pass for builtin engine"
+    )
+    replay_parser.add_argument(
+        "--tag",
+        dest="tag",
+        default="",
+        help="tag of the benchmark result, used to query history"
+    )
+    replay_parser.add_argument(
+        "--profile",
+        dest="profile",
+        action="store_true",
+        default=False,
+        help="sample python stacks of the builtin engine and save them with the result"
+    )
+    replay_parser.add_argument(
+        "--dry-run",
+        dest="dry_run",
+        action="store_true",
+        default=False,
+        help="do not send any request"
+    )
+
     return parser
 
 
@@ -3,17 +3,38 @@
 import os
 from pathlib import Path
 import sys
+import time
 import logging
 from requests.models import Request
 from requests import Session
 import requests_mock
+import attr
 
 from tomlkit import parse
 from tabulate import tabulate
 
 from .common import load_dotenv, render_config_file
-from .common import EasyWrkContext, RequestBuilder, create_easywrk_context, build_request
-from .wrk import Wrk
+from .common import EasyWrkContext, create_easywrk_context
+from .common import make_config_hash, hash_config_data, get_api_files
+from .common import REPLAY_NAME_PREFIX
+from .validates import validate_name
+from .wrk import ReplayWrk
+from .engine import BuiltinEngine, parse_duration
+from .converge import is_auto_duration
+from .parallel import RunAllScheduler, plan_jobs, make_run_cmd, collect_results
+from .corpus import Corpus, CorpusException, import_corpus
+from .result import parse_wrk_output
+from .result import load_results, load_latest_result, get_results_dir
+from .records import RecordException, open_request_records, query_ranges
+from .engine import LATENCY_PERCENTILES
+from . import api
+from .api import EasyWrkException, ConfigException, render_config, build_prepared_request
+from .api import run_benchmark, run_engine, finish_engine_result, add_client_diagnosis, get_ca_file
+from .api import save_benchmark_result, save_schedule_file, save_profile_file
+from .history import HistoryStore, days_ago
+from .report import build_report
+from .watch import create_watcher, wait_changes, find_template_files
+from .exporter import to_openmetrics, to_line_protocol, push_to_gateway, ExportException
 
 logger = logging.getLogger(__name__)
 
@@ -32,23 +53,25 @@ def help_command(args, other_argv=None):
     parser.print_help()
 
 def load_config_file(args, verbose):
-    
-    if not os.path.isfile(args.config_file):
-        logger.error(f"config file [{args.config_file}] does not exist")
+    try:
+        text = render_config(args.config_file, args.env_file)
+    except ConfigException as e:
+        logger.error(str(e))
         sys.exit(-1)
 
-    if not os.path.isfile(args.env_file):
-        logger.info(f"env file [{args.env_file}] does not exist")    
-    else:
-        load_dotenv(args.env_file)
-
-    text = render_config_file(args.config_file)
     if verbose:
         print("config file: \n")
         print(text)
 
     return parse(text)
 
+def create_context(base_url, config_file_dir, config) -> EasyWrkContext:
+    try:
+        return create_easywrk_context(base_url, config_file_dir, config)
+    except ConfigException as e:
+        logger.error(str(e))
+        sys.exit(-1)
+
 init_env_text="""
 WRK_BIN = "wrk"
 BASE_URL="${BASE_URL:-http://127.0.0.1:8080}"
@@ -112,13 +135,12 @@ def init_command(args, other_args=None):
 
 
 def get_base_url():
-    base_url = os.environ.get('BASE_URL', '')
-    if not base_url:
-        print("not define environ [BASE_URL]")
+    try:
+        return api.get_base_url()
+    except ConfigException as e:
+        print(str(e))
         sys.exit(1)
 
-    return base_url
-
 
 def view_config_command(args, other_argv=None):
     load_config_file(args, True)
@@ -129,9 +151,9 @@ def list_command(args, other_argv=None):
     config = load_config_file(args, False)
     config_file_dir = Path(os.path.dirname(args.config_file))
 
-    base_url = get_base_url()
+    base_url = os.environ.get('BASE_URL', '')
 
-    context: EasyWrkContext = create_easywrk_context(base_url, config_file_dir, config)
+    context: EasyWrkContext = create_context(base_url, config_file_dir, config)
 
     header = ("API", "DESC")
     table = []
@@ -153,18 +175,21 @@ def _do_reqeust_command(args, other_argv=None, print_request_body=True, print_re
     config = load_config_file(args, False)
     config_file_dir = Path(os.path.dirname(args.config_file))
 
-    base_url = get_base_url()
+    base_url = os.environ.get('BASE_URL', '')
 
-    context: EasyWrkContext = create_easywrk_context(base_url, config_file_dir, config)
+    context: EasyWrkContext = create_context(base_url, config_file_dir, config)
 
     name = args.name[0]
     api_config = context.api_config_map.get(name, None)
     if api_config is None:
         print(f"not found api [{name}]")
-        return
+        sys.exit(1)
 
-    req_builder: RequestBuilder = build_request(context, api_config)
-    prepare_req = req_builder.build()
+    try:
+        prepare_req = build_prepared_request(context, api_config)
+    except ConfigException as e:
+        logger.error(str(e))
+        sys.exit(1)
 
     logger.info("try to connect server...")
     logger.info("url: %s", prepare_req.url)
@@ -193,8 +218,13 @@ def _do_reqeust_command(args, other_argv=None, print_request_body=True, print_re
 
         m.register_uri(prepare_req.method, prepare_req.url, **p)
 
+        verify = True
+        if api_config.connect is not None:
+            # 建连压测可以用自签名证书，预检请求使用相同的证书校验配置
+            verify = api_config.connect.tls_verify and (get_ca_file(context, api_config) or True)
+
         s = Session()
-        resp = s.send(prepare_req)
+        resp = s.send(prepare_req, verify=verify)
         s.close()
 
     http_version = GLOBAL_HTTP_VERSION_MAP.get(resp.raw.version, "")
@@ -223,18 +253,686 @@ def request_command(args, other_argv=None):
         args.print_response_body
         )
 
+def _print_engine_result(result):
+    if result.engine == "connect":
+        table = [
+            ("connections", result.requests),
+            ("duration(s)", result.duration),
+            ("connections/sec", result.requests_per_sec),
+        ]
+    else:
+        table = [
+            ("requests", result.requests),
+            ("duration(s)", result.duration),
+            ("requests/sec", result.requests_per_sec),
+        ]
+    table += [
+        ("latency avg(ms)", result.latency.avg * 1000),
+        ("latency max(ms)", result.latency.max * 1000),
+    ]
+    for k, v in result.latency_percentiles.items():
+        table.append((f"latency p{k}(ms)", v * 1000))
+    for k, v in result.errors.items():
+        if v:
+            table.append((f"errors {k}", v))
+    for k, v in result.extra.get('schedule', {}).items():
+        if k == 'scheduled_requests':
+            table.append((f"schedule {k}", v))
+        else:
+            table.append((f"schedule {k}(ms)", v * 1000))
+
+    connect = result.extra.get('connect', {})
+    for phase, stats in connect.get('phases', {}).items():
+        for k in ('p50', 'p99', 'max'):
+            table.append((f"{phase} {k}(ms)", stats[k] * 1000))
+    if connect.get('resumption_tried'):
+        table.append(("tls resumption ratio", connect['resumption_ratio']))
+
+    convergence = result.extra.get('convergence', {})
+    if convergence:
+        table.append(("stop reason", convergence['stop_reason']))
+        for k in ('requests_per_sec', 'p99'):
+            ci = convergence.get(f'{k}_ci')
+            if ci is not None:
+                table.append((f"{k} ci(%)", ci * 100))
+
+    table = [(k, "%.2f" % v if isinstance(v, float) else v) for k, v in table]
+
+    print('')
+    print(tabulate(table, disable_numparse=True))
+    print('')
+
+    top = result.extra.get('profile', {}).get('top', [])
+    if top:
+        print(tabulate(
+            [(name, "%.1f" % pct) for name, pct in top],
+            headers=("FUNCTION", "SAMPLES(%)"), disable_numparse=True
+        ))
+        print('')
+
+def _print_benchmark_result(result):
+    # wrk 的输出在运行时已经打印过了，分段运行时只打印了每段的结果
+    if result.engine != 'wrk' or 'convergence' in result.extra:
+        _print_engine_result(result)
+
+    diagnosis = result.extra.get('diagnosis')
+    if diagnosis:
+        log = logger.warning if diagnosis['client_bound'] else logger.info
+        log("load generator: %s", diagnosis['reason'])
+        log("suggestion: %s", diagnosis['recommendation'])
+
 def run_command(args, other_argv=None):
     context, api_config, prepare_req = _do_reqeust_command(args, other_argv, 
         args.print_request_body, 
         args.print_response_body 
     )
 
-    wrk_bin = os.environ.get('WRK_BIN', 'wrk')
-    api_dir = context.get_api_dir(api_config.name)
+    try:
+        result = run_benchmark(
+            context, api_config, args.engine,
+            tag=args.tag, profile=args.profile, wrk_args=other_argv,
+            dry_run=args.dry_run, prepare_req=prepare_req, echo=True,
+            record=args.record
+        )
+    except EasyWrkException as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+    if result is not None:
+        _print_benchmark_result(result)
+
+def run_all_command(args, other_argv=None):
+    config = load_config_file(args, False)
+    config_file_dir = Path(os.path.dirname(args.config_file))
+
+    base_url = os.environ.get('BASE_URL', '')
+
+    context: EasyWrkContext = create_context(base_url, config_file_dir, config)
+
+    api_configs = context.api_config_list
+    if args.names:
+        for name in args.names:
+            if name not in context.api_config_map:
+                print(f"not found api [{name}]")
+                sys.exit(1)
+        api_configs = [context.api_config_map[name] for name in args.names]
+    if args.groups:
+        api_configs = [a for a in api_configs if a.group in args.groups]
+
+    if not api_configs:
+        print("not found any api to run")
+        return
+
+    try:
+        jobs = plan_jobs(context, api_configs, args.engine)
+    except (ConfigException, ValueError) as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+    scheduler = RunAllScheduler(jobs, max_parallel=args.max_parallel)
+    tag = args.tag or time.strftime("run-all-%Y%m%dT%H%M%S")
+    logger.info("run %d apis on %d cpus, tag: %s", len(jobs), len(scheduler.cpu_list), tag)
+
+    if args.dry_run:
+        for i, wave in enumerate(scheduler.plan()):
+            print(f"wave {i + 1}:")
+            print(tabulate(
+                [(job.api_name, job.engine, job.target, job.cpus) for job in wave],
+                headers=("API", "ENGINE", "TARGET", "CPUS")
+            ))
+            print('')
+        return
+
+    start_time = time.time()
+    scheduler.run(
+        lambda job: make_run_cmd(job, args.config_file, args.env_file, tag, args.engine)
+    )
+    collect_results(context, jobs, tag)
+
+    table = []
+    for job in jobs:
+        row = [
+            job.api_name, job.target, ",".join(str(c) for c in job.cpu_set),
+            "%.1f" % (job.end_time - job.start_time),
+        ]
+        result = job.result
+        if result is None:
+            row.extend((f"failed({job.returncode})", "", "", ""))
+        else:
+            p99 = result.latency_percentiles.get("99")
+            row.extend((
+                "ok", "%.2f" % result.requests_per_sec,
+                "" if p99 is None else "%.2f" % (p99 * 1000),
+                str(result.total_errors()),
+            ))
+        table.append(row)
 
-    wrk = Wrk(
-        context.wrk_config,  wrk_bin,
-        prepare_req.url, prepare_req.method,
-        prepare_req.headers, prepare_req.body
+    print('')
+    print(tabulate(
+        table,
+        headers=("API", "TARGET", "CPUS", "TIME(s)", "STATUS", "RPS", "P99(ms)", "ERRORS"),
+        disable_numparse=True
+    ))
+    print('')
+    logger.info(
+        "finished %d apis in %.1fs, query them with: history --tag %s",
+        len(jobs), time.time() - start_time, tag
     )
-    wrk.run(api_dir, other_argv, args.dry_run)
+
+    if any(job.result is None for job in jobs):
+        sys.exit(1)
+
+def import_command(args, other_argv=None):
+    config = load_config_file(args, False)
+    config_file_dir = Path(os.path.dirname(args.config_file))
+
+    base_url = os.environ.get('BASE_URL', '')
+
+    context: EasyWrkContext = create_context(base_url, config_file_dir, config)
+
+    name = args.name[0]
+    if not validate_name(name):
+        print(f"corpus name [{name}] is illegal")
+        sys.exit(1)
+
+    source = Path(args.source[0])
+    if not source.is_file():
+        print(f"source file [{source}] does not exist")
+        sys.exit(1)
+
+    corpus_dir = context.get_corpus_dir(name)
+    try:
+        count = import_corpus(source, corpus_dir, args.format)
+    except (CorpusException, ValueError, KeyError) as e:
+        logger.error(f"import [{source}] failed: {e}")
+        sys.exit(1)
+
+    logger.info("import %d requests into %s", count, corpus_dir)
+
+def replay_command(args, other_argv=None):
+    config = load_config_file(args, False)
+    config_file_dir = Path(os.path.dirname(args.config_file))
+
+    base_url = get_base_url()
+
+    context: EasyWrkContext = create_context(base_url, config_file_dir, config)
+
+    if args.speedup <= 0:
+        print(f"speedup must be positive, got {args.speedup}")
+        sys.exit(1)
+
+    name = args.name[0]
+    corpus_dir = context.get_corpus_dir(name)
+    try:
+        corpus = Corpus(corpus_dir)
+    except CorpusException as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+    if len(corpus) == 0:
+        corpus.close()
+        logger.error(f"corpus [{name}] has no requests")
+        sys.exit(1)
+
+    api_name = REPLAY_NAME_PREFIX + name
+    wrk_config = context.wrk_config
+    timing = not args.no_timing
+    config_hash = hash_config_data({
+        'wrk': attr.asdict(wrk_config),
+        'corpus': corpus.meta,
+        'speedup': args.speedup,
+        'timing': timing,
+    })
+    logger.info(
+        "replay %d requests of corpus [%s], original duration %.2fs, speedup %s",
+        len(corpus), name, corpus.duration, args.speedup
+    )
+
+    with corpus:
+        if args.engine == 'builtin':
+            connections = wrk_config.thread_connections * wrk_config.threads
+            duration = parse_duration(args.duration) if args.duration else None
+            if args.dry_run:
+                return
+
+            engine = BuiltinEngine(base_url, connections)
+            requests = corpus.iter_requests(args.speedup, timing, loop=duration is not None)
+            run, cpu, profiler = run_engine(engine, requests, duration, args.profile)
+
+            result = run.to_result(api_name)
+            result.wrk_config = attr.asdict(wrk_config)
+            finish_engine_result(result, cpu, profiler)
+        else:
+            run = None
+            profiler = None
+            if args.profile:
+                logger.warning("--profile only works with the builtin engine, ignored")
+            if args.duration:
+                wrk_config = attr.evolve(wrk_config, duration=args.duration)
+            elif is_auto_duration(wrk_config.duration):
+                # 回放不支持自动时长，使用最长时长
+                logger.info("auto duration is not supported by replay, run %s", wrk_config.max_duration)
+                wrk_config = attr.evolve(wrk_config, duration=wrk_config.max_duration)
+            wrk_bin = os.environ.get('WRK_BIN', 'wrk')
+            api_dir = context.get_api_dir(api_name)
+            start_time = time.time()
+
+            wrk = ReplayWrk(
+                wrk_config, wrk_bin, base_url, corpus_dir,
+                len(corpus), args.speedup, timing
+            )
+            output = wrk.run(api_dir, other_argv, args.dry_run)
+            if output is None:
+                return
+
+            result = parse_wrk_output(api_name, output)
+            result.timestamp = start_time
+            result.wrk_config = attr.asdict(wrk_config)
+            add_client_diagnosis(result, wrk.cpu_stats)
+
+    result.config_hash = config_hash
+    result.extra['replay'] = {
+        'corpus': name,
+        'requests': len(corpus),
+        'speedup': args.speedup,
+        'timing': timing,
+    }
+    _print_benchmark_result(result)
+    save_benchmark_result(context, result, tag=args.tag)
+    if run is not None:
+        save_schedule_file(context, result, run)
+    save_profile_file(context, result, profiler)
+
+
+def _format_ms(value):
+    if value is None:
+        return None
+    return value * 1000
+
+def _format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+def history_command(args, other_argv=None):
+    config = load_config_file(args, False)
+    config_file_dir = Path(os.path.dirname(args.config_file))
+
+    base_url = os.environ.get('BASE_URL', '')
+
+    context: EasyWrkContext = create_context(base_url, config_file_dir, config)
+
+    name = args.name
+    if name is not None and not context.has_result_name(name):
+        print(f"not found api [{name}]")
+        sys.exit(1)
+
+    tag = args.tag or None
+    config_hash = args.config_hash or None
+    since = days_ago(args.days) if args.days > 0 else None
+
+    with HistoryStore(context.get_history_file()) as store:
+        if args.import_results:
+            names = [name] if name else None
+            count = store.import_dir(config_file_dir.joinpath('benchmark'), names)
+            logger.info("import %d runs", count)
+
+        if args.compact_days > 0:
+            count = store.compact(days_ago(args.compact_days))
+            logger.info("compact %d runs older than %s days", count, args.compact_days)
+
+        if name is None:
+            return
+
+        if args.trend:
+            header = ("DATE", "RUNS", "RPS", "RPS MIN", "RPS MAX", "P99(ms)", "P99 MAX(ms)", "ERRORS")
+            table = []
+            for point in store.trend(name, tag=tag, config_hash=config_hash, since=since):
+                table.append((
+                    time.strftime("%Y-%m-%d", time.localtime(point.timestamp)),
+                    point.runs,
+                    point.requests_per_sec,
+                    point.rps_min,
+                    point.rps_max,
+                    _format_ms(point.p99),
+                    _format_ms(point.p99_max),
+                    point.errors,
+                ))
+        else:
+            header = ("RUN", "TIME", "TAG", "CONFIG", "RPS", "P50(ms)", "P99(ms)", "ERRORS")
+            table = []
+            runs = store.query_runs(
+                name, tag=tag, config_hash=config_hash, since=since, limit=args.limit
+            )
+            for run in runs:
+                table.append((
+                    run.run_id,
+                    _format_time(run.timestamp),
+                    run.tag,
+                    run.config_hash,
+                    run.requests_per_sec,
+                    _format_ms(run.p50),
+                    _format_ms(run.p99),
+                    run.errors,
+                ))
+
+    print('')
+    print(tabulate(table, headers=header, floatfmt=".2f"))
+    print('')
+
+def records_command(args, other_argv=None):
+    config = load_config_file(args, False)
+    config_file_dir = Path(os.path.dirname(args.config_file))
+
+    base_url = os.environ.get('BASE_URL', '')
+
+    context: EasyWrkContext = create_context(base_url, config_file_dir, config)
+
+    name = args.name[0]
+    if not context.has_result_name(name):
+        print(f"not found api [{name}]")
+        sys.exit(1)
+
+    api_dir = context.get_api_dir(name)
+    recorded = [r for r in load_results(api_dir) if 'records' in r.extra]
+    if args.run_ids:
+        results = []
+        for run_id in args.run_ids:
+            found = [r for r in recorded if r.run_id == run_id]
+            if not found:
+                print(f"not found recorded run [{run_id}] of api [{name}]")
+                sys.exit(1)
+            results.append(found[0])
+    elif recorded:
+        results = recorded[-1:]
+    else:
+        print(f"api [{name}] has no recorded run, run it with --record")
+        sys.exit(1)
+
+    try:
+        start = parse_duration(args.start) if args.start else 0.0
+        end = parse_duration(args.end) if args.end else None
+        interval = parse_duration(args.interval) if args.interval else None
+    except ValueError as e:
+        print(f"invalid time range: {e}")
+        sys.exit(1)
+    if interval is not None and interval <= 0:
+        print(f"interval must be positive, got [{args.interval}]")
+        sys.exit(1)
+
+    percentiles = args.percentiles or list(LATENCY_PERCENTILES)
+    for p in percentiles:
+        try:
+            valid = 0 < float(p) <= 100
+        except ValueError:
+            valid = False
+        if not valid:
+            print(f"invalid percentile [{p}], it must be a number in (0, 100]")
+            sys.exit(1)
+
+    header = ["RUN", "FROM(s)", "TO(s)", "REQUESTS", "RPS", "AVG(ms)"]
+    header += [f"P{p}(ms)" for p in percentiles]
+    header.append("ERRORS")
+
+    table = []
+    for result in results:
+        # 最后一段包括压测结束时还没完成的请求
+        run_end = end if end is not None else result.duration
+        ranges = [(start, end)]
+        if interval:
+            ranges = []
+            t = start
+            while t < run_end:
+                ranges.append((t, t + interval if t + interval < run_end else end))
+                t += interval
+
+        try:
+            records = open_request_records(get_results_dir(api_dir), result.run_id)
+        except RecordException as e:
+            logger.error(str(e))
+            sys.exit(1)
+
+        for (range_start, range_end), stats in zip(ranges, query_ranges(records, ranges)):
+            range_end = run_end if range_end is None else range_end
+            seconds = range_end - range_start
+            row = [
+                result.run_id, range_start, range_end, stats.count,
+                stats.count / seconds if seconds > 0 else 0.0,
+                _format_ms(stats.latency_stats().avg if stats.count else None),
+            ]
+            row += [
+                _format_ms(stats.latencies.percentile(float(p)) if stats.count else None)
+                for p in percentiles
+            ]
+            row.append(sum(stats.errors().values()))
+            table.append(row)
+
+    print('')
+    print(tabulate(table, headers=header, floatfmt=".2f"))
+    print('')
+
+
+def export_command(args, other_argv=None):
+    config = load_config_file(args, False)
+    config_file_dir = Path(os.path.dirname(args.config_file))
+
+    base_url = os.environ.get('BASE_URL', '')
+
+    context: EasyWrkContext = create_context(base_url, config_file_dir, config)
+
+    names = args.name
+    if not names:
+        names = [api_config.name for api_config in context.api_config_list]
+
+    results = []
+    latest_results = []
+    for name in names:
+        if not context.has_result_name(name):
+            print(f"not found api [{name}]")
+            sys.exit(1)
+
+        api_dir = context.get_api_dir(name)
+        latest = load_latest_result(api_dir)
+        if latest is None:
+            logger.info(f"api [{name}] has no benchmark result")
+            continue
+
+        latest_results.append(latest)
+        if args.all_runs:
+            results.extend(load_results(api_dir))
+        else:
+            results.append(latest)
+
+    if not results:
+        print("not found any benchmark result")
+        sys.exit(1)
+
+    output_dir = Path(args.output_dir) if args.output_dir else config_file_dir.joinpath('benchmark', 'export')
+    output_dir.mkdir(exist_ok=True, parents=True)
+
+    p = output_dir.joinpath('easywrk.prom')
+    with p.open('w') as f:
+        f.write(to_openmetrics(results))
+    logger.info("write OpenMetrics file: %s", p)
+
+    p = output_dir.joinpath('easywrk.lp')
+    with p.open('w') as f:
+        f.write(to_line_protocol(results))
+    logger.info("write line protocol file: %s", p)
+
+    if args.push_url:
+        try:
+            push_to_gateway(args.push_url, args.job, latest_results)
+        except ExportException as e:
+            logger.error(str(e))
+            sys.exit(1)
+
+
+def report_command(args, other_argv=None):
+    config = load_config_file(args, False)
+    config_file_dir = Path(os.path.dirname(args.config_file))
+
+    base_url = os.environ.get('BASE_URL', '')
+
+    context: EasyWrkContext = create_context(base_url, config_file_dir, config)
+
+    api_names = [api_config.name for api_config in context.api_config_list]
+    descs = {api_config.name: api_config.desc for api_config in context.api_config_list}
+
+    with HistoryStore(context.get_history_file()) as store:
+        html = build_report(store, api_names, descs, args.tag or None, args.max_runs)
+
+    output = Path(args.output) if args.output else config_file_dir.joinpath('benchmark', 'report.html')
+    with output.open('w', encoding='utf-8') as f:
+        f.write(html)
+
+    logger.info("write report to %s", output)
+
+
+def _load_watch_context(args):
+    if os.path.isfile(args.env_file):
+        load_dotenv(args.env_file, override=True)
+
+    text = render_config_file(args.config_file)
+    config = parse(text)
+    config_file_dir = Path(os.path.dirname(args.config_file))
+
+    base_url = os.environ.get('BASE_URL', '')
+    return create_easywrk_context(base_url, config_file_dir, config)
+
+def _watch_snapshot(context: EasyWrkContext, names):
+    # 配置 hash 不包括服务地址，BASE_URL 和组的 base_url 变化也要重新压测
+    return {
+        name: (
+            make_config_hash(context.wrk_config, context.api_config_map[name]),
+            context.get_base_url(context.api_config_map[name]),
+        )
+        for name in names if name in context.api_config_map
+    }
+
+def _get_watch_files(args, context: EasyWrkContext, names):
+    config_file = Path(args.config_file).absolute()
+    config_files = {config_file, Path(args.env_file).absolute()}
+    config_files.update(find_template_files(config_file, config_file.parent))
+
+    api_files = {}
+    for name in names:
+        api_config = context.api_config_map[name]
+        files = set(p.absolute() for p in get_api_files(context.config_file_dir, api_config))
+        if api_config.body.startswith(':render:'):
+            for p in list(files):
+                files.update(find_template_files(p, context.config_file_dir.absolute()))
+        api_files[name] = files
+
+    return config_files, api_files
+
+def _print_result_diff(previous, current):
+    def values(run):
+        if run is None:
+            return (None, ) * 5
+        return (
+            run.requests_per_sec, _format_ms(run.latency_avg),
+            _format_ms(run.p50), _format_ms(run.p99), run.errors
+        )
+
+    header = ("METRIC", "PREVIOUS", "CURRENT", "CHANGE")
+    table = []
+    metrics = ("RPS", "LATENCY AVG(ms)", "P50(ms)", "P99(ms)", "ERRORS")
+    for metric, old, new in zip(metrics, values(previous), values(current)):
+        change = ""
+        if old and new is not None:
+            change = "%+.1f%%" % ((new - old) / old * 100)
+        table.append((metric, old, new, change))
+
+    print('')
+    print(tabulate(table, headers=header, floatfmt=".2f"))
+    print('')
+
+def watch_command(args, other_argv=None):
+    if not os.path.isfile(args.config_file):
+        logger.error(f"config file [{args.config_file}] does not exist")
+        sys.exit(-1)
+
+    try:
+        context = _load_watch_context(args)
+    except Exception as e:
+        logger.error(f"load config failed: {e}")
+        sys.exit(-1)
+
+    watch_all = not args.name
+    names = args.name or [api_config.name for api_config in context.api_config_list]
+    for name in names:
+        if name not in context.api_config_map:
+            print(f"not found api [{name}]")
+            sys.exit(1)
+
+    def snapshot(ctx):
+        return _watch_snapshot(ctx, names)
+
+    def run_apis(ctx, api_names):
+        wrk_config = attr.evolve(ctx.wrk_config, duration=args.duration)
+        for name in api_names:
+            api_config = ctx.api_config_map[name]
+            logger.info("benchmark api [%s]...", name)
+            try:
+                result = run_benchmark(
+                    ctx, api_config, wrk_config=wrk_config, tag=args.tag,
+                    wrk_args=other_argv, echo=True
+                )
+                _print_benchmark_result(result)
+            except Exception as e:
+                logger.error(f"benchmark api [{name}] failed: {e}")
+                continue
+
+            with HistoryStore(ctx.get_history_file()) as store:
+                runs = store.query_runs(name, tag=args.tag, limit=2)
+            if runs:
+                _print_result_diff(runs[1] if len(runs) > 1 else None, runs[0])
+
+    watcher = create_watcher(args.polling, args.interval)
+    config_files, api_files = _get_watch_files(args, context, names)
+    watcher.set_paths(config_files.union(*api_files.values()))
+    hashes = snapshot(context)
+
+    if args.initial:
+        run_apis(context, names)
+
+    logger.info("watching %d files, press Ctrl+C to stop", len(watcher.files))
+    try:
+        while True:
+            changed = wait_changes(watcher)
+            for p in sorted(changed):
+                logger.info("changed: %s", p)
+
+            affected = set()
+            if changed & config_files:
+                try:
+                    new_context = _load_watch_context(args)
+                except Exception as e:
+                    logger.error(f"reload config failed: {e}")
+                    continue
+
+                if watch_all:
+                    names = [api_config.name for api_config in new_context.api_config_list]
+                new_hashes = snapshot(new_context)
+                affected.update(
+                    name for name, h in new_hashes.items() if hashes.get(name) != h
+                )
+                context, hashes = new_context, new_hashes
+
+            for name, files in api_files.items():
+                if changed & files:
+                    affected.add(name)
+
+            config_files, api_files = _get_watch_files(
+                args, context, [name for name in names if name in context.api_config_map]
+            )
+            watcher.set_paths(config_files.union(*api_files.values()))
+
+            if not affected:
+                logger.info("no api affected")
+                continue
+
+            run_apis(context, [name for name in names if name in affected])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
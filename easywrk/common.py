@@ -1,10 +1,12 @@
 #coding:utf8
 
 import os
-import sys
 import attr
 import logging
+import json
 import base64
+import hashlib
+import operator
 
 from pathlib import Path
 from requests import Request
@@ -12,9 +14,15 @@ from dotenv import load_dotenv
 from jinja2 import Environment, FileSystemLoader
 import requests
 
-from typing import List, Dict, Tuple, Any, IO
+from typing import List, Dict, Tuple, Any, IO, Iterable, Iterator, Optional
 import cattr
 
+try:
+    from cattr.errors import BaseValidationError as StructureError
+except ImportError:
+    # cattrs 1.x 直接抛出校验时的异常
+    StructureError = ValueError
+
 from .validates import validate_name
 
 
@@ -32,13 +40,46 @@ VALUE_TYPE_MAP = {
     'float': float
 }
 
+# replay 命令保存结果使用的 api 名字前缀
+REPLAY_NAME_PREFIX = 'replay-'
+
+
+class EasyWrkException(Exception):
+    def __init__(self, msg:str):
+        super().__init__(msg)
+
+class ConfigException(EasyWrkException):
+    """
+    Config file, env or api config is invalid.
+    """
+
+
+def _validate_config_name(instance, attribute, value):
+    # api 和 group 的名字会用作目录名
+    if not value:
+        raise ValueError("field name must exist")
+
+    if not validate_name(value):
+        raise ValueError(f"value [{value}] is illegal")
+
 @attr.s
 class WrkConfig(object):
     threads= attr.ib(type=int, default=20)
     thread_connections= attr.ib(type=int, default=30)
     latency=attr.ib(type=bool, default=False)
+    # 为 auto 时按窗口收集吞吐和 p99，二者都稳定后停止压测
     duration = attr.ib(type=str, default="10s")
 
+    # 以下只在 duration 为 auto 时使用
+    min_duration = attr.ib(type=str, default="10s")
+    max_duration = attr.ib(type=str, default="5m")
+    # 采样窗口，wrk 引擎按窗口长度分段运行
+    window = attr.ib(type=str, default="5s")
+    # 最近 converge_windows 个窗口的均值置信区间半宽不超过均值的 tolerance 时认为稳定
+    converge_windows = attr.ib(type=int, default=5)
+    tolerance = attr.ib(type=float, default=0.05)
+    confidence = attr.ib(type=float, default=0.95)
+
 
 @attr.s
 class ApiField(object):
@@ -49,19 +90,79 @@ class ApiField(object):
     encode = attr.ib(type=str, default="")
 
 @attr.s
-class ApiConfig(object):
+class RateStage(object):
+    # constant: 固定 rate
+    # ramp: 从 rate 线性变化到 target
+    # spike: 基础 rate, 从 spike_at 开始的 spike_duration 内是 target
+    # diurnal: 按 period 周期在 rate 和 target 之间正弦变化
+    type = attr.ib(type=str, default="constant")
+    duration = attr.ib(type=str, default="10s")
+    # 每秒请求数
+    rate = attr.ib(type=float, default=0.0)
+    target = attr.ib(type=float, default=0.0)
+    period = attr.ib(type=str, default="")
+    spike_at = attr.ib(type=str, default="0s")
+    spike_duration = attr.ib(type=str, default="1s")
+
+
+@attr.s
+class ArrivalConfig(object):
+    # 到达过程，支持 poisson, fixed, bursty
+    process = attr.ib(type=str, default="poisson")
+    # 没有 stages 时的固定每秒请求数
+    rate = attr.ib(type=float, default=0.0)
+    # 为空时使用 wrk 的 duration
+    duration = attr.ib(type=str, default="")
+    # bursty 的发送和静默时长，发送期间按 rate * (on + off) / on 发送
+    on = attr.ib(type=str, default="1s")
+    off = attr.ib(type=str, default="1s")
+    # 最大并发连接数，0 表示 threads * thread_connections
+    max_connections = attr.ib(type=int, default=0)
+    # 随机数种子，0 表示不固定
+    seed = attr.ib(type=int, default=0)
+    stages = attr.ib(type=List[RateStage], factory=list)
+
+
+@attr.s
+class GroupConfig(object):
     name = attr.ib(
         type=str,
-        validator= attr.validators.instance_of(str)
+        validator= [attr.validators.instance_of(str), _validate_config_name]
     )
 
-    @name.validator
-    def validate_name(self, attribute, value):
-        if not value :
-            raise ValueError(f"field name must exist")
+    desc = attr.ib(type=str, default="")
+    # 组内 api 的服务地址，为空时使用 BASE_URL
+    base_url = attr.ib(type=str, default="")
+    # run-all 时每个 api 占用的 CPU 数，0 表示按引擎自动计算
+    cpus = attr.ib(type=int, default=0)
+
+
+@attr.s
+class ConnectConfig(object):
+    # tcp: 只建立 TCP 连接
+    # tls: 建立连接并完成 TLS 握手
+    # request: 在新连接上发送第一个请求并读取响应
+    mode = attr.ib(type=str, default="request")
+    # TLS session 复用: off 不复用, on 总是复用, both 交替进行完整握手和复用握手
+    resumption = attr.ib(type=str, default="both")
+    tls_verify = attr.ib(type=bool, default=True)
+    # 校验服务端证书用的 CA 文件，相对配置文件目录，用于自签名证书
+    ca_file = attr.ib(type=str, default="")
+    # TLS SNI 和证书校验使用的域名，为空时使用 BASE_URL 里的域名
+    server_name = attr.ib(type=str, default="")
+    # 并发建立连接数，0 表示 threads * thread_connections
+    connections = attr.ib(type=int, default=0)
+    # 为空时使用 wrk 的 duration
+    duration = attr.ib(type=str, default="")
+    timeout = attr.ib(type=float, default=10.0)
+
 
-        if not validate_name(value):
-            raise ValueError(f"value [{value}] is illegal")
+@attr.s
+class ApiConfig(object):
+    name = attr.ib(
+        type=str,
+        validator= [attr.validators.instance_of(str), _validate_config_name]
+    )
 
     desc = attr.ib(type=str, default="")
 
@@ -85,6 +186,25 @@ class ApiConfig(object):
     # 表示是要上传文件
     fields = attr.ib(type=List[ApiField], default=[])
 
+    # 导出压测结果时附加的 label
+    labels = attr.ib(type=Dict[str, str], factory=dict)
+
+    # 所属的组，使用组的 base_url 和 cpus
+    group = attr.ib(type=str, default="")
+    # 服务地址，为空时使用组的 base_url 或者 BASE_URL
+    base_url = attr.ib(type=str, default="")
+    # run-all 时占用的 CPU 数，0 表示使用组的配置
+    cpus = attr.ib(type=int, default=0)
+
+    # 开放模型的请求到达配置，设置后使用内置引擎按计划时间发送请求
+    arrival = attr.ib(type=Optional[ArrivalConfig], default=None)
+
+    # 建连压测配置，设置后每个请求都使用新连接，测量建连和 TLS 握手耗时
+    connect = attr.ib(type=Optional[ConnectConfig], default=None)
+
+    # json body 预编译结果，参见 get_json_plan
+    json_plan = attr.ib(default=None, init=False, repr=False, eq=False)
+
 
 def load_env_file(fpath):
     load_dotenv(fpath)
@@ -106,6 +226,9 @@ def make_wrkconfig(config) -> WrkConfig:
 def make_apiconfigs(config) -> List[ApiConfig]:
     return cattr.structure(config['apis'], List[ApiConfig])
 
+def make_groupconfigs(config) -> List[GroupConfig]:
+    return cattr.structure(config.get('groups', []), List[GroupConfig])
+
 
 @attr.s
 class EasyWrkContext(object):
@@ -114,6 +237,44 @@ class EasyWrkContext(object):
     wrk_config = attr.ib(type=WrkConfig)
     api_config_list = attr.ib(type=List[ApiConfig])
     api_config_map = attr.ib(type=Dict[str, ApiConfig])
+    group_config_map = attr.ib(type=Dict[str, GroupConfig], factory=dict)
+
+    def get_group(self, api_config) -> Optional[GroupConfig]:
+        return self.group_config_map.get(api_config.group, None)
+
+    def get_base_url(self, api_config) -> str:
+        """
+        Base url of the api, from the api, its group or BASE_URL in order.
+        """
+        if api_config.base_url:
+            return api_config.base_url
+
+        group = self.get_group(api_config)
+        if group is not None and group.base_url:
+            return group.base_url
+
+        return self.base_url
+
+    def get_history_file(self) -> Path:
+        benchmark_dir = self.config_file_dir.joinpath('benchmark')
+        if not benchmark_dir.is_dir():
+            benchmark_dir.mkdir(exist_ok=True, parents=True)
+
+        return benchmark_dir.joinpath('history.db')
+
+    def has_result_name(self, name) -> bool:
+        """
+        Whether `name` has benchmark results: an api, or `replay-<corpus>`
+        saved by the replay command.
+        """
+        if name in self.api_config_map:
+            return True
+        if name.startswith(REPLAY_NAME_PREFIX):
+            return self.config_file_dir.joinpath('benchmark', name).is_dir()
+        return False
+
+    def get_corpus_dir(self, name) -> Path:
+        return self.config_file_dir.joinpath('benchmark', 'corpus', name)
 
     def get_api_dir(self, api_name) -> Path:
         api_dir = self.config_file_dir.joinpath('benchmark', api_name)
@@ -123,9 +284,39 @@ class EasyWrkContext(object):
         return api_dir
 
 
+# 这些字段不影响压测结果
+CONFIG_HASH_EXCLUDE_FIELDS = ('desc', 'labels', 'json_plan', 'group', 'cpus')
+
+# duration 不是 auto 时这些字段不起作用
+AUTO_DURATION_FIELDS = (
+    'min_duration', 'max_duration', 'window', 'converge_windows', 'tolerance', 'confidence'
+)
+
+def hash_config_data(data) -> str:
+    text = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+def make_config_hash(wrk_config:WrkConfig, api_config:ApiConfig) -> str:
+    auto = wrk_config.duration.strip().lower() == "auto"
+    return hash_config_data({
+        'wrk': attr.asdict(
+            wrk_config,
+            filter=lambda a, v: auto or a.name not in AUTO_DURATION_FIELDS
+        ),
+        'api': attr.asdict(
+            api_config,
+            filter=lambda a, v: a.name not in CONFIG_HASH_EXCLUDE_FIELDS
+        ),
+    })
+
+
 def create_easywrk_context(base_url:str, config_file_dir:Path, config):
-    wrk_config = make_wrkconfig(config)
-    api_config_list = make_apiconfigs(config)
+    try:
+        wrk_config = make_wrkconfig(config)
+        api_config_list = make_apiconfigs(config)
+        group_config_list = make_groupconfigs(config)
+    except (StructureError, ValueError, TypeError, KeyError) as e:
+        raise ConfigException(f"invalid config: {e}") from e
 
     api_config_map = {}
     for api in api_config_list:
@@ -134,12 +325,24 @@ def create_easywrk_context(base_url:str, config_file_dir:Path, config):
 
         api_config_map[api.name] = api
 
+    group_config_map = {}
+    for group in group_config_list:
+        if group.name in group_config_map:
+            logger.warning(f"group [{group.name}] is repeat, please check config file")
+
+        group_config_map[group.name] = group
+
+    for api in api_config_list:
+        if api.group and api.group not in group_config_map:
+            raise ConfigException(f"group [{api.group}] of api [{api.name}] is not defined")
+
     return EasyWrkContext(
         base_url = base_url,
         config_file_dir = config_file_dir,
         wrk_config = wrk_config, 
         api_config_list = api_config_list, 
-        api_config_map = api_config_map
+        api_config_map = api_config_map,
+        group_config_map = group_config_map
         )
 
 
@@ -184,7 +387,13 @@ def join_url_path(base_url:str, path:str):
     return "".join(l)
 
 def build_request(context: EasyWrkContext , api_config: ApiConfig):
-    url = join_url_path(context.base_url, api_config.path)
+    base_url = context.get_base_url(api_config)
+    if not base_url:
+        raise BuildRequestException(
+            f"not define base url of api [{api_config.name}], set environ [BASE_URL] or base_url in config"
+        )
+
+    url = join_url_path(base_url, api_config.path)
     req_builder = RequestBuilder(
         url = url, 
         method = api_config.method,
@@ -225,6 +434,13 @@ def _get_file_path(config_file_dir:Path, value:str):
 
     return p
 
+def _file_state(fpath:Path) -> Optional[Tuple[int, int]]:
+    try:
+        st = fpath.stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
 def _is_file_field(value:str):
     if value.startswith("@@"):
         return False
@@ -242,7 +458,7 @@ def _encode_file_data(config_file_dir:Path, value:str, encode:str):
 
         encode_func = BYTES_ENCODE_MAP.get(encode)
 
-    p = _get_file_path(config_file_dir, value)
+    p = _get_file_path(config_file_dir, p)
 
     if encode_func is None:
         with p.open("r") as f:
@@ -256,8 +472,7 @@ def build_forms(config_file_dir:Path, req_builder: RequestBuilder, api_config:Ap
     data = []
     files = []
     if not api_config.fields:
-        print("not found any form field")
-        sys.exit(1)
+        raise BuildRequestException("not found any form field")
 
     for field in api_config.fields:
         if not _is_file_field(field.value):
@@ -272,58 +487,150 @@ def build_forms(config_file_dir:Path, req_builder: RequestBuilder, api_config:Ap
 
     return req_builder
 
-def build_json(config_file_dir:Path, req_builder: RequestBuilder, api_config: ApiConfig):
-    data = {}
+def _split_field_path(name:str) -> List[str]:
+    if name.startswith('/'):
+        raise BuildRequestException(f"field [{name}] cannot start with [/]")
 
-    finish_fields = []
+    path = name
+    if path.endswith('/'):
+        path = path[0:-1]
 
-    if not api_config.fields:
-        print("not found any json field")
-        sys.exit(1)
-
-    for field in api_config.fields:
+    items = path.split('/')
+    for item in items:
+        if len(item) == 0:
+            raise BuildRequestException(f"field [{name}] has empty path item")
 
-        name:str = field.name
+    return items
 
-        if name.startswith('/'):
-            raise BuildRequestException(f"field [{field.name}] cannot start with [/]")
+def _make_field_convert(config_file_dir:Path, field:ApiField):
+    if field.encode and field.encode not in BYTES_ENCODE_MAP:
+        raise BuildRequestException(f"not support encode value [{field.encode}]")
 
-        if name.endswith('/'):
-            name = name[0:-1]
+    convert = VALUE_TYPE_MAP.get(field.type)
+    if convert is None:
+        raise BuildRequestException(f"not found type convert for field [{field.name}]")
 
-        if name in finish_fields:
-            raise BuildRequestException(f"field [{field.name}] already in json data")
-
-        value = field.value
+    encode = field.encode
+    def _convert(value):
         if _is_file_field(value):
-            value = _encode_file_data(config_file_dir, value, field.encode)
-        else:
-            convert = VALUE_TYPE_MAP.get(field.type)
-            if convert is None:
-                raise BuildRequestException(f"not found type convert for field [{field.name}]")
-
-            value = convert(value)
-
-        if not '/' in name:
-            data[field.name] = value
-        else:
-            name_list = name.split('/')
-            current = data
-            last_idx = len(name_list) - 1
-            for idx, item in enumerate(name_list):
-                if idx == last_idx:
-                    current[item] = value
-                    break
-
-                v = current.get(item)
-                if v is None:
-                    v = {}
-                    current[item] = v
+            return _encode_file_data(config_file_dir, value, encode)
+        return convert(value)
+
+    return _convert
+
+def _is_list_index(key:str):
+    return key.isdigit() and str(int(key)) == key
+
+def _compile_json_node(node, path:str):
+    # 叶子节点是 slot 下标
+    if isinstance(node, int):
+        return operator.itemgetter(node)
+
+    keys = list(node.keys())
+    # 非根节点下全部是数字下标的，生成数组
+    if path and all(_is_list_index(k) for k in keys):
+        indexes = sorted(int(k) for k in keys)
+        if indexes != list(range(len(indexes))):
+            raise BuildRequestException(f"array field [{path}] index must be continuous and start with 0")
+
+        item_funcs = [
+            _compile_json_node(node[str(i)], f"{path}/{i}") for i in indexes
+        ]
+        return lambda slots: [f(slots) for f in item_funcs]
+
+    child_funcs = [
+        (k, _compile_json_node(node[k], f"{path}/{k}" if path else k)) for k in keys
+    ]
+    return lambda slots: {k: f(slots) for k, f in child_funcs}
+
+
+class JsonBodyPlan(object):
+    """
+    A json body layout compiled from the fields of an api config.
+
+    Field paths are split, checked and resolved to slots only once, the
+    type converters are bound per slot, so `build` only has to fill the
+    slots and assemble a new body. Files of `@file` fields are read here
+    too, `is_stale` tells whether any of them changed since.
+    """
+
+    def __init__(self, config_file_dir:Path, fields:List[ApiField]):
+        self.config_file_dir = config_file_dir
+        self.slot_map: Dict[str, int] = {}
+        self.converts = []
+        self.defaults = []
+        # 文件字段读取的文件 -> 读取前的 (mtime, size)
+        self.files: Dict[Path, Tuple[int, int]] = {}
+
+        root: Dict[str, Any] = {}
+        for idx, field in enumerate(fields):
+            items = _split_field_path(field.name)
+            path = '/'.join(items)
+            if path in self.slot_map:
+                raise BuildRequestException(f"field [{field.name}] already in json data")
+
+            current = root
+            for item in items[:-1]:
+                v = current.setdefault(item, {})
+                if not isinstance(v, dict):
+                    raise BuildRequestException(f"field [{field.name}] conflict with other field")
                 current = v
 
-        finish_fields.append(name)
+            if items[-1] in current:
+                raise BuildRequestException(f"field [{field.name}] conflict with other field")
+            current[items[-1]] = idx
+
+            convert = _make_field_convert(config_file_dir, field)
+            if _is_file_field(field.value):
+                fpath = _get_file_path(config_file_dir, field.value[1:])
+                # 先记录状态再读取，读取期间的修改下次也能发现
+                self.files[fpath] = _file_state(fpath)
+            self.slot_map[path] = idx
+            self.slot_map[field.name] = idx
+            self.converts.append(convert)
+            self.defaults.append(convert(field.value))
+
+        self._build_func = _compile_json_node(root, "")
+
+    def is_stale(self) -> bool:
+        return any(_file_state(fpath) != state for fpath, state in self.files.items())
 
-    req_builder.json = data
+    def build(self, values:Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Build a json body, `values` maps field name to raw (unconverted)
+        value and overrides the value from config.
+        """
+        if not values:
+            return self._build_func(self.defaults)
+
+        slots = list(self.defaults)
+        for name, value in values.items():
+            idx = self.slot_map.get(name)
+            if idx is None:
+                raise BuildRequestException(f"field [{name}] not found in json data")
+            slots[idx] = self.converts[idx](value)
+
+        return self._build_func(slots)
+
+    def build_many(self, value_list:Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        for values in value_list:
+            yield self.build(values)
+
+
+def get_json_plan(config_file_dir:Path, api_config: ApiConfig) -> JsonBodyPlan:
+    plan = api_config.json_plan
+    if plan is None or plan.config_file_dir != config_file_dir or plan.is_stale():
+        plan = JsonBodyPlan(config_file_dir, api_config.fields)
+        api_config.json_plan = plan
+
+    return plan
+
+def build_json(config_file_dir:Path, req_builder: RequestBuilder, api_config: ApiConfig):
+    if not api_config.fields:
+        raise BuildRequestException("not found any json field")
+
+    plan = get_json_plan(config_file_dir, api_config)
+    req_builder.json = plan.build()
     return req_builder
 
 def render_file(config_file_dir:Path, req_builder: RequestBuilder, api_config: ApiConfig, fpath:str):
@@ -358,7 +665,7 @@ def build_body(config_file_dir:Path, req_builder: RequestBuilder, api_config: Ap
         if body == ":form":
             return build_forms(config_file_dir, req_builder, api_config)
 
-        if body == ':render:':
+        if body.startswith(':render:'):
             b = body[8:]
             return render_file(config_file_dir, req_builder, api_config, b)
 
@@ -366,3 +673,25 @@ def build_body(config_file_dir:Path, req_builder: RequestBuilder, api_config: Ap
 
     req_builder.data = body.encode("utf-8")
     return req_builder
+
+def get_api_files(config_file_dir:Path, api_config: ApiConfig) -> List[Path]:
+    """
+    Files read when building the request of the api.
+    """
+    body = api_config.body
+    if body is None or len(body) == 0:
+        return []
+
+    if _is_file_field(body):
+        return [_get_file_path(config_file_dir, body[1:])]
+
+    if body.startswith(':render:'):
+        return [_get_file_path(config_file_dir, body[8:])]
+
+    if body in (':json', ':form'):
+        return [
+            _get_file_path(config_file_dir, field.value[1:])
+            for field in api_config.fields if _is_file_field(field.value)
+        ]
+
+    return []
@@ -0,0 +1,269 @@
+# coding:utf8
+
+import ssl
+import math
+import time
+import socket
+import logging
+import http.client
+
+from array import array
+from typing import Dict, Optional
+
+from .result import BenchmarkResult
+from .engine import BuiltinEngine, EngineRecorder, EngineRun, EngineRequest, percentile
+from .engine import STATUS_CONNECT_ERROR, STATUS_READ_ERROR, STATUS_TIMEOUT, ERROR_STATUS_MAP
+
+logger = logging.getLogger(__name__)
+
+CONNECT_MODES = ('tcp', 'tls', 'request')
+RESUMPTION_MODES = ('off', 'on', 'both')
+
+STATUS_TLS_ERROR = -4
+
+CONNECT_ERROR_STATUS_MAP = dict(ERROR_STATUS_MAP)
+CONNECT_ERROR_STATUS_MAP[STATUS_TLS_ERROR] = 'tls'
+
+# 每次建连的 TLS 会话情况
+SESSION_NONE = -1       # 不是 TLS 连接或者握手没有完成
+SESSION_FULL = 0        # 完整握手
+SESSION_RESUMED = 1     # 复用成功
+SESSION_REJECTED = 2    # 尝试复用但服务端做了完整握手
+
+
+class ConnectException(Exception):
+    def __init__(self, msg:str):
+        super().__init__(msg)
+
+
+class ConnectRecorder(EngineRecorder):
+    """
+    Engine records plus the time spent in each phase of a new connection.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # 各阶段耗时，没有到达该阶段时是 NaN
+        self.tcp_connect = array('d')
+        self.tls_handshake = array('d')
+        self.first_request = array('d')
+        self.sessions = array('b')
+
+    def add_phases(self, tcp_connect:float, tls_handshake:float, first_request:float, session:int):
+        self.tcp_connect.append(tcp_connect)
+        self.tls_handshake.append(tls_handshake)
+        self.first_request.append(first_request)
+        self.sessions.append(session)
+
+    def extend(self, other:'ConnectRecorder'):
+        super().extend(other)
+        self.tcp_connect.extend(other.tcp_connect)
+        self.tls_handshake.extend(other.tls_handshake)
+        self.first_request.extend(other.first_request)
+        self.sessions.extend(other.sessions)
+
+
+def _phase_stats(values) -> Dict[str, float]:
+    values = sorted(v for v in values if not math.isnan(v))
+    if not values:
+        return {}
+
+    return {
+        'count': len(values),
+        'avg': sum(values) / len(values),
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': values[-1],
+    }
+
+
+class ConnectRun(EngineRun):
+    def errors(self) -> Dict[str, int]:
+        errors = {'connect': 0, 'tls': 0, 'read': 0, 'write': 0, 'timeout': 0, 'status': 0}
+        for status in self.recorder.statuses:
+            if status < 0:
+                errors[CONNECT_ERROR_STATUS_MAP[status]] += 1
+            elif status >= 400:
+                errors['status'] += 1
+        return errors
+
+    def phase_stats(self) -> Dict[str, Dict[str, float]]:
+        rec = self.recorder
+        full = []
+        resumed = []
+        for handshake, session in zip(rec.tls_handshake, rec.sessions):
+            if session == SESSION_RESUMED:
+                resumed.append(handshake)
+            elif session != SESSION_NONE:
+                full.append(handshake)
+
+        stats = {
+            'tcp_connect': _phase_stats(rec.tcp_connect),
+            'tls_handshake_full': _phase_stats(full),
+            'tls_handshake_resumed': _phase_stats(resumed),
+            'first_request': _phase_stats(rec.first_request),
+        }
+        return {k: v for k, v in stats.items() if v}
+
+    def to_result(self, api_name:str) -> BenchmarkResult:
+        """
+        `requests` counts new connections and the latency is the total time
+        of connect, handshake and first request.
+        """
+        result = super().to_result(api_name)
+        result.engine = "connect"
+
+        sessions = self.recorder.sessions
+        resumed = sessions.count(SESSION_RESUMED)
+        tried = resumed + sessions.count(SESSION_REJECTED)
+
+        result.extra['connect'] = {
+            'phases': self.phase_stats(),
+            'resumption_tried': tried,
+            'resumption_ratio': resumed / tried if tried else 0.0,
+        }
+        return result
+
+
+class ConnectEngine(BuiltinEngine):
+    """
+    Open a new connection for every request and measure tcp connect,
+    TLS handshake and first request latency separately.
+    """
+
+    recorder_class = ConnectRecorder
+    run_class = ConnectRun
+
+    def __init__(self, base_url:str, connections:int = 10,
+            timeout:float = 10.0, tls_verify:bool = True, ca_file:Optional[str] = None,
+            mode:str = "request", resumption:str = "both", server_name:str = ""):
+        if mode not in CONNECT_MODES:
+            raise ConnectException(f"not support connect mode [{mode}]")
+        if resumption not in RESUMPTION_MODES:
+            raise ConnectException(f"not support resumption mode [{resumption}]")
+
+        super().__init__(base_url, connections, timeout, tls_verify, ca_file)
+
+        if mode == 'tls' and self.ssl_context is None:
+            raise ConnectException(f"connect mode [tls] needs a https url, got [{base_url}]")
+
+        self.mode = mode
+        # tcp 模式不做 TLS 握手
+        self.tls = self.ssl_context is not None and mode != 'tcp'
+        self.resumption = resumption
+        self.server_name = server_name or self.host
+        if self.port is None:
+            self.port = 443 if self.scheme == 'https' else 80
+
+    def _open(self, session:Optional[ssl.SSLSession]):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        if not self.tls:
+            return sock
+        try:
+            return self.ssl_context.wrap_socket(sock, server_hostname=self.server_name, session=session)
+        except Exception:
+            sock.close()
+            raise
+
+    def _first_request(self, sock, req:EngineRequest):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        conn.sock = sock
+        try:
+            return self._send(conn, req)
+        finally:
+            conn.close()
+
+    def _prime_session(self, req:EngineRequest) -> Optional[ssl.SSLSession]:
+        # TLS 1.3 的 session ticket 在握手后才发送，需要读一次响应才能拿到
+        try:
+            sock = self._open(None)
+        except OSError as e:
+            logger.debug(f"get tls session failed: {e}")
+            return None
+
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        conn.sock = sock
+        try:
+            conn.request(req.method, self.base_path + req.url, body=req.body, headers=req.headers)
+            resp = conn.getresponse()
+            # 连接关闭后拿不到 session
+            session = sock.session
+            resp.read()
+        except (OSError, http.client.HTTPException) as e:
+            logger.debug(f"get tls session failed: {e}")
+            return None
+        finally:
+            conn.close()
+            sock.close()
+        return session
+
+    def _use_session(self, count:int) -> bool:
+        if not self.tls or self.resumption == 'off':
+            return False
+        if self.resumption == 'on':
+            return True
+        return count % 2 == 1
+
+    def _worker(self, next_request, start:float, deadline:Optional[float], rec:ConnectRecorder):
+        session = None
+        count = 0
+        while not self._stop.is_set():
+            req = next_request()
+            if req is None:
+                break
+
+            resume = self._use_session(count)
+            count += 1
+            if resume and session is None:
+                session = self._prime_session(req)
+
+            send = time.perf_counter()
+            if deadline is not None and send >= deadline:
+                break
+
+            status = 0
+            size = 0
+            tcp_connect = tls_handshake = first_request = math.nan
+            session_state = SESSION_NONE
+            phase = STATUS_CONNECT_ERROR
+            sock = None
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+                t = time.perf_counter()
+                tcp_connect = t - send
+
+                if self.tls:
+                    phase = STATUS_TLS_ERROR
+                    sock = self.ssl_context.wrap_socket(
+                        sock, server_hostname=self.server_name,
+                        session=session if resume else None
+                    )
+                    now = time.perf_counter()
+                    tls_handshake = now - t
+                    t = now
+                    if sock.session_reused:
+                        session_state = SESSION_RESUMED
+                    else:
+                        session_state = SESSION_REJECTED if resume else SESSION_FULL
+
+                if self.mode == 'request':
+                    phase = STATUS_READ_ERROR
+                    status, size = self._first_request(sock, req)
+                    first_request = time.perf_counter() - t
+            except socket.timeout:
+                status = STATUS_TIMEOUT
+            except (OSError, http.client.HTTPException):
+                # 按出错的阶段分类，握手完成之后的 SSLError 算作读写错误
+                status = phase
+            finally:
+                if sock is not None:
+                    sock.close()
+
+            latency = time.perf_counter() - send
+            rec.add(send - start, latency, status, size, None)
+            rec.add_phases(tcp_connect, tls_handshake, first_request, session_state)
+
+            # 服务端拒绝复用时下次重新获取 session
+            if session_state == SESSION_REJECTED:
+                session = None
@@ -0,0 +1,222 @@
+# coding:utf8
+
+import math
+import logging
+
+from typing import List, Dict, Tuple, Optional
+
+from .common import WrkConfig
+from .engine import EngineRecorder, parse_duration, percentile, snapshot_counts
+
+logger = logging.getLogger(__name__)
+
+AUTO_DURATION = "auto"
+
+# 双侧置信度对应的标准正态分位数
+NORMAL_QUANTILES = {
+    0.8: 1.2816,
+    0.9: 1.6449,
+    0.95: 1.9600,
+    0.98: 2.3263,
+    0.99: 2.5758,
+}
+
+STOP_CONVERGED = "converged"
+STOP_MAX_DURATION = "max_duration"
+
+
+def is_auto_duration(duration:str) -> bool:
+    return duration.strip().lower() == AUTO_DURATION
+
+def t_quantile(confidence:float, df:int) -> float:
+    """
+    Two sided student t quantile, by the Cornish-Fisher expansion of the
+    normal quantile, close enough for confidence intervals with df >= 2.
+    """
+    z = NORMAL_QUANTILES[confidence]
+    if df <= 0:
+        return math.inf
+    return (
+        z
+        + (z ** 3 + z) / (4 * df)
+        + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+        + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3)
+    )
+
+def relative_ci(values:List[float], confidence:float) -> Tuple[float, float]:
+    """
+    (mean, half width of the confidence interval of the mean / mean).
+    """
+    n = len(values)
+    mean = sum(values) / n
+    if n < 2:
+        return mean, math.inf
+
+    stdev = math.sqrt(sum((v - mean) ** 2 for v in values) / (n - 1))
+    half = t_quantile(confidence, n - 1) * stdev / math.sqrt(n)
+    if mean == 0:
+        return mean, 0.0 if half == 0 else math.inf
+    return mean, half / abs(mean)
+
+
+class ConvergenceMonitor(object):
+    """
+    Collect throughput and p99 per window and decide when both are stable.
+    The first window is treated as warm up and never used.
+    """
+
+    def __init__(self, min_duration:float, max_duration:float, window:float,
+            windows:int = 5, tolerance:float = 0.05, confidence:float = 0.95):
+        if confidence not in NORMAL_QUANTILES:
+            raise ValueError(
+                f"confidence must be one of {', '.join(str(c) for c in NORMAL_QUANTILES)}"
+            )
+        if window <= 0 or windows < 2:
+            raise ValueError("window must be positive and converge_windows at least 2")
+        if max_duration < min_duration:
+            raise ValueError("max_duration must not be less than min_duration")
+
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.window = window
+        self.windows = windows
+        self.tolerance = tolerance
+        self.confidence = confidence
+
+        # (窗口结束时间, 每秒请求数, p99)
+        self.samples: List[Tuple[float, float, Optional[float]]] = []
+        # 有窗口没有 p99 时不算收敛，只提示一次
+        self.p99_missing = False
+        self.stop_reason = ""
+        self.stop_time = 0.0
+
+    @classmethod
+    def from_config(cls, wrk_config:WrkConfig) -> 'ConvergenceMonitor':
+        return cls(
+            parse_duration(wrk_config.min_duration),
+            parse_duration(wrk_config.max_duration),
+            parse_duration(wrk_config.window),
+            wrk_config.converge_windows,
+            wrk_config.tolerance,
+            wrk_config.confidence,
+        )
+
+    def add_window(self, t:float, requests_per_sec:float, p99:Optional[float]):
+        if p99 is None and not self.p99_missing:
+            logger.warning(
+                "window at %.1fs has no p99, not converged while recent windows miss it", t
+            )
+        self.p99_missing = self.p99_missing or p99 is None
+        self.samples.append((t, requests_per_sec, p99))
+
+    def _recent(self):
+        # 跳过第一个预热窗口
+        recent = self.samples[1:][-self.windows:]
+        if len(recent) < self.windows:
+            return None
+        return recent
+
+    def intervals(self) -> Dict[str, Tuple[float, float]]:
+        """
+        {metric: (mean, relative ci)} over the recent windows.
+        """
+        recent = self._recent()
+        if recent is None:
+            return {}
+
+        intervals = {'requests_per_sec': relative_ci([s[1] for s in recent], self.confidence)}
+        p99s = [s[2] for s in recent if s[2] is not None]
+        if len(p99s) == len(recent):
+            intervals['p99'] = relative_ci(p99s, self.confidence)
+        return intervals
+
+    def converged(self) -> bool:
+        intervals = self.intervals()
+        if not intervals:
+            return False
+        # 目标卡住时窗口没有完成的请求，吞吐稳定在 0 不算收敛
+        if any(rps <= 0 or p99 is None for _, rps, p99 in self._recent()):
+            return False
+        return all(ci <= self.tolerance for _, ci in intervals.values())
+
+    def check(self, elapsed:float) -> bool:
+        """
+        Whether the run should stop at `elapsed` seconds.
+        """
+        if self.stop_reason:
+            return True
+
+        if elapsed >= self.min_duration and self.converged():
+            self.stop_reason = STOP_CONVERGED
+        elif elapsed >= self.max_duration:
+            self.stop_reason = STOP_MAX_DURATION
+        else:
+            return False
+
+        self.stop_time = elapsed
+        logger.info("stop after %.1fs: %s", elapsed, self.stop_reason)
+        return True
+
+    def stats(self) -> Dict:
+        intervals = self.intervals()
+        info = {
+            'converged': self.stop_reason == STOP_CONVERGED,
+            'stop_reason': self.stop_reason,
+            'stop_time': self.stop_time,
+            'window': self.window,
+            'windows': len(self.samples),
+            'p99_checked': 'p99' in intervals,
+            'converge_windows': self.windows,
+            'tolerance': self.tolerance,
+            'confidence': self.confidence,
+            'min_duration': self.min_duration,
+            'max_duration': self.max_duration,
+        }
+        for name, (mean, ci) in intervals.items():
+            info[f'{name}_mean'] = mean
+            info[f'{name}_ci'] = ci if math.isfinite(ci) else None
+        return info
+
+
+class RecorderWindows(object):
+    """
+    Feed windows of the built-in engine recorders into a monitor while
+    the engine runs, only new records are read on every check.
+    """
+
+    def __init__(self, monitor:ConvergenceMonitor):
+        self.monitor = monitor
+        self.offsets: Dict[int, int] = {}
+        # 窗口序号 -> 这个窗口内完成的请求延迟
+        self.pending: Dict[int, List[float]] = {}
+        self.next_window = 0
+
+    def __call__(self, elapsed:float, recorders:List[EngineRecorder],
+            counts:Optional[List[int]] = None) -> bool:
+        """
+        Read the first `counts` records of every recorder, all complete
+        records when None.
+        """
+        window = self.monitor.window
+        if counts is None:
+            counts = snapshot_counts(recorders)
+        for i, (rec, end) in enumerate(zip(recorders, counts)):
+            # offsets 是包括已经删除的记录在内的位置
+            start = max(self.offsets.get(i, 0) - rec.dropped, 0)
+            for send, latency in zip(rec.sends[start:end], rec.latencies[start:end]):
+                idx = int((send + latency) / window)
+                if idx >= self.next_window:
+                    self.pending.setdefault(idx, []).append(latency)
+            self.offsets[i] = rec.dropped + end
+
+        # 结束时间已经过去的窗口不会再有新的请求
+        while (self.next_window + 1) * window <= elapsed:
+            latencies = sorted(self.pending.pop(self.next_window, []))
+            self.next_window += 1
+            self.monitor.add_window(
+                self.next_window * window,
+                len(latencies) / window,
+                percentile(latencies, 99) if latencies else None,
+            )
+
+        return self.monitor.check(elapsed)
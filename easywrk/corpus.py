@@ -0,0 +1,413 @@
+# coding:utf8
+
+import os
+import re
+import json
+import mmap
+import base64
+import struct
+import logging
+
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit
+from typing import List, Tuple, Dict, Any, Iterator, IO
+
+import attr
+
+from .engine import EngineRequest
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE_NAME = "index.bin"
+DATA_FILE_NAME = "data.bin"
+META_FILE_NAME = "meta.json"
+
+# 索引记录，定长 32 字节，小端:
+# 到达时间(微秒, 相对第一个请求), 数据偏移, url 长度, headers 长度, body 长度, method 长度
+INDEX_RECORD = struct.Struct('<QQIIIH2x')
+
+# 回放时不带上这些 header，由客户端重新生成
+SKIP_HEADERS = {
+    'host', 'content-length', 'connection', 'keep-alive', 'transfer-encoding',
+    'proxy-connection', 'upgrade', 'te', 'trailer',
+}
+
+NGINX_COMBINED_RE = re.compile(
+    r'^(?P<remote>\S+) \S+ (?P<user>\S+) \[(?P<time>[^\]]+)\] '
+    r'"(?P<method>[A-Z]+) (?P<url>\S+)(?: (?P<protocol>[^"]+))?" '
+    r'(?P<status>\d{3}) (?P<size>\S+)'
+    r'(?: "(?P<referer>[^"]*)" "(?P<agent>[^"]*)")?'
+)
+
+NGINX_TIME_FORMAT = "%d/%b/%Y:%H:%M:%S %z"
+
+CORPUS_FORMATS = ('nginx', 'har', 'jsonl')
+
+
+class CorpusException(Exception):
+    def __init__(self, msg:str):
+        super().__init__(msg)
+
+
+@attr.s
+class CorpusRequest(object):
+    # 到达时间，unix 时间戳
+    timestamp = attr.ib(type=float)
+    method = attr.ib(type=str)
+    # path 和 query
+    url = attr.ib(type=str)
+    headers = attr.ib(type=List[Tuple[str, str]], factory=list)
+    body = attr.ib(type=bytes, default=b"")
+
+
+def _relative_url(url:str) -> str:
+    u = urlsplit(url)
+    return urlunsplit(('', '', u.path or '/', u.query, ''))
+
+def _filter_headers(headers:List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    # HTTP/2 的伪 header 以 `:` 开头
+    return [
+        (k, v) for k, v in headers
+        if not k.startswith(':') and k.lower() not in SKIP_HEADERS
+    ]
+
+def _parse_iso_time(text:str) -> float:
+    text = text.strip()
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    # fromisoformat 只支持 3 位或者 6 位小数
+    m = re.match(r'^(.*T\d{2}:\d{2}:\d{2})(\.\d+)?(.*)$', text)
+    if m is not None and m.group(2):
+        fraction = (m.group(2)[1:] + '000000')[:6]
+        text = f"{m.group(1)}.{fraction}{m.group(3)}"
+    return datetime.fromisoformat(text).timestamp()
+
+
+def iter_nginx_log(f:IO[str]) -> Iterator[CorpusRequest]:
+    """
+    Requests from nginx access log in `combined` (or `common`) format,
+    access logs have no request body.
+    """
+    last_time_text = None
+    last_time = 0.0
+    skipped = 0
+    for line in f:
+        m = NGINX_COMBINED_RE.match(line)
+        if m is None:
+            skipped += 1
+            continue
+
+        # 同一秒的日志很多，缓存时间解析结果
+        time_text = m.group('time')
+        if time_text != last_time_text:
+            last_time = datetime.strptime(time_text, NGINX_TIME_FORMAT).timestamp()
+            last_time_text = time_text
+
+        headers = []
+        agent = m.group('agent')
+        if agent and agent != '-':
+            headers.append(('User-Agent', agent))
+        referer = m.group('referer')
+        if referer and referer != '-':
+            headers.append(('Referer', referer))
+
+        yield CorpusRequest(
+            timestamp = last_time,
+            method = m.group('method'),
+            url = _relative_url(m.group('url')),
+            headers = headers,
+        )
+
+    if skipped:
+        logger.warning(f"skip {skipped} invalid lines of nginx log")
+
+
+def iter_json_array(f:IO[str], key:str, chunk_size:int = 1 << 16) -> Iterator[Any]:
+    """
+    Incrementally decode the items of the first json array named `key`,
+    only one item is kept in memory at a time.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    eof = False
+
+    def fill():
+        nonlocal buf, eof
+        data = f.read(chunk_size)
+        if not data:
+            eof = True
+        buf += data
+
+    marker = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    while True:
+        m = marker.search(buf)
+        if m is not None:
+            buf = buf[m.end():]
+            break
+        if eof:
+            raise CorpusException(f"not found json array [{key}]")
+        # 保留结尾，防止 key 被切断
+        buf = buf[-len(key) - 16:]
+        fill()
+
+    pos = 0
+    while True:
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            buf = ""
+            pos = 0
+            fill()
+
+        if pos >= len(buf):
+            raise CorpusException(f"json array [{key}] is not closed")
+        if buf[pos] == ']':
+            return
+
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            if eof:
+                raise CorpusException(f"invalid item in json array [{key}]")
+            buf = buf[pos:]
+            pos = 0
+            fill()
+            continue
+
+        yield item
+        buf = buf[end:]
+        pos = 0
+
+def iter_har(f:IO[str]) -> Iterator[CorpusRequest]:
+    for entry in iter_json_array(f, 'entries'):
+        req = entry['request']
+        headers = [(h['name'], h['value']) for h in req.get('headers', [])]
+
+        body = b""
+        post_data = req.get('postData')
+        if post_data and post_data.get('text'):
+            if post_data.get('encoding') == 'base64':
+                body = base64.b64decode(post_data['text'])
+            else:
+                body = post_data['text'].encode('utf-8')
+
+        yield CorpusRequest(
+            timestamp = _parse_iso_time(entry['startedDateTime']),
+            method = req['method'],
+            url = _relative_url(req['url']),
+            headers = headers,
+            body = body,
+        )
+
+def iter_jsonl(f:IO[str]) -> Iterator[CorpusRequest]:
+    """
+    One request per line:
+    {"ts": 1610000000.123, "method": "POST", "url": "/api/x?a=1",
+     "headers": {"Content-Type": "application/json"}, "body": "..."}
+
+    `ts` can also be an ISO 8601 string, `headers` a list of [name, value],
+    binary body is given by `body_base64`.
+    """
+    for lineno, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            raise CorpusException(f"invalid json at line {lineno}: {e}")
+
+        ts = item.get('ts', 0)
+        if isinstance(ts, str):
+            ts = _parse_iso_time(ts)
+
+        headers = item.get('headers') or []
+        if isinstance(headers, dict):
+            headers = list(headers.items())
+
+        body = b""
+        if item.get('body_base64'):
+            body = base64.b64decode(item['body_base64'])
+        elif item.get('body'):
+            body = item['body'].encode('utf-8')
+
+        yield CorpusRequest(
+            timestamp = float(ts),
+            method = item.get('method', 'GET'),
+            url = _relative_url(item.get('url', '/')),
+            headers = [(str(k), str(v)) for k, v in headers],
+            body = body,
+        )
+
+CORPUS_READER_MAP = {
+    'nginx': iter_nginx_log,
+    'har': iter_har,
+    'jsonl': iter_jsonl,
+}
+
+def guess_format(fpath:Path) -> str:
+    name = fpath.name.lower()
+    if name.endswith('.har'):
+        return 'har'
+    if name.endswith('.jsonl') or name.endswith('.ndjson'):
+        return 'jsonl'
+    return 'nginx'
+
+
+def _encode_headers(headers:List[Tuple[str, str]]) -> bytes:
+    return "".join(f"{k}: {v}\r\n" for k, v in headers).encode('utf-8')
+
+def _decode_headers(data:bytes) -> Dict[str, str]:
+    headers = {}
+    for line in data.decode('utf-8').split('\r\n'):
+        if line:
+            k, _, v = line.partition(': ')
+            headers[k] = v
+    return headers
+
+
+def write_corpus(corpus_dir:Path, requests:Iterator[CorpusRequest], source:str = "") -> int:
+    """
+    Write requests into a corpus directory, streaming, return request count.
+    """
+    corpus_dir.mkdir(exist_ok=True, parents=True)
+
+    count = 0
+    first_ts = None
+    last_offset = 0
+    offset = 0
+    with corpus_dir.joinpath(INDEX_FILE_NAME).open('wb', buffering=1 << 20) as index_w, \
+            corpus_dir.joinpath(DATA_FILE_NAME).open('wb', buffering=1 << 20) as data_w:
+        for req in requests:
+            if first_ts is None:
+                first_ts = req.timestamp
+
+            method = req.method.encode('ascii')
+            url = req.url.encode('utf-8')
+            headers = _encode_headers(_filter_headers(req.headers))
+            body = req.body or b""
+
+            # 日志不一定严格按时间排序，早于第一个请求的按 0 处理
+            arrival_us = max(0, int(round((req.timestamp - first_ts) * 1000000)))
+            last_offset = max(last_offset, arrival_us)
+
+            index_w.write(INDEX_RECORD.pack(
+                arrival_us, offset, len(url), len(headers), len(body), len(method)
+            ))
+            for part in (method, url, headers, body):
+                data_w.write(part)
+            offset += len(method) + len(url) + len(headers) + len(body)
+            count += 1
+
+    meta = {
+        'source': source,
+        'count': count,
+        'start_time': first_ts or 0.0,
+        'duration': last_offset / 1000000,
+    }
+    with corpus_dir.joinpath(META_FILE_NAME).open('w') as f:
+        json.dump(meta, f, indent=2)
+
+    return count
+
+def import_corpus(source:Path, corpus_dir:Path, fmt:str = "") -> int:
+    if not fmt:
+        fmt = guess_format(source)
+
+    reader = CORPUS_READER_MAP.get(fmt)
+    if reader is None:
+        raise CorpusException(f"not support corpus format [{fmt}]")
+
+    with source.open('r', encoding='utf-8', errors='replace') as f:
+        return write_corpus(corpus_dir, reader(f), str(source))
+
+
+class Corpus(object):
+    """
+    Read only, memory mapped view of a corpus directory.
+    """
+
+    def __init__(self, corpus_dir:Path):
+        self.corpus_dir = corpus_dir
+        index_file = corpus_dir.joinpath(INDEX_FILE_NAME)
+        if not index_file.is_file():
+            raise CorpusException(f"corpus [{corpus_dir}] does not exist")
+
+        with corpus_dir.joinpath(META_FILE_NAME).open('r') as f:
+            self.meta = json.load(f)
+
+        self._index_f = index_file.open('rb')
+        self._data_f = corpus_dir.joinpath(DATA_FILE_NAME).open('rb')
+        self.count = os.fstat(self._index_f.fileno()).st_size // INDEX_RECORD.size
+
+        self._index = None
+        self._data = None
+        if self.count > 0:
+            self._index = mmap.mmap(self._index_f.fileno(), 0, access=mmap.ACCESS_READ)
+            if os.fstat(self._data_f.fileno()).st_size > 0:
+                self._data = mmap.mmap(self._data_f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        for m in (self._index, self._data):
+            if m is not None:
+                m.close()
+        self._index_f.close()
+        self._data_f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def duration(self) -> float:
+        return self.meta.get('duration', 0.0)
+
+    def get(self, idx:int) -> Tuple[float, EngineRequest]:
+        """
+        (arrival offset in seconds, request) of the idx-th request.
+        """
+        arrival_us, offset, url_len, headers_len, body_len, method_len = \
+            INDEX_RECORD.unpack_from(self._index, idx * INDEX_RECORD.size)
+
+        data = self._data
+        pos = offset
+        method = data[pos:pos + method_len].decode('ascii')
+        pos += method_len
+        url = data[pos:pos + url_len].decode('utf-8')
+        pos += url_len
+        headers = _decode_headers(data[pos:pos + headers_len])
+        pos += headers_len
+        body = data[pos:pos + body_len] if body_len > 0 else None
+
+        return arrival_us / 1000000, EngineRequest(method=method, url=url, headers=headers, body=body)
+
+    def iter_requests(self, speedup:float = 1.0, timing:bool = True,
+            loop:bool = False) -> Iterator[EngineRequest]:
+        """
+        Requests in corpus order, with `scheduled` set to the original
+        arrival time divided by `speedup` when `timing` is true.
+        """
+        if speedup <= 0:
+            raise CorpusException(f"speedup must be positive, got {speedup}")
+
+        base = 0.0
+        while True:
+            for i in range(self.count):
+                arrival, req = self.get(i)
+                if timing:
+                    req.scheduled = base + arrival / speedup
+                yield req
+
+            if not loop or self.count == 0:
+                return
+            # 循环回放时，下一轮接在上一轮之后
+            base += self.duration / speedup
@@ -0,0 +1,410 @@
+# coding:utf8
+
+import ssl
+import math
+import time
+import socket
+import bisect
+import logging
+import threading
+import http.client
+
+from array import array
+from pathlib import Path
+from urllib.parse import urlsplit
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator, Callable
+
+import attr
+
+from .result import BenchmarkResult, LatencyStats, Sample
+
+logger = logging.getLogger(__name__)
+
+LATENCY_PERCENTILES = ("50", "75", "90", "99", "99.9")
+
+# 直方图桶的上界，100us 到 60s 按 sqrt(2) 倍数递增
+HISTOGRAM_BOUNDS = [0.0001 * (2 ** (i / 2)) for i in range(39)]
+
+# 压测过程中调用 monitor 的间隔，单位是秒
+MONITOR_INTERVAL = 0.5
+
+# 引擎工作线程的名字前缀
+ENGINE_THREAD_PREFIX = "easywrk-engine"
+
+# 请求结果，非 0 表示出错
+STATUS_CONNECT_ERROR = -1
+STATUS_READ_ERROR = -2
+STATUS_TIMEOUT = -3
+
+ERROR_STATUS_MAP = {
+    STATUS_CONNECT_ERROR: 'connect',
+    STATUS_READ_ERROR: 'read',
+    STATUS_TIMEOUT: 'timeout',
+}
+
+
+@attr.s
+class EngineRequest(object):
+    method = attr.ib(type=str, default="GET")
+    # path 和 query
+    url = attr.ib(type=str, default="/")
+    headers = attr.ib(type=Dict[str, str], factory=dict)
+    body = attr.ib(type=Optional[bytes], default=None)
+    # 相对压测开始的计划发送时间，单位是秒；None 表示尽快发送
+    scheduled = attr.ib(type=Optional[float], default=None)
+
+
+def percentile(sorted_values, p:float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = int(math.ceil(p / 100.0 * len(sorted_values))) - 1
+    return sorted_values[min(max(idx, 0), len(sorted_values) - 1)]
+
+
+class EngineRecorder(object):
+    """
+    Per worker request records, merged after the run.
+    """
+
+    def __init__(self):
+        # 相对压测开始的实际发送时间
+        self.sends = array('d')
+        self.latencies = array('d')
+        self.statuses = array('i')
+        self.sizes = array('q')
+        # 计划发送时间，没有计划时是 NaN
+        self.scheduled = array('d')
+        # 已经写入文件并从内存删除的记录数
+        self.dropped = 0
+
+    def add(self, send:float, latency:float, status:int, size:int, scheduled:Optional[float]):
+        self.sends.append(send)
+        self.latencies.append(latency)
+        self.statuses.append(status)
+        self.sizes.append(size)
+        self.scheduled.append(math.nan if scheduled is None else scheduled)
+
+    def extend(self, other:'EngineRecorder'):
+        self.sends.extend(other.sends)
+        self.latencies.extend(other.latencies)
+        self.statuses.extend(other.statuses)
+        self.sizes.extend(other.sizes)
+        self.scheduled.extend(other.scheduled)
+
+    def drop(self, n:int):
+        """
+        Remove the first `n` records, workers may keep appending meanwhile.
+        """
+        del self.sends[:n]
+        del self.latencies[:n]
+        del self.statuses[:n]
+        del self.sizes[:n]
+        del self.scheduled[:n]
+        self.dropped += n
+
+    def __len__(self):
+        return len(self.sends)
+
+
+def snapshot_counts(recorders:List[EngineRecorder]) -> List[int]:
+    """
+    Number of complete records of every recorder, workers may be appending.
+    """
+    # scheduled 最后写入，这个长度以内的记录都是完整的
+    return [len(rec.scheduled) for rec in recorders]
+
+
+class EngineRun(object):
+    def __init__(self, start_time:float, duration:float, recorder:EngineRecorder, connections:int):
+        # unix 时间戳
+        self.start_time = start_time
+        self.duration = duration
+        self.recorder = recorder
+        self.connections = connections
+
+    def errors(self) -> Dict[str, int]:
+        errors = {'connect': 0, 'read': 0, 'write': 0, 'timeout': 0, 'status': 0}
+        for status in self.recorder.statuses:
+            if status < 0:
+                errors[ERROR_STATUS_MAP[status]] += 1
+            elif status >= 400:
+                errors['status'] += 1
+        return errors
+
+    def samples(self, interval:float = 1.0) -> List[Sample]:
+        rec = self.recorder
+        buckets: Dict[int, List[float]] = {}
+        bucket_errors: Dict[int, int] = {}
+        bucket_sent: Dict[int, int] = {}
+        bucket_scheduled: Dict[int, int] = {}
+        for send, latency, status, scheduled in zip(
+                rec.sends, rec.latencies, rec.statuses, rec.scheduled):
+            idx = int((send + latency) / interval)
+            buckets.setdefault(idx, []).append(latency)
+            if status < 0 or status >= 400:
+                bucket_errors[idx] = bucket_errors.get(idx, 0) + 1
+
+            if not math.isnan(scheduled):
+                idx = int(send / interval)
+                bucket_sent[idx] = bucket_sent.get(idx, 0) + 1
+                idx = int(scheduled / interval)
+                bucket_scheduled[idx] = bucket_scheduled.get(idx, 0) + 1
+
+        samples = []
+        for idx in sorted(set(buckets) | set(bucket_sent) | set(bucket_scheduled)):
+            latencies = sorted(buckets.get(idx, []))
+            samples.append(Sample(
+                t = (idx + 1) * interval,
+                requests_per_sec = len(latencies) / interval,
+                p99 = percentile(latencies, 99),
+                errors = bucket_errors.get(idx, 0),
+                scheduled_per_sec = bucket_scheduled.get(idx, 0) / interval,
+                sent_per_sec = bucket_sent.get(idx, 0) / interval,
+            ))
+        return samples
+
+    def schedule_stats(self) -> Dict[str, float]:
+        """
+        How late requests were sent compared with their scheduled time.
+        """
+        rec = self.recorder
+        lags = []
+        # 从计划时间开始算的响应时间，不受发送端落后的影响
+        corrected = []
+        for send, latency, scheduled in zip(rec.sends, rec.latencies, rec.scheduled):
+            if math.isnan(scheduled):
+                continue
+            # 计时误差可能让发送时间略早于计划，按 0 计算，和记录文件的统计一致
+            lag = max(send - scheduled, 0.0)
+            lags.append(lag)
+            corrected.append(lag + latency)
+
+        if not lags:
+            return {}
+
+        lags.sort()
+        corrected.sort()
+        return {
+            'scheduled_requests': len(lags),
+            'lag_avg': sum(lags) / len(lags),
+            'lag_p50': percentile(lags, 50),
+            'lag_p99': percentile(lags, 99),
+            'lag_max': lags[-1],
+            'corrected_latency_p50': percentile(corrected, 50),
+            'corrected_latency_p99': percentile(corrected, 99),
+        }
+
+    def write_schedule_file(self, fpath:Path):
+        """
+        Scheduled and actual send time of every scheduled request as csv,
+        times are seconds from the start of the run.
+        """
+        rec = self.recorder
+        with fpath.open('w') as f:
+            f.write("scheduled,sent,latency,status\n")
+            for send, latency, status, scheduled in zip(
+                    rec.sends, rec.latencies, rec.statuses, rec.scheduled):
+                if math.isnan(scheduled):
+                    continue
+                f.write(f"{scheduled:.6f},{send:.6f},{latency:.6f},{status}\n")
+
+    def to_result(self, api_name:str) -> BenchmarkResult:
+        rec = self.recorder
+        latencies = sorted(rec.latencies)
+        count = len(latencies)
+
+        result = BenchmarkResult(
+            api_name = api_name,
+            engine = "builtin",
+            timestamp = self.start_time,
+            duration = self.duration,
+            requests = count,
+        )
+        if self.duration > 0:
+            result.requests_per_sec = count / self.duration
+            result.transfer_per_sec = sum(rec.sizes) / self.duration
+
+        if count > 0:
+            avg = sum(latencies) / count
+            variance = sum((v - avg) ** 2 for v in latencies) / count
+            result.latency = LatencyStats(avg=avg, stdev=math.sqrt(variance), max=latencies[-1])
+            result.latency_percentiles = {
+                p: percentile(latencies, float(p)) for p in LATENCY_PERCENTILES
+            }
+            result.latency_histogram = [
+                [le, bisect.bisect_right(latencies, le)] for le in HISTOGRAM_BOUNDS
+            ]
+
+        result.errors = self.errors()
+        result.samples = self.samples()
+        result.wrk_config = {'connections': self.connections}
+
+        schedule = self.schedule_stats()
+        if schedule:
+            result.extra['schedule'] = schedule
+
+        return result
+
+
+class BuiltinEngine(object):
+    """
+    A thread per connection load generator based on http.client.
+
+    It is much slower than wrk, but can send a different request each time
+    and send requests at scheduled times.
+    """
+
+    recorder_class = EngineRecorder
+    run_class = EngineRun
+
+    def __init__(self, base_url:str, connections:int = 10,
+            timeout:float = 30.0, tls_verify:bool = True, ca_file:Optional[str] = None):
+        u = urlsplit(base_url)
+        if u.scheme not in ('http', 'https'):
+            raise ValueError(f"not support url [{base_url}]")
+
+        self.scheme = u.scheme
+        self.host = u.hostname
+        self.port = u.port
+        self.base_path = u.path.rstrip('/')
+        self.connections = connections
+        self.timeout = timeout
+
+        self.ssl_context = None
+        if self.scheme == 'https':
+            self.ssl_context = ssl.create_default_context(cafile=ca_file)
+            if not tls_verify:
+                self.ssl_context.check_hostname = False
+                self.ssl_context.verify_mode = ssl.CERT_NONE
+
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.scheme == 'https':
+            conn = http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.timeout, context=self.ssl_context
+            )
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        conn.connect()
+        return conn
+
+    def _send(self, conn, req:EngineRequest) -> Tuple[int, int]:
+        conn.request(req.method, self.base_path + req.url, body=req.body, headers=req.headers)
+        resp = conn.getresponse()
+        data = resp.read()
+        if resp.will_close:
+            conn.close()
+        return resp.status, len(data)
+
+    def _worker(self, next_request, start:float, deadline:Optional[float], rec:EngineRecorder):
+        conn = None
+        while not self._stop.is_set():
+            req = next_request()
+            if req is None:
+                break
+
+            if req.scheduled is not None:
+                target = start + req.scheduled
+                if deadline is not None and target >= deadline:
+                    break
+                wait = target - time.perf_counter()
+                if wait > 0 and self._stop.wait(wait):
+                    break
+
+            send = time.perf_counter()
+            if deadline is not None and send >= deadline:
+                break
+
+            status = 0
+            size = 0
+            try:
+                if conn is None or conn.sock is None:
+                    try:
+                        conn = self._connect()
+                    except OSError:
+                        status = STATUS_CONNECT_ERROR
+                        conn = None
+
+                if conn is not None:
+                    status, size = self._send(conn, req)
+            except socket.timeout:
+                status = STATUS_TIMEOUT
+            except (OSError, http.client.HTTPException):
+                status = STATUS_READ_ERROR
+
+            if status < 0 and conn is not None:
+                conn.close()
+                conn = None
+
+            latency = time.perf_counter() - send
+            rec.add(send - start, latency, status, size, req.scheduled)
+
+        if conn is not None:
+            conn.close()
+
+    def run(self, requests:Iterable[EngineRequest], duration:Optional[float] = None,
+            monitor:Optional[Callable[[float, List[EngineRecorder]], bool]] = None) -> EngineRun:
+        """
+        Send `requests` in order until they are used up or `duration` seconds passed.
+
+        `monitor(elapsed, recorders)` is called about every MONITOR_INTERVAL
+        seconds while running, the run stops early when it returns True.
+        """
+        self._stop.clear()
+        it: Iterator[EngineRequest] = iter(requests)
+        lock = threading.Lock()
+
+        def next_request():
+            with lock:
+                return next(it, None)
+
+        recorders = [self.recorder_class() for _ in range(self.connections)]
+        start_time = time.time()
+        start = time.perf_counter()
+        deadline = None if duration is None else start + duration
+
+        threads = [
+            threading.Thread(
+                target=self._worker, args=(next_request, start, deadline, rec),
+                name=f"{ENGINE_THREAD_PREFIX}-{i}", daemon=True
+            )
+            for i, rec in enumerate(recorders)
+        ]
+        for t in threads:
+            t.start()
+
+        try:
+            for t in threads:
+                while t.is_alive():
+                    t.join(MONITOR_INTERVAL)
+                    if monitor is not None and monitor(time.perf_counter() - start, recorders):
+                        self.stop()
+        except KeyboardInterrupt:
+            self.stop()
+            for t in threads:
+                t.join()
+
+        elapsed = time.perf_counter() - start
+        if duration is not None:
+            elapsed = min(elapsed, duration)
+
+        merged = self.recorder_class()
+        for rec in recorders:
+            merged.extend(rec)
+
+        return self.run_class(start_time, elapsed, merged, self.connections)
+
+
+def parse_duration(text:str) -> float:
+    """
+    Parse wrk duration like `10s`, `2m`, `1h` or plain seconds.
+    """
+    text = text.strip()
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    if text and text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
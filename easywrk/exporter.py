@@ -0,0 +1,243 @@
+# coding:utf8
+
+import re
+import logging
+
+from typing import List, Dict, Tuple, Iterable
+from urllib.parse import quote
+
+import requests
+
+from .result import BenchmarkResult
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = "easywrk"
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# WrkConfig 里作为 label 的参数
+WRK_CONFIG_LABELS = ('threads', 'thread_connections', 'duration')
+
+LABEL_NAME_RE = re.compile(r'[^a-zA-Z0-9_]')
+
+
+class ExportException(Exception):
+    def __init__(self, msg:str):
+        super().__init__(msg)
+
+
+def _label_name(name:str) -> str:
+    name = LABEL_NAME_RE.sub('_', name)
+    if not name or name[0].isdigit():
+        name = '_' + name
+    return name
+
+def make_labels(result:BenchmarkResult) -> Dict[str, str]:
+    labels = {
+        'api': result.api_name,
+        'engine': result.engine,
+    }
+    for name in WRK_CONFIG_LABELS:
+        if name in result.wrk_config:
+            labels[name] = str(result.wrk_config[name])
+
+    if result.git_commit:
+        labels['git_commit'] = result.git_commit
+
+    for k, v in result.labels.items():
+        labels.setdefault(_label_name(k), str(v))
+
+    return labels
+
+
+def _escape_label_value(value:str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels:Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    items = [f'{k}="{_escape_label_value(v)}"' for k, v in labels.items()]
+    return "{" + ",".join(items) + "}"
+
+def _format_number(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _MetricFamily(object):
+    def __init__(self, name:str, type:str, help:str):
+        self.name = name
+        self.type = type
+        self.help = help
+        # (sample name, labels, value, timestamp)
+        self.samples: List[Tuple[str, Dict[str, str], float, float]] = []
+
+    def add(self, suffix:str, labels:Dict[str, str], value, timestamp:float):
+        self.samples.append((self.name + suffix, labels, value, timestamp))
+
+
+def _collect_families(results:Iterable[BenchmarkResult]) -> List[_MetricFamily]:
+    p = METRIC_PREFIX
+    families = [
+        _MetricFamily(f"{p}_requests_per_second", "gauge", "Requests per second."),
+        _MetricFamily(f"{p}_transfer_bytes_per_second", "gauge", "Transfer bytes per second."),
+        _MetricFamily(f"{p}_requests", "counter", "Requests completed in the run."),
+        _MetricFamily(f"{p}_errors", "counter", "Errors in the run by type."),
+        _MetricFamily(f"{p}_duration_seconds", "gauge", "Duration of the run."),
+        _MetricFamily(f"{p}_latency_avg_seconds", "gauge", "Average request latency."),
+        _MetricFamily(f"{p}_latency_stdev_seconds", "gauge", "Request latency standard deviation."),
+        _MetricFamily(f"{p}_latency_max_seconds", "gauge", "Max request latency."),
+        _MetricFamily(f"{p}_latency_seconds", "summary", "Request latency percentiles."),
+        _MetricFamily(f"{p}_latency_histogram_seconds", "histogram", "Request latency histogram."),
+    ]
+    (rps, transfer, total, errors, duration,
+        lat_avg, lat_stdev, lat_max, summary, histogram) = families
+
+    # OpenMetrics 要求同一个时间序列的点按时间排序
+    for r in sorted(results, key=lambda x: x.timestamp):
+        labels = make_labels(r)
+        ts = r.timestamp
+
+        rps.add("", labels, r.requests_per_sec, ts)
+        transfer.add("", labels, r.transfer_per_sec, ts)
+        total.add("_total", labels, r.requests, ts)
+        duration.add("", labels, r.duration, ts)
+        lat_avg.add("", labels, r.latency.avg, ts)
+        lat_stdev.add("", labels, r.latency.stdev, ts)
+        lat_max.add("", labels, r.latency.max, ts)
+
+        for name, count in r.errors.items():
+            errors.add("_total", dict(labels, type=name), count, ts)
+
+        if r.latency_percentiles:
+            for key, value in sorted(r.latency_percentiles.items(), key=lambda x: float(x[0])):
+                quantile = repr(float(key) / 100)
+                summary.add("", dict(labels, quantile=quantile), value, ts)
+            summary.add("_count", labels, r.requests, ts)
+            summary.add("_sum", labels, r.latency.avg * r.requests, ts)
+
+        if r.latency_histogram:
+            count = 0
+            for le, count in r.latency_histogram:
+                histogram.add("_bucket", dict(labels, le=repr(float(le))), int(count), ts)
+            histogram.add("_bucket", dict(labels, le="+Inf"), int(count), ts)
+            histogram.add("_count", labels, int(count), ts)
+            histogram.add("_sum", labels, r.latency.avg * count, ts)
+
+    return [f for f in families if f.samples]
+
+
+def _series_labels(labels:Dict[str, str]) -> Dict[str, str]:
+    return {k: v for k, v in labels.items() if k not in ('quantile', 'le')}
+
+def _render_text(families:List[_MetricFamily], openmetrics:bool) -> str:
+    lines = []
+    for family in families:
+        name = family.name
+        # prometheus 文本格式里 counter 的元数据名字要和带 _total 的样本名一致
+        if not openmetrics and family.type == "counter":
+            name += "_total"
+        lines.append(f"# HELP {name} {family.help}")
+        lines.append(f"# TYPE {name} {family.type}")
+
+        # 同一个时间序列的点要相邻且按时间排序，quantile 和 le 属于同一个点
+        samples = sorted(
+            family.samples,
+            key=lambda x: (sorted(_series_labels(x[1]).items()), x[3])
+        )
+        for name, labels, value, ts in samples:
+            line = f"{name}{_format_labels(labels)} {_format_number(value)}"
+            if openmetrics:
+                line += f" {_format_number(round(ts, 3))}"
+            lines.append(line)
+
+    if openmetrics:
+        lines.append("# EOF")
+
+    return "\n".join(lines) + "\n"
+
+def to_openmetrics(results:Iterable[BenchmarkResult]) -> str:
+    """
+    OpenMetrics text with one timestamped point per run,
+    can be backfilled with `promtool tsdb create-blocks-from openmetrics`.
+    """
+    return _render_text(_collect_families(results), True)
+
+def to_prometheus_text(results:Iterable[BenchmarkResult]) -> str:
+    """
+    Prometheus text format without timestamps, which is what a pushgateway accepts.
+    """
+    return _render_text(_collect_families(results), False)
+
+
+def _escape_tag(value:str) -> str:
+    return value.replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+def _format_tags(tags:Dict[str, str]) -> str:
+    return "".join(f",{_escape_tag(k)}={_escape_tag(v)}" for k, v in tags.items() if v != "")
+
+def _format_fields(fields:Dict[str, object]) -> str:
+    items = []
+    for k, v in fields.items():
+        if isinstance(v, int) and not isinstance(v, bool):
+            items.append(f"{_escape_tag(k)}={v}i")
+        else:
+            items.append(f"{_escape_tag(k)}={float(v)!r}")
+    return ",".join(items)
+
+def to_line_protocol(results:Iterable[BenchmarkResult]) -> str:
+    p = METRIC_PREFIX
+    lines = []
+    for r in sorted(results, key=lambda x: x.timestamp):
+        tags = _format_tags(make_labels(r))
+        ts = int(r.timestamp * 1000000000)
+
+        fields: Dict[str, object] = {
+            'requests_per_sec': r.requests_per_sec,
+            'transfer_per_sec': r.transfer_per_sec,
+            'requests': r.requests,
+            'duration': r.duration,
+            'latency_avg': r.latency.avg,
+            'latency_stdev': r.latency.stdev,
+            'latency_max': r.latency.max,
+        }
+        for key, value in r.latency_percentiles.items():
+            fields[f"latency_p{key}"] = value
+        for name, count in r.errors.items():
+            fields[f"errors_{name}"] = count
+
+        lines.append(f"{p}{tags} {_format_fields(fields)} {ts}")
+
+        for le, count in r.latency_histogram:
+            bucket_tags = tags + _format_tags({'le': _format_number(le)})
+            lines.append(f"{p}_latency_bucket{bucket_tags} count={int(count)}i {ts}")
+
+    return "\n".join(lines) + "\n"
+
+
+def push_to_gateway(url:str, job:str, results:List[BenchmarkResult], timeout:float=10.0):
+    """
+    Replace the metrics of `job` group in a pushgateway compatible endpoint.
+    """
+    push_url = f"{url.rstrip('/')}/metrics/job/{quote(job, safe='')}"
+    data = to_prometheus_text(results).encode('utf-8')
+
+    logger.info("push metrics to %s", push_url)
+    try:
+        resp = requests.put(
+            push_url, data=data,
+            headers={'Content-Type': PROMETHEUS_CONTENT_TYPE},
+            timeout=timeout,
+        )
+    except requests.RequestException as e:
+        raise ExportException(f"push metrics to [{push_url}] failed: {e}")
+
+    if resp.status_code >= 300:
+        raise ExportException(
+            f"push metrics to [{push_url}] failed, status code is {resp.status_code}: {resp.text}"
+        )
+
+    return resp
@@ -0,0 +1,461 @@
+# coding:utf8
+
+import json
+import time
+import logging
+import sqlite3
+
+from pathlib import Path
+from typing import List, Dict, Tuple, Any, Optional, Iterable
+
+import attr
+import cattr
+
+from .result import BenchmarkResult, Sample, load_result, list_result_files
+
+logger = logging.getLogger(__name__)
+
+DAY_SECONDS = 86400
+
+# ts 所在时刻本地时区相对 UTC 的秒数
+LOCAL_OFFSET_SQL = (
+    "(CAST(strftime('%s', ts, 'unixepoch', 'localtime') AS INTEGER)"
+    " - CAST(strftime('%s', ts, 'unixepoch') AS INTEGER))"
+)
+# 按本地时间划分的 bucket 开始时间，需要两个 period 参数
+BUCKET_SQL = f"(CAST((ts + {LOCAL_OFFSET_SQL}) / ? AS INTEGER) * ? - {LOCAL_OFFSET_SQL})"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    api TEXT NOT NULL,
+    run_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    tag TEXT NOT NULL DEFAULT '',
+    config_hash TEXT NOT NULL DEFAULT '',
+    engine TEXT NOT NULL DEFAULT '',
+    git_commit TEXT NOT NULL DEFAULT '',
+    duration REAL NOT NULL DEFAULT 0,
+    requests INTEGER NOT NULL DEFAULT 0,
+    rps REAL NOT NULL DEFAULT 0,
+    transfer REAL NOT NULL DEFAULT 0,
+    latency_avg REAL NOT NULL DEFAULT 0,
+    latency_max REAL NOT NULL DEFAULT 0,
+    p50 REAL,
+    p90 REAL,
+    p99 REAL,
+    errors INTEGER NOT NULL DEFAULT 0,
+    percentiles TEXT NOT NULL DEFAULT '{}',
+    histogram TEXT NOT NULL DEFAULT '[]',
+    samples TEXT NOT NULL DEFAULT '[]',
+    UNIQUE (api, run_id)
+);
+CREATE INDEX IF NOT EXISTS idx_runs_api_ts ON runs (api, ts);
+CREATE INDEX IF NOT EXISTS idx_runs_ts ON runs (ts);
+CREATE INDEX IF NOT EXISTS idx_runs_tag_ts ON runs (tag, ts);
+CREATE INDEX IF NOT EXISTS idx_runs_config_hash_ts ON runs (config_hash, ts);
+
+CREATE TABLE IF NOT EXISTS summaries (
+    api TEXT NOT NULL,
+    period INTEGER NOT NULL,
+    bucket REAL NOT NULL,
+    tag TEXT NOT NULL DEFAULT '',
+    config_hash TEXT NOT NULL DEFAULT '',
+    runs INTEGER NOT NULL,
+    rps_avg REAL NOT NULL,
+    rps_min REAL NOT NULL,
+    rps_max REAL NOT NULL,
+    p99_avg REAL,
+    p99_max REAL,
+    latency_avg REAL NOT NULL,
+    errors INTEGER NOT NULL,
+    PRIMARY KEY (api, period, bucket, tag, config_hash)
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+RUN_COLUMNS = (
+    'api', 'run_id', 'ts', 'tag', 'config_hash', 'engine', 'git_commit',
+    'duration', 'requests', 'rps', 'transfer', 'latency_avg', 'latency_max',
+    'p50', 'p90', 'p99', 'errors', 'percentiles', 'histogram', 'samples',
+)
+
+# 压缩之前的原始记录不再导入，避免和汇总数据重复
+META_COMPACTED_UNTIL = 'compacted_until'
+
+
+@attr.s
+class HistoryRun(object):
+    api_name = attr.ib(type=str)
+    run_id = attr.ib(type=str)
+    timestamp = attr.ib(type=float)
+    tag = attr.ib(type=str, default="")
+    config_hash = attr.ib(type=str, default="")
+    engine = attr.ib(type=str, default="")
+    git_commit = attr.ib(type=str, default="")
+    duration = attr.ib(type=float, default=0.0)
+    requests = attr.ib(type=int, default=0)
+    requests_per_sec = attr.ib(type=float, default=0.0)
+    transfer_per_sec = attr.ib(type=float, default=0.0)
+    latency_avg = attr.ib(type=float, default=0.0)
+    latency_max = attr.ib(type=float, default=0.0)
+    p50 = attr.ib(type=Optional[float], default=None)
+    p90 = attr.ib(type=Optional[float], default=None)
+    p99 = attr.ib(type=Optional[float], default=None)
+    errors = attr.ib(type=int, default=0)
+    latency_percentiles = attr.ib(type=Dict[str, float], factory=dict)
+    latency_histogram = attr.ib(type=List[List[float]], factory=list)
+    samples = attr.ib(type=List[Sample], factory=list)
+
+
+@attr.s
+class TrendPoint(object):
+    # bucket 开始时间
+    timestamp = attr.ib(type=float)
+    runs = attr.ib(type=int, default=0)
+    requests_per_sec = attr.ib(type=float, default=0.0)
+    rps_min = attr.ib(type=float, default=0.0)
+    rps_max = attr.ib(type=float, default=0.0)
+    p99 = attr.ib(type=Optional[float], default=None)
+    p99_max = attr.ib(type=Optional[float], default=None)
+    latency_avg = attr.ib(type=float, default=0.0)
+    errors = attr.ib(type=int, default=0)
+
+
+def _result_row(result:BenchmarkResult) -> Tuple:
+    percentiles = result.latency_percentiles
+    return (
+        result.api_name, result.run_id, result.timestamp,
+        result.tag, result.config_hash, result.engine, result.git_commit,
+        result.duration, result.requests, result.requests_per_sec,
+        result.transfer_per_sec, result.latency.avg, result.latency.max,
+        percentiles.get('50'), percentiles.get('90'), percentiles.get('99'),
+        result.total_errors(),
+        json.dumps(percentiles),
+        json.dumps(result.latency_histogram),
+        json.dumps(cattr.unstructure(result.samples)),
+    )
+
+def local_bucket(ts:float, period:int = DAY_SECONDS) -> float:
+    """
+    Start of the `period` seconds bucket of `ts` in local time, like BUCKET_SQL.
+    """
+    offset = time.localtime(ts).tm_gmtoff
+    return int((ts + offset) // period) * period - offset
+
+def _merge_avg(a, a_weight, b, b_weight):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return (a * a_weight + b * b_weight) / (a_weight + b_weight)
+
+def _merge_max(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
+def _make_history_run(row:sqlite3.Row) -> HistoryRun:
+    return HistoryRun(
+        api_name = row['api'],
+        run_id = row['run_id'],
+        timestamp = row['ts'],
+        tag = row['tag'],
+        config_hash = row['config_hash'],
+        engine = row['engine'],
+        git_commit = row['git_commit'],
+        duration = row['duration'],
+        requests = row['requests'],
+        requests_per_sec = row['rps'],
+        transfer_per_sec = row['transfer'],
+        latency_avg = row['latency_avg'],
+        latency_max = row['latency_max'],
+        p50 = row['p50'],
+        p90 = row['p90'],
+        p99 = row['p99'],
+        errors = row['errors'],
+        latency_percentiles = json.loads(row['percentiles']),
+        latency_histogram = json.loads(row['histogram']),
+        samples = cattr.structure(json.loads(row['samples']), List[Sample]),
+    )
+
+
+class HistoryStore(object):
+    """
+    Run history in a sqlite file, indexed by api name, time, tag and config hash.
+    """
+
+    def __init__(self, fpath:Path):
+        self.fpath = fpath
+        self.conn = sqlite3.connect(str(fpath), timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _get_meta(self, key:str, default:str="") -> str:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        return row['value']
+
+    def _set_meta(self, key:str, value:str):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+        )
+
+    def add_results(self, results:Iterable[BenchmarkResult]) -> int:
+        compacted_until = float(self._get_meta(META_COMPACTED_UNTIL, "0"))
+        rows = [
+            _result_row(r) for r in results if r.timestamp >= compacted_until
+        ]
+
+        placeholders = ", ".join("?" for _ in RUN_COLUMNS)
+        sql = f"INSERT OR IGNORE INTO runs ({', '.join(RUN_COLUMNS)}) VALUES ({placeholders})"
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(sql, rows)
+            return self.conn.total_changes - before
+
+    def add_result(self, result:BenchmarkResult) -> bool:
+        return self.add_results([result]) > 0
+
+    def import_dir(self, benchmark_dir:Path, api_names:Optional[List[str]] = None) -> int:
+        if api_names is None:
+            api_dirs = [p for p in sorted(benchmark_dir.iterdir()) if p.is_dir()]
+        else:
+            api_dirs = [benchmark_dir.joinpath(name) for name in api_names]
+
+        count = 0
+        for api_dir in api_dirs:
+            results = []
+            for p in list_result_files(api_dir):
+                try:
+                    results.append(load_result(p))
+                except (ValueError, KeyError, TypeError) as e:
+                    logger.warning(f"skip invalid result file [{p}]: {e}")
+            count += self.add_results(results)
+
+        return count
+
+    def list_apis(self) -> List[str]:
+        rows = self.conn.execute(
+            "SELECT DISTINCT api FROM runs UNION SELECT DISTINCT api FROM summaries ORDER BY api"
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _where(self, api:Optional[str], tag:Optional[str], config_hash:Optional[str],
+            since:Optional[float], until:Optional[float],
+            ts_column:str = "ts") -> Tuple[str, List[Any]]:
+        conds = []
+        params: List[Any] = []
+        if api is not None:
+            conds.append("api = ?")
+            params.append(api)
+        if tag is not None:
+            conds.append("tag = ?")
+            params.append(tag)
+        if config_hash is not None:
+            conds.append("config_hash = ?")
+            params.append(config_hash)
+        if since is not None:
+            conds.append(f"{ts_column} >= ?")
+            params.append(since)
+        if until is not None:
+            conds.append(f"{ts_column} < ?")
+            params.append(until)
+
+        where = ""
+        if conds:
+            where = "WHERE " + " AND ".join(conds)
+        return where, params
+
+    def query_runs(self, api:Optional[str] = None, tag:Optional[str] = None,
+            config_hash:Optional[str] = None, since:Optional[float] = None,
+            until:Optional[float] = None, limit:int = 20) -> List[HistoryRun]:
+        """
+        Newest runs first.
+        """
+        where, params = self._where(api, tag, config_hash, since, until)
+        sql = f"SELECT * FROM runs {where} ORDER BY ts DESC"
+        if limit > 0:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        return [_make_history_run(row) for row in self.conn.execute(sql, params)]
+
+    def latest_runs(self, tag:Optional[str] = None) -> Dict[str, HistoryRun]:
+        """
+        The newest run of every api.
+        """
+        # 按 api 编号后取第一条，过滤条件只需要写一次，同一时间的其他 tag 不会混进来
+        where, params = self._where(None, tag, None, None, None)
+        sql = f"""
+            SELECT * FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY api ORDER BY ts DESC, run_id DESC) AS n
+                FROM runs {where}
+            ) WHERE n = 1
+        """
+        runs = {}
+        for row in self.conn.execute(sql, params):
+            runs[row['api']] = _make_history_run(row)
+        return runs
+
+    def query_series(self, tag:Optional[str] = None, since:Optional[float] = None,
+            limit:int = 0) -> Dict[str, List[Tuple[float, float, Optional[float]]]]:
+        """
+        (timestamp, requests per second, p99) of runs grouped by api, oldest first,
+        compacted summaries are points at the start of their bucket.
+        `limit` keeps only the newest points of every api.
+        """
+        where, params = self._where(None, tag, None, since, None)
+        summary_where, summary_params = self._where(None, tag, None, since, None, "bucket")
+        sql = f"""
+            SELECT api, ts, rps, p99 FROM (
+                SELECT api, ts, rps, p99,
+                    ROW_NUMBER() OVER (PARTITION BY api ORDER BY ts DESC) AS n
+                FROM (
+                    SELECT api, ts, rps, p99 FROM runs {where}
+                    UNION ALL
+                    SELECT api, bucket AS ts,
+                        SUM(rps_avg * runs) / SUM(runs) AS rps,
+                        SUM(p99_avg * runs) / SUM(CASE WHEN p99_avg IS NULL THEN 0 ELSE runs END) AS p99
+                    FROM summaries {summary_where}
+                    GROUP BY api, bucket
+                )
+            )
+        """
+        params = params + summary_params
+        if limit > 0:
+            sql += " WHERE n <= ?"
+            params.append(limit)
+        sql += " ORDER BY api, ts"
+
+        series: Dict[str, List[Tuple[float, float, Optional[float]]]] = {}
+        for api, ts, rps, p99 in self.conn.execute(sql, params):
+            series.setdefault(api, []).append((ts, rps, p99))
+
+        return series
+
+    def trend(self, api:str, period:int = DAY_SECONDS, tag:Optional[str] = None,
+            config_hash:Optional[str] = None, since:Optional[float] = None,
+            until:Optional[float] = None) -> List[TrendPoint]:
+        """
+        Runs grouped into `period` seconds buckets of local time, oldest
+        first, compacted summaries are merged into the same buckets.
+        """
+        where, params = self._where(api, tag, config_hash, since, until)
+        sql = f"""
+            SELECT {BUCKET_SQL} AS bucket,
+                COUNT(*) AS runs,
+                AVG(rps) AS rps_avg, MIN(rps) AS rps_min, MAX(rps) AS rps_max,
+                AVG(p99) AS p99_avg, MAX(p99) AS p99_max,
+                AVG(latency_avg) AS latency_avg, SUM(errors) AS errors
+            FROM runs {where}
+            GROUP BY bucket
+        """
+        points: Dict[float, TrendPoint] = {}
+        for row in self.conn.execute(sql, [period, period] + params):
+            points[row['bucket']] = TrendPoint(
+                timestamp = row['bucket'],
+                runs = row['runs'],
+                requests_per_sec = row['rps_avg'],
+                rps_min = row['rps_min'],
+                rps_max = row['rps_max'],
+                p99 = row['p99_avg'],
+                p99_max = row['p99_max'],
+                latency_avg = row['latency_avg'],
+                errors = row['errors'],
+            )
+
+        where, params = self._where(api, tag, config_hash, since, until, "bucket")
+        sql = f"SELECT * FROM summaries {where}"
+        for row in self.conn.execute(sql, params):
+            bucket = local_bucket(row['bucket'], period)
+            p = points.get(bucket)
+            if p is None:
+                p = TrendPoint(timestamp=bucket, rps_min=row['rps_min'], rps_max=row['rps_max'])
+                points[bucket] = p
+
+            p.requests_per_sec = _merge_avg(p.requests_per_sec, p.runs, row['rps_avg'], row['runs'])
+            p.latency_avg = _merge_avg(p.latency_avg, p.runs, row['latency_avg'], row['runs'])
+            p.p99 = _merge_avg(p.p99, p.runs, row['p99_avg'], row['runs'])
+            p.p99_max = _merge_max(p.p99_max, row['p99_max'])
+            p.rps_min = min(p.rps_min, row['rps_min'])
+            p.rps_max = max(p.rps_max, row['rps_max'])
+            p.runs += row['runs']
+            p.errors += row['errors']
+
+        return [points[k] for k in sorted(points)]
+
+    def compact(self, before:float, period:int = DAY_SECONDS) -> int:
+        """
+        Replace runs older than `before` with `period` seconds summaries,
+        return the number of removed runs.
+        """
+        sql = f"""
+            SELECT api, tag, config_hash, {BUCKET_SQL} AS bucket,
+                COUNT(*) AS runs,
+                AVG(rps) AS rps_avg, MIN(rps) AS rps_min, MAX(rps) AS rps_max,
+                AVG(p99) AS p99_avg, MAX(p99) AS p99_max,
+                AVG(latency_avg) AS latency_avg, SUM(errors) AS errors
+            FROM runs WHERE ts < ?
+            GROUP BY api, tag, config_hash, bucket
+        """
+        with self.conn:
+            groups = self.conn.execute(sql, (period, period, before)).fetchall()
+            for g in groups:
+                key = (g['api'], period, g['bucket'], g['tag'], g['config_hash'])
+                old = self.conn.execute(
+                    """SELECT * FROM summaries
+                    WHERE api = ? AND period = ? AND bucket = ? AND tag = ? AND config_hash = ?""",
+                    key
+                ).fetchone()
+
+                values = dict(g)
+                if old is not None:
+                    values['rps_avg'] = _merge_avg(old['rps_avg'], old['runs'], g['rps_avg'], g['runs'])
+                    values['latency_avg'] = _merge_avg(old['latency_avg'], old['runs'], g['latency_avg'], g['runs'])
+                    values['p99_avg'] = _merge_avg(old['p99_avg'], old['runs'], g['p99_avg'], g['runs'])
+                    values['p99_max'] = _merge_max(old['p99_max'], g['p99_max'])
+                    values['rps_min'] = min(old['rps_min'], g['rps_min'])
+                    values['rps_max'] = max(old['rps_max'], g['rps_max'])
+                    values['runs'] = old['runs'] + g['runs']
+                    values['errors'] = old['errors'] + g['errors']
+
+                self.conn.execute(
+                    """INSERT OR REPLACE INTO summaries
+                    (api, period, bucket, tag, config_hash, runs, rps_avg, rps_min, rps_max,
+                        p99_avg, p99_max, latency_avg, errors)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    key + (
+                        values['runs'], values['rps_avg'], values['rps_min'], values['rps_max'],
+                        values['p99_avg'], values['p99_max'], values['latency_avg'], values['errors'],
+                    )
+                )
+
+            cursor = self.conn.execute("DELETE FROM runs WHERE ts < ?", (before,))
+            compacted_until = max(before, float(self._get_meta(META_COMPACTED_UNTIL, "0")))
+            self._set_meta(META_COMPACTED_UNTIL, str(compacted_until))
+
+        return cursor.rowcount
+
+
+def days_ago(days:float) -> float:
+    return time.time() - days * DAY_SECONDS
@@ -0,0 +1,245 @@
+# coding:utf8
+
+import os
+import sys
+import time
+import logging
+import subprocess
+
+from pathlib import Path
+from urllib.parse import urlsplit
+from typing import List, Dict, Set, Optional
+
+import attr
+
+from .common import EasyWrkContext, ApiConfig
+from .api import select_engine
+from .profiling import available_cpu_count
+from .result import BenchmarkResult, load_latest_result
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.2
+
+RUN_ALL_LOG_FILE = "run-all.log"
+
+# 等待中的任务被后面的任务插队这么多次后，不再让后面的任务先运行
+MAX_BACKFILL_SKIPS = 3
+
+
+@attr.s
+class RunAllJob(object):
+    api_name = attr.ib(type=str)
+    engine = attr.ib(type=str)
+    # 压测目标，同一个目标同时只能有一个压测
+    target = attr.ib(type=str)
+    # 需要的 CPU 数
+    cpus = attr.ib(type=int)
+    log_file = attr.ib(type=Path)
+
+    # 运行时分配的 CPU
+    cpu_set = attr.ib(type=List[int], factory=list)
+    process = attr.ib(default=None, repr=False)
+    start_time = attr.ib(type=float, default=0.0)
+    end_time = attr.ib(type=float, default=0.0)
+    returncode = attr.ib(type=Optional[int], default=None)
+    result = attr.ib(type=Optional[BenchmarkResult], default=None, repr=False)
+
+
+def get_cpu_list() -> List[int]:
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(available_cpu_count()))
+
+def get_target(base_url:str) -> str:
+    u = urlsplit(base_url)
+    port = u.port or (443 if u.scheme == 'https' else 80)
+    return f"{u.hostname}:{port}"
+
+def get_api_cpus(context:EasyWrkContext, api_config:ApiConfig, engine:str) -> int:
+    """
+    Cpu budget of the api: api config, then group config, then by engine,
+    wrk needs a cpu per thread and the python engines use a single core.
+    """
+    if api_config.cpus > 0:
+        return api_config.cpus
+
+    group = context.get_group(api_config)
+    if group is not None and group.cpus > 0:
+        return group.cpus
+
+    if engine == 'wrk':
+        return context.wrk_config.threads
+    return 1
+
+def plan_jobs(context:EasyWrkContext, api_configs:List[ApiConfig], engine:Optional[str] = None) -> List[RunAllJob]:
+    jobs = []
+    for api_config in api_configs:
+        job_engine = select_engine(api_config, engine)
+        base_url = context.get_base_url(api_config)
+        if not base_url:
+            raise ValueError(
+                f"not define base url of api [{api_config.name}], set environ [BASE_URL] or base_url in config"
+            )
+
+        jobs.append(RunAllJob(
+            api_name = api_config.name,
+            engine = job_engine,
+            target = get_target(base_url),
+            cpus = get_api_cpus(context, api_config, job_engine),
+            log_file = context.get_api_dir(api_config.name).joinpath(RUN_ALL_LOG_FILE),
+        ))
+    return jobs
+
+
+def _set_affinity(cpu_set:List[int]):
+    if cpu_set and hasattr(os, 'sched_setaffinity'):
+        return lambda: os.sched_setaffinity(0, cpu_set)
+    return None
+
+
+class RunAllScheduler(object):
+    """
+    Run jobs as separate easywrk processes, each pinned to its own cpus.
+    A job starts when enough cpus are free and no other job is running
+    against the same target, jobs start in order when possible. Later jobs
+    may start before a waiting one only MAX_BACKFILL_SKIPS times, then its
+    cpus are kept for it.
+    """
+
+    def __init__(self, jobs:List[RunAllJob], cpu_list:Optional[List[int]] = None, max_parallel:int = 0):
+        self.jobs = jobs
+        self.cpu_list = cpu_list or get_cpu_list()
+        self.max_parallel = max_parallel
+
+        for job in jobs:
+            if job.cpus > len(self.cpu_list):
+                logger.warning(
+                    "api [%s] needs %d cpus, only %d available",
+                    job.api_name, job.cpus, len(self.cpu_list)
+                )
+                job.cpus = len(self.cpu_list)
+
+    def plan(self) -> List[List[RunAllJob]]:
+        """
+        Waves of jobs that would run together if every job took the same time,
+        used to show the plan on dry run.
+        """
+        skipped = {id(job): 0 for job in self.jobs}
+        waves = []
+        pending = list(self.jobs)
+        while pending:
+            wave = self._select(pending, len(self.cpu_list), set(), 0, skipped)
+            for job in wave:
+                pending.remove(job)
+            waves.append(wave)
+        return waves
+
+    def _select(self, pending:List[RunAllJob], free:int, busy_targets:Set[str],
+            running:int, skipped:Dict[int, int]) -> List[RunAllJob]:
+        """
+        Jobs of `pending` to start now, `skipped` counts by id(job) how
+        often later jobs started before a waiting one.
+        """
+        selected = []
+        waiting = None
+        for job in pending:
+            if self.max_parallel and running + len(selected) >= self.max_parallel:
+                break
+            if job.target in busy_targets or job.cpus > free:
+                if waiting is None:
+                    waiting = job
+                    if skipped[id(job)] >= MAX_BACKFILL_SKIPS:
+                        break
+                continue
+            selected.append(job)
+            free -= job.cpus
+            busy_targets.add(job.target)
+            if waiting is not None:
+                skipped[id(waiting)] += 1
+        return selected
+
+    def _start(self, job:RunAllJob, cmd:List[str], free:List[int]):
+        job.cpu_set = free[:job.cpus]
+        del free[:job.cpus]
+
+        logger.info(
+            "start api [%s] against %s on cpus %s",
+            job.api_name, job.target, ",".join(str(c) for c in job.cpu_set)
+        )
+        job.start_time = time.time()
+        with job.log_file.open('w') as f:
+            job.process = subprocess.Popen(
+                cmd, stdout=f, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                preexec_fn=_set_affinity(job.cpu_set),
+            )
+
+    def run(self, make_cmd) -> List[RunAllJob]:
+        """
+        `make_cmd(job)` returns the command line of a job.
+        """
+        pending = list(self.jobs)
+        running: List[RunAllJob] = []
+        free = list(self.cpu_list)
+        skipped = {id(job): 0 for job in self.jobs}
+
+        try:
+            while pending or running:
+                busy_targets = set(job.target for job in running)
+                for job in self._select(pending, len(free), busy_targets, len(running), skipped):
+                    pending.remove(job)
+                    self._start(job, make_cmd(job), free)
+                    running.append(job)
+
+                time.sleep(POLL_INTERVAL)
+
+                for job in list(running):
+                    returncode = job.process.poll()
+                    if returncode is None:
+                        continue
+
+                    job.returncode = returncode
+                    job.end_time = time.time()
+                    running.remove(job)
+                    free.extend(job.cpu_set)
+                    free.sort()
+
+                    log = logger.info if returncode == 0 else logger.error
+                    log(
+                        "api [%s] finished with code %d in %.1fs, log: %s",
+                        job.api_name, returncode, job.end_time - job.start_time, job.log_file
+                    )
+        except KeyboardInterrupt:
+            for job in running:
+                job.process.terminate()
+            for job in running:
+                job.process.wait()
+            raise
+
+        return self.jobs
+
+
+def make_run_cmd(job:RunAllJob, config_file:str, env_file:str, tag:str,
+        engine:Optional[str] = None) -> List[str]:
+    cmd = [
+        sys.executable, '-m', 'easywrk.cli', 'run', job.api_name,
+        '-c', config_file, '-f', env_file, '--tag', tag,
+    ]
+    if engine:
+        cmd.extend(('--engine', engine))
+    return cmd
+
+def collect_results(context:EasyWrkContext, jobs:List[RunAllJob], tag:str) -> Dict[str, BenchmarkResult]:
+    """
+    Latest result of every succeeded job, if it was saved by this run.
+    """
+    results = {}
+    for job in jobs:
+        if job.returncode != 0:
+            continue
+        result = load_latest_result(context.get_api_dir(job.api_name))
+        if result is None or result.tag != tag or result.timestamp < job.start_time - 1:
+            continue
+        job.result = result
+        results[job.api_name] = result
+    return results
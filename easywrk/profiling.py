@@ -0,0 +1,266 @@
+# coding:utf8
+
+import os
+import sys
+import time
+import logging
+import threading
+
+from pathlib import Path
+from typing import List, Dict, Tuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# 线程 CPU 使用率达到这个比例就认为压测端到了瓶颈
+BUSY_THREAD_RATIO = 0.9
+
+# 结果里最多保存的线程数，内置引擎每个连接一个线程
+MAX_THREADS_IN_RESULT = 20
+
+PROFILE_TOP_FUNCTIONS = 15
+
+
+def _clock_ticks() -> int:
+    try:
+        return os.sysconf('SC_CLK_TCK')
+    except (ValueError, OSError, AttributeError):
+        return 100
+
+def available_cpu_count() -> int:
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def read_task_times(pid:int) -> Dict[int, Tuple[str, int]]:
+    """
+    {tid: (thread name, utime + stime in clock ticks)} of a process, empty when
+    /proc is not available or the process has exited.
+    """
+    task_dir = Path(f"/proc/{pid}/task")
+    times = {}
+    try:
+        tids = os.listdir(task_dir)
+    except OSError:
+        return times
+
+    for tid in tids:
+        try:
+            with open(task_dir.joinpath(tid, 'stat'), 'r') as f:
+                data = f.read()
+        except OSError:
+            continue
+
+        # comm 里可能有空格和括号，从最后一个括号之后开始解析
+        left = data.find('(')
+        right = data.rfind(')')
+        name = data[left + 1:right]
+        fields = data[right + 2:].split()
+        times[int(tid)] = (name, int(fields[11]) + int(fields[12]))
+
+    return times
+
+
+class TaskCpuSampler(object):
+    """
+    Sample cpu usage of every thread of a process from /proc/<pid>/task
+    in a background thread, usage is in cores (1.0 is a full core).
+    """
+
+    def __init__(self, pid:int, interval:float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.ticks = _clock_ticks()
+        # tid -> (线程名, 每次采样的使用率)
+        self.threads: Dict[int, Tuple[str, List[float]]] = {}
+        self.process: List[float] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self):
+        prev = read_task_times(self.pid)
+        if not prev:
+            logger.debug(f"can not read /proc/{self.pid}/task, cpu usage is not recorded")
+            return
+
+        prev_time = time.monotonic()
+        while not self._stop.wait(self.interval):
+            now = read_task_times(self.pid)
+            now_time = time.monotonic()
+            if not now:
+                break
+
+            elapsed = (now_time - prev_time) * self.ticks
+            total = 0.0
+            for tid, (name, ticks) in now.items():
+                # 新建的线程从 0 开始算
+                usage = (ticks - prev.get(tid, (name, 0))[1]) / elapsed
+                total += usage
+                self.threads.setdefault(tid, (name, []))[1].append(usage)
+            self.process.append(total)
+
+            prev = now
+            prev_time = now_time
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._sample, name="easywrk-cpu-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def stats(self) -> Dict:
+        if not self.process:
+            return {}
+
+        threads = []
+        for tid, (name, usages) in self.threads.items():
+            threads.append({
+                'tid': tid,
+                'name': name,
+                'avg': sum(usages) / len(usages),
+                'max': max(usages),
+            })
+        threads.sort(key=lambda t: t['avg'], reverse=True)
+
+        return {
+            'interval': self.interval,
+            'cpu_count': available_cpu_count(),
+            'process_avg': sum(self.process) / len(self.process),
+            'process_max': max(self.process),
+            'thread_count': len(threads),
+            'busy_threads': sum(1 for t in threads if t['avg'] >= BUSY_THREAD_RATIO),
+            'threads': threads[:MAX_THREADS_IN_RESULT],
+        }
+
+
+def diagnose(cpu:Dict, engine:str) -> Dict:
+    """
+    Tell whether the load generator, rather than the target, limited the run.
+    """
+    if not cpu:
+        return {}
+
+    cpu_count = cpu['cpu_count']
+    process_avg = cpu['process_avg']
+    busy = cpu['busy_threads']
+
+    if process_avg >= cpu_count * BUSY_THREAD_RATIO:
+        client_bound = True
+        reason = f"load generator used {process_avg:.2f} of {cpu_count} cpus"
+        recommendation = "the host is saturated, run the load generator on more hosts"
+    elif engine != 'wrk' and process_avg >= BUSY_THREAD_RATIO:
+        # python 引擎受 GIL 限制，最多只能用满一个核
+        client_bound = True
+        reason = f"python engine used {process_avg:.2f} cpu, it is limited by the GIL to one core"
+        recommendation = "use the wrk engine or run more easywrk processes"
+    elif busy > 0:
+        client_bound = True
+        reason = f"{busy} of {cpu['thread_count']} load threads were near 100% cpu"
+        if process_avg + busy <= cpu_count:
+            recommendation = "add wrk threads (threads in config) or processes, there are idle cpus"
+        else:
+            recommendation = "the host has no idle cpus, run the load generator on more hosts"
+    else:
+        client_bound = False
+        reason = f"load generator used {process_avg:.2f} of {cpu_count} cpus, no thread was busy"
+        recommendation = "the load generator has headroom, the target is likely saturated"
+
+    return {
+        'client_bound': client_bound,
+        'reason': reason,
+        'recommendation': recommendation,
+    }
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler(object):
+    """
+    Sample python stacks of all threads with sys._current_frames and count
+    them as folded stacks, which flamegraph tools can read. It samples wall
+    clock time, threads waiting on sockets are counted too.
+    """
+
+    def __init__(self, interval:float = 0.01, thread_prefix:str = ""):
+        self.interval = interval
+        # 只采样名字以此开头的线程，为空时采样所有线程
+        self.thread_prefix = thread_prefix
+        self.stacks: Dict[str, int] = {}
+        # 栈顶函数的采样数
+        self.functions: Dict[str, int] = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            idents = set(
+                t.ident for t in threading.enumerate()
+                if t.name.startswith(self.thread_prefix)
+            )
+            for ident, frame in sys._current_frames().items():
+                if ident == me or ident not in idents:
+                    continue
+
+                names = []
+                while frame is not None:
+                    names.append(_frame_name(frame))
+                    frame = frame.f_back
+                if not names:
+                    continue
+
+                stack = ";".join(reversed(names))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+                self.functions[names[0]] = self.functions.get(names[0], 0) + 1
+                self.samples += 1
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._sample, name="easywrk-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def top(self, n:int = PROFILE_TOP_FUNCTIONS) -> List[Tuple[str, float]]:
+        """
+        (function, percent of samples) of the functions seen most on top of stacks.
+        """
+        if not self.samples:
+            return []
+        items = sorted(self.functions.items(), key=lambda kv: kv[1], reverse=True)
+        return [(name, count * 100.0 / self.samples) for name, count in items[:n]]
+
+    def dump(self, fpath:Path):
+        with fpath.open('w') as f:
+            for stack, count in sorted(self.stacks.items(), key=lambda kv: kv[1], reverse=True):
+                f.write(f"{stack} {count}\n")
@@ -0,0 +1,654 @@
+# coding:utf8
+
+import math
+import mmap
+import bisect
+import struct
+import logging
+
+from pathlib import Path
+from typing import List, Dict, Tuple, Optional, Iterator
+
+from .result import BenchmarkResult, LatencyStats, Sample
+from .engine import EngineRecorder, EngineRun, LATENCY_PERCENTILES, HISTOGRAM_BOUNDS
+from .engine import ERROR_STATUS_MAP, percentile, snapshot_counts
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+RECORD_MAGIC = b"EWRKREC\0"
+RECORD_VERSION = 1
+
+# 文件头固定 64 字节: magic, 版本, 每条记录的字节数, 开始时间, 记录类型
+HEADER_STRUCT = struct.Struct('<8sIId16s')
+HEADER_SIZE = 64
+
+REQUESTS_FILE_SUFFIX = ".requests.bin"
+SAMPLES_FILE_SUFFIX = ".samples.bin"
+
+# 每次读取的记录数
+CHUNK_ROWS = 65536
+
+# 结果文件里最多保存的采样数，更多时合并相邻的采样
+MAX_RESULT_SAMPLES = 3600
+
+# 百分位统计用的对数桶，1us 到 1h，相邻桶相差 1%
+PERCENTILE_BOUNDS = [0.000001 * (1.01 ** i) for i in range(2203)]
+
+NUMPY_TYPES = {'d': 'f8', 'q': 'i8', 'i': 'i4'}
+
+
+class RecordException(Exception):
+    def __init__(self, msg:str):
+        super().__init__(msg)
+
+
+class RecordFormat(object):
+    """
+    A fixed size little endian record, fields starting with `_` are padding.
+    """
+
+    def __init__(self, name:str, fields:List[Tuple[str, str]]):
+        self.name = name
+        self.fields = fields
+        self.struct = struct.Struct('<' + ''.join(code for _, code in fields))
+        self.size = self.struct.size
+
+    @property
+    def names(self) -> List[str]:
+        return [name for name, _ in self.fields]
+
+    def dtype(self):
+        if np is None:
+            raise RecordException("numpy is not installed")
+        return np.dtype([(name, '<' + NUMPY_TYPES[code]) for name, code in self.fields])
+
+
+# 每个请求一条记录，时间都是相对压测开始的秒数，没有计划发送时间时 scheduled 是 NaN
+REQUEST_FORMAT = RecordFormat("requests", [
+    ('send', 'd'),
+    ('latency', 'd'),
+    ('scheduled', 'd'),
+    ('size', 'q'),
+    ('status', 'i'),
+    ('_pad', 'i'),
+])
+
+# 每秒一条记录，和 Sample 的字段一致
+SAMPLE_FORMAT = RecordFormat("samples", [
+    ('t', 'd'),
+    ('requests_per_sec', 'd'),
+    ('p99', 'd'),
+    ('errors', 'q'),
+    ('scheduled_per_sec', 'd'),
+    ('sent_per_sec', 'd'),
+])
+
+
+class RecordWriter(object):
+    """
+    Append records to a file, flushed on every write so the file can be
+    read while the run is going on.
+    """
+
+    def __init__(self, fpath:Path, fmt:RecordFormat, start_time:float):
+        self.fpath = fpath
+        self.fmt = fmt
+        self.count = 0
+        self._f = fpath.open('w+b')
+        header = HEADER_STRUCT.pack(
+            RECORD_MAGIC, RECORD_VERSION, fmt.size, start_time, fmt.name.encode('ascii')
+        )
+        self._f.write(header.ljust(HEADER_SIZE, b'\0'))
+
+    def write(self, rows:List[Tuple]):
+        if not rows:
+            return
+        pack = self.fmt.struct.pack
+        self._f.write(b''.join(pack(*row) for row in rows))
+        self._f.flush()
+        self.count += len(rows)
+
+    def add_to(self, index:int, values:Dict[str, float]):
+        """
+        Add `values` to the fields of the index-th written record.
+        """
+        pos = HEADER_SIZE + index * self.fmt.size
+        self._f.seek(pos)
+        row = list(self.fmt.struct.unpack(self._f.read(self.fmt.size)))
+        for name, value in values.items():
+            row[self.fmt.names.index(name)] += value
+        self._f.seek(pos)
+        self._f.write(self.fmt.struct.pack(*row))
+        self._f.seek(0, 2)
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+
+class RecordFile(object):
+    """
+    Read a record file through mmap. With numpy the records are a numpy
+    memmap, otherwise they are unpacked chunk by chunk; either way the file
+    is never loaded into memory at once. A partly written last record is
+    ignored.
+    """
+
+    def __init__(self, fpath:Path, fmt:RecordFormat):
+        self.fpath = fpath
+        self.fmt = fmt
+        with fpath.open('rb') as f:
+            header = f.read(HEADER_SIZE)
+            size = f.seek(0, 2)
+
+        if len(header) < HEADER_SIZE:
+            raise RecordException(f"invalid record file [{fpath}]")
+        magic, version, record_size, start_time, name = HEADER_STRUCT.unpack_from(header)
+        if magic != RECORD_MAGIC or version != RECORD_VERSION:
+            raise RecordException(f"invalid record file [{fpath}]")
+        if name.rstrip(b'\0').decode('ascii') != fmt.name or record_size != fmt.size:
+            raise RecordException(f"record file [{fpath}] is not a {fmt.name} file")
+
+        self.start_time = start_time
+        self.count = (size - HEADER_SIZE) // record_size
+
+    def __len__(self):
+        return self.count
+
+    def to_numpy(self):
+        """
+        A read only numpy structured array over the file.
+        """
+        dtype = self.fmt.dtype()
+        if self.count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.fpath, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(self.count,))
+
+    def iter_columns(self, chunk_rows:int = CHUNK_ROWS) -> Iterator[Dict]:
+        """
+        {field: values} of every chunk, values are numpy arrays with numpy
+        and tuples without.
+        """
+        if self.count == 0:
+            return
+
+        names = [name for name in self.fmt.names if not name.startswith('_')]
+        if np is not None:
+            records = self.to_numpy()
+            for i in range(0, self.count, chunk_rows):
+                chunk = records[i:i + chunk_rows]
+                yield {name: chunk[name] for name in names}
+            return
+
+        size = self.fmt.size
+        indexes = [self.fmt.names.index(name) for name in names]
+        with self.fpath.open('rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for i in range(0, self.count, chunk_rows):
+                    start = HEADER_SIZE + i * size
+                    end = HEADER_SIZE + min(i + chunk_rows, self.count) * size
+                    columns = list(zip(*self.fmt.struct.iter_unpack(mm[start:end])))
+                    yield {name: columns[idx] for name, idx in zip(names, indexes)}
+
+    def rows(self) -> List[Tuple]:
+        """
+        All records as tuples of python values, for small files like samples.
+        """
+        if np is not None:
+            names = [name for name in self.fmt.names if not name.startswith('_')]
+            return self.to_numpy()[names].tolist()
+
+        rows = []
+        for columns in self.iter_columns():
+            rows.extend(zip(*columns.values()))
+        return rows
+
+
+def get_records_files(results_dir:Path, run_id:str) -> Tuple[Path, Path]:
+    return (
+        results_dir.joinpath(run_id + REQUESTS_FILE_SUFFIX),
+        results_dir.joinpath(run_id + SAMPLES_FILE_SUFFIX),
+    )
+
+
+def _zero_counts(size:int):
+    # 区间很多时计数占用的内存不小，有 numpy 时使用 numpy 数组
+    if np is not None:
+        return np.zeros(size, dtype=np.int64)
+    return [0] * size
+
+
+class LogHistogram(object):
+    """
+    Counts in log buckets 1% wide, percentiles are accurate to 1%.
+    """
+
+    def __init__(self):
+        self.counts = _zero_counts(len(PERCENTILE_BOUNDS) + 1)
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, values):
+        if np is not None:
+            values = np.asarray(values)
+            if not len(values):
+                return
+            idx = np.searchsorted(PERCENTILE_BOUNDS, values, side='left')
+            self.counts += np.bincount(idx, minlength=len(self.counts))
+            self.count += len(values)
+            self.max = max(self.max, float(values.max()))
+            return
+
+        for v in values:
+            self.counts[bisect.bisect_left(PERCENTILE_BOUNDS, v)] += 1
+            self.count += 1
+            if v > self.max:
+                self.max = v
+
+    def percentile(self, p:float) -> float:
+        if not self.count:
+            return 0.0
+        rank = max(int(math.ceil(p / 100.0 * self.count)), 1)
+        if np is not None:
+            i = int(np.searchsorted(np.cumsum(self.counts), rank, side='left'))
+        else:
+            total = 0
+            for i, n in enumerate(self.counts):
+                total += n
+                if total >= rank:
+                    break
+        if i >= len(PERCENTILE_BOUNDS):
+            return self.max
+        return min(PERCENTILE_BOUNDS[i], self.max)
+
+
+def _iter_rows(columns:Dict) -> Iterator[Tuple]:
+    return zip(
+        columns['send'], columns['latency'], columns['scheduled'],
+        columns['size'], columns['status'],
+    )
+
+
+class RequestStats(object):
+    """
+    Aggregate request records chunk by chunk, vectorized with numpy.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.size = 0
+        self.latency_sum = 0.0
+        self.latency_square_sum = 0.0
+        self.latencies = LogHistogram()
+        # 每个直方图桶的请求数，最后一个桶是超过上界的
+        self.histogram = _zero_counts(len(HISTOGRAM_BOUNDS) + 1)
+        self.statuses: Dict[int, int] = {}
+        # 按计划发送的请求
+        self.lags = LogHistogram()
+        self.lag_sum = 0.0
+        self.corrected = LogHistogram()
+
+    def add(self, columns:Dict, start:Optional[float] = None, end:Optional[float] = None):
+        """
+        Add a chunk, only requests completed in [start, end) seconds when given.
+        """
+        if np is not None:
+            self._add_numpy(columns, start, end)
+        else:
+            self._add_python(columns, start, end)
+
+    def _add_numpy(self, columns, start, end):
+        send = columns['send']
+        latency = columns['latency']
+        mask = None
+        if start is not None or end is not None:
+            done = send + latency
+            mask = np.ones(len(done), dtype=bool)
+            if start is not None:
+                mask &= done >= start
+            if end is not None:
+                mask &= done < end
+            columns = {name: values[mask] for name, values in columns.items()}
+            send = columns['send']
+            latency = columns['latency']
+
+        self.count += len(latency)
+        self.size += int(columns['size'].sum())
+        self.latency_sum += float(latency.sum())
+        self.latency_square_sum += float((latency * latency).sum())
+        self.latencies.add(latency)
+        idx = np.searchsorted(HISTOGRAM_BOUNDS, latency, side='left')
+        self.histogram += np.bincount(idx, minlength=len(self.histogram))
+
+        statuses, counts = np.unique(columns['status'], return_counts=True)
+        for status, n in zip(statuses.tolist(), counts.tolist()):
+            self.statuses[status] = self.statuses.get(status, 0) + n
+
+        scheduled = columns['scheduled']
+        planned = ~np.isnan(scheduled)
+        if planned.any():
+            lag = np.maximum(send[planned] - scheduled[planned], 0.0)
+            self.lags.add(lag)
+            self.lag_sum += float(lag.sum())
+            self.corrected.add(lag + latency[planned])
+
+    def _add_python(self, columns, start, end):
+        for row in _iter_rows(columns):
+            done = row[0] + row[1]
+            if (start is not None and done < start) or (end is not None and done >= end):
+                continue
+            self._add_record(*row)
+
+    def _add_record(self, send, latency, scheduled, size, status):
+        self.count += 1
+        self.size += size
+        self.latency_sum += latency
+        self.latency_square_sum += latency * latency
+        self.latencies.add((latency,))
+        self.histogram[bisect.bisect_left(HISTOGRAM_BOUNDS, latency)] += 1
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+        if not math.isnan(scheduled):
+            lag = max(send - scheduled, 0.0)
+            self.lags.add((lag,))
+            self.lag_sum += lag
+            self.corrected.add((lag + latency,))
+
+    def errors(self) -> Dict[str, int]:
+        errors = {'connect': 0, 'read': 0, 'write': 0, 'timeout': 0, 'status': 0}
+        for status, n in self.statuses.items():
+            if status < 0:
+                errors[ERROR_STATUS_MAP.get(status, 'read')] += n
+            elif status >= 400:
+                errors['status'] += n
+        return errors
+
+    def latency_histogram(self) -> List[List[float]]:
+        """
+        Cumulative histogram like BenchmarkResult.latency_histogram.
+        """
+        histogram = []
+        total = 0
+        for le, n in zip(HISTOGRAM_BOUNDS, self.histogram):
+            total += int(n)
+            histogram.append([le, total])
+        return histogram
+
+    def latency_stats(self) -> LatencyStats:
+        if not self.count:
+            return LatencyStats()
+        avg = self.latency_sum / self.count
+        variance = max(self.latency_square_sum / self.count - avg * avg, 0.0)
+        return LatencyStats(avg=avg, stdev=math.sqrt(variance), max=self.latencies.max)
+
+    def schedule_stats(self) -> Dict[str, float]:
+        if not self.lags.count:
+            return {}
+        return {
+            'scheduled_requests': self.lags.count,
+            'lag_avg': self.lag_sum / self.lags.count,
+            'lag_p50': self.lags.percentile(50),
+            'lag_p99': self.lags.percentile(99),
+            'lag_max': self.lags.max,
+            'corrected_latency_p50': self.corrected.percentile(50),
+            'corrected_latency_p99': self.corrected.percentile(99),
+        }
+
+
+def query_requests(records:RecordFile, start:Optional[float] = None,
+        end:Optional[float] = None) -> RequestStats:
+    """
+    Stats of the requests completed in [start, end) seconds of the run.
+    """
+    stats = RequestStats()
+    for columns in records.iter_columns():
+        stats.add(columns, start, end)
+    return stats
+
+def _range_edges(ranges:List[Tuple[Optional[float], Optional[float]]]) -> Optional[List[float]]:
+    """
+    [start0, end0, start1, end1, ...] when the ranges are in order and do
+    not overlap, otherwise None.
+    """
+    edges = []
+    for start, end in ranges:
+        edges.append(-math.inf if start is None else start)
+        edges.append(math.inf if end is None else end)
+    if any(a > b for a, b in zip(edges, edges[1:])):
+        return None
+    return edges
+
+def _add_ranges_numpy(columns:Dict, edges:List[float], stats:List[RequestStats]):
+    # 偶数位置是 [start, end) 之内，奇数位置是两段之间
+    pos = np.searchsorted(edges, columns['send'] + columns['latency'], side='right') - 1
+    order = np.argsort(pos, kind='stable')
+    pos = pos[order]
+    for k in np.unique(pos).tolist():
+        if k < 0 or k % 2:
+            continue
+        lo = np.searchsorted(pos, k, side='left')
+        hi = np.searchsorted(pos, k, side='right')
+        idx = order[lo:hi]
+        stats[k // 2].add({name: values[idx] for name, values in columns.items()})
+
+def _add_ranges_python(columns:Dict, edges:List[float], stats:List[RequestStats]):
+    for row in _iter_rows(columns):
+        k = bisect.bisect_right(edges, row[0] + row[1]) - 1
+        if k >= 0 and k % 2 == 0:
+            stats[k // 2]._add_record(*row)
+
+def query_ranges(records:RecordFile,
+        ranges:List[Tuple[Optional[float], Optional[float]]]) -> List[RequestStats]:
+    """
+    query_requests of several time ranges in a single pass over the file,
+    every request is assigned to its range once when the ranges are in
+    order and do not overlap.
+    """
+    stats = [RequestStats() for _ in ranges]
+    edges = _range_edges(ranges)
+    for columns in records.iter_columns():
+        if edges is None:
+            for (start, end), s in zip(ranges, stats):
+                s.add(columns, start, end)
+        elif np is not None:
+            _add_ranges_numpy(columns, edges, stats)
+        else:
+            _add_ranges_python(columns, edges, stats)
+    return stats
+
+def open_request_records(results_dir:Path, run_id:str) -> RecordFile:
+    fpath, _ = get_records_files(results_dir, run_id)
+    if not fpath.is_file():
+        raise RecordException(f"not found request records of run [{run_id}]")
+    return RecordFile(fpath, REQUEST_FORMAT)
+
+
+def merge_samples(samples:List[Sample], max_samples:int = MAX_RESULT_SAMPLES) -> List[Sample]:
+    """
+    Merge adjacent samples so that at most `max_samples` are left, the p99
+    of merged samples is the largest one.
+    """
+    if len(samples) <= max_samples:
+        return samples
+
+    n = int(math.ceil(len(samples) / max_samples))
+    merged = []
+    for i in range(0, len(samples), n):
+        group = samples[i:i + n]
+        merged.append(Sample(
+            t = group[-1].t,
+            requests_per_sec = sum(s.requests_per_sec for s in group) / len(group),
+            p99 = max(s.p99 for s in group),
+            errors = sum(s.errors for s in group),
+            scheduled_per_sec = sum(s.scheduled_per_sec for s in group) / len(group),
+            sent_per_sec = sum(s.sent_per_sec for s in group) / len(group),
+        ))
+    return merged
+
+
+class RecordedRun(EngineRun):
+    """
+    A run whose records were streamed to files, the result is computed from
+    the files instead of the recorder.
+    """
+
+    def __init__(self, start_time:float, duration:float, connections:int,
+            requests:RecordFile, samples:RecordFile):
+        super().__init__(start_time, duration, EngineRecorder(), connections)
+        self.requests = requests
+        self.sample_records = samples
+
+    def to_result(self, api_name:str) -> BenchmarkResult:
+        stats = query_requests(self.requests)
+
+        result = BenchmarkResult(
+            api_name = api_name,
+            engine = "builtin",
+            timestamp = self.start_time,
+            duration = self.duration,
+            requests = stats.count,
+        )
+        if self.duration > 0:
+            result.requests_per_sec = stats.count / self.duration
+            result.transfer_per_sec = stats.size / self.duration
+
+        if stats.count > 0:
+            result.latency = stats.latency_stats()
+            result.latency_percentiles = {
+                p: stats.latencies.percentile(float(p)) for p in LATENCY_PERCENTILES
+            }
+            result.latency_histogram = stats.latency_histogram()
+
+        result.errors = stats.errors()
+        result.samples = merge_samples([Sample(*row) for row in self.sample_records.rows()])
+        result.wrk_config = {'connections': self.connections}
+
+        schedule = stats.schedule_stats()
+        if schedule:
+            result.extra['schedule'] = schedule
+
+        return result
+
+
+class RecordStream(object):
+    """
+    Called by the engine while running, it moves finished requests from the
+    recorders to the requests file and writes a sample for every second
+    once it is over, so memory does not grow with the run.
+    """
+
+    def __init__(self, results_dir:Path, run_id:str, start_time:float, interval:float = 1.0):
+        results_dir.mkdir(exist_ok=True, parents=True)
+        self.run_id = run_id
+        self.interval = interval
+        requests_file, samples_file = get_records_files(results_dir, run_id)
+        self.requests = RecordWriter(requests_file, REQUEST_FORMAT, start_time)
+        self.samples = RecordWriter(samples_file, SAMPLE_FORMAT, start_time)
+
+        # 采样序号 -> (延迟, 错误数)，以及计划和实际发送数
+        self.pending: Dict[int, Tuple[List[float], List[int]]] = {}
+        self.sent: Dict[int, int] = {}
+        self.scheduled: Dict[int, int] = {}
+        self.next_sample = 0
+
+    def _add(self, rec:EngineRecorder, n:int):
+        rows = list(zip(
+            rec.sends[:n], rec.latencies[:n], rec.scheduled[:n],
+            rec.sizes[:n], rec.statuses[:n], [0] * n,
+        ))
+        self.requests.write(rows)
+
+        interval = self.interval
+        for send, latency, scheduled, _, status, _ in rows:
+            idx = int((send + latency) / interval)
+            latencies, errors = self.pending.setdefault(idx, ([], [0]))
+            latencies.append(latency)
+            if status < 0 or status >= 400:
+                errors[0] += 1
+            if not math.isnan(scheduled):
+                idx = int(send / interval)
+                self.sent[idx] = self.sent.get(idx, 0) + 1
+                idx = int(scheduled / interval)
+                self.scheduled[idx] = self.scheduled.get(idx, 0) + 1
+
+    def _write_samples(self, until:Optional[int]):
+        interval = self.interval
+        keys = set(self.pending) | set(self.sent) | set(self.scheduled)
+
+        # 慢请求完成时，它发送的那一秒可能已经写入，计数加到已经写入的记录上，p99 不再更新
+        for idx in sorted(k for k in keys if k < self.next_sample):
+            latencies, errors = self.pending.pop(idx, ([], [0]))
+            self.samples.add_to(idx, {
+                'requests_per_sec': len(latencies) / interval,
+                'errors': errors[0],
+                'scheduled_per_sec': self.scheduled.pop(idx, 0) / interval,
+                'sent_per_sec': self.sent.pop(idx, 0) / interval,
+            })
+            keys.discard(idx)
+
+        if until is None:
+            until = max(keys) + 1 if keys else self.next_sample
+
+        # 每秒都写一条记录，记录序号就是采样序号
+        rows = []
+        for idx in range(self.next_sample, until):
+            latencies, errors = self.pending.pop(idx, ([], [0]))
+            latencies.sort()
+            rows.append((
+                (idx + 1) * interval,
+                len(latencies) / interval,
+                percentile(latencies, 99),
+                errors[0],
+                self.scheduled.pop(idx, 0) / interval,
+                self.sent.pop(idx, 0) / interval,
+            ))
+        self.samples.write(rows)
+        self.next_sample = max(self.next_sample, until)
+
+    def __call__(self, elapsed:float, recorders:List[EngineRecorder],
+            counts:Optional[List[int]] = None) -> bool:
+        """
+        Move the first `counts` records of every recorder to the file, all
+        complete records when None.
+        """
+        if counts is None:
+            counts = snapshot_counts(recorders)
+        for rec, n in zip(recorders, counts):
+            if n:
+                self._add(rec, n)
+                rec.drop(n)
+
+        # 多等一个间隔，还没写入的请求也算进去
+        self._write_samples(int(elapsed / self.interval) - 1)
+        return False
+
+    def finish(self, run:EngineRun) -> RecordedRun:
+        """
+        Write what is left in the merged recorder and close the files.
+        """
+        self._add(run.recorder, len(run.recorder))
+        self._write_samples(None)
+        self.requests.close()
+        self.samples.close()
+        logger.info(
+            "save %d request records to %s", self.requests.count, self.requests.fpath
+        )
+
+        return RecordedRun(
+            run.start_time, run.duration, run.connections,
+            RecordFile(self.requests.fpath, REQUEST_FORMAT),
+            RecordFile(self.samples.fpath, SAMPLE_FORMAT),
+        )
+
+    def info(self) -> Dict:
+        return {
+            'requests_file': self.requests.fpath.name,
+            'samples_file': self.samples.fpath.name,
+            'requests': self.requests.count,
+            'samples': self.samples.count,
+        }
@@ -0,0 +1,236 @@
+# coding:utf8
+
+import time
+import logging
+
+from html import escape
+from typing import List, Dict, Tuple, Optional, Callable
+
+from .history import HistoryStore, HistoryRun
+
+logger = logging.getLogger(__name__)
+
+CHART_WIDTH = 360
+CHART_HEIGHT = 180
+CHART_PADDING = (10, 10, 30, 60)  # top, right, bottom, left
+
+COLOR_RPS = "#1f77b4"
+COLOR_P99 = "#d62728"
+COLOR_LATENCY = "#2ca02c"
+
+REPORT_CSS = """
+body { font-family: -apple-system, "Segoe UI", Helvetica, Arial, sans-serif; margin: 24px; color: #222; }
+h1 { font-size: 22px; }
+h2 { font-size: 18px; margin: 0; display: inline; }
+table { border-collapse: collapse; font-size: 13px; }
+th, td { border: 1px solid #ddd; padding: 4px 8px; text-align: right; }
+th { background: #f5f5f5; }
+td.name, th.name { text-align: left; }
+td.up { color: #2ca02c; }
+td.down { color: #d62728; }
+details { margin: 16px 0; border-top: 1px solid #eee; padding-top: 8px; }
+.charts { display: flex; flex-wrap: wrap; gap: 16px; margin-top: 8px; }
+.chart { font-size: 12px; }
+.chart svg { background: #fcfcfc; border: 1px solid #eee; }
+.meta { color: #666; font-size: 12px; }
+"""
+
+
+def _format_ms(value:Optional[float]) -> str:
+    if value is None:
+        return ""
+    return "%.2f" % (value * 1000)
+
+def _format_time(timestamp:float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp))
+
+def _format_number(value:float) -> str:
+    if abs(value) >= 1000:
+        return "%.0f" % value
+    if abs(value) >= 10:
+        return "%.1f" % value
+    return "%.3g" % value
+
+def svg_line_chart(title:str, series:List[Tuple[str, str, List[Tuple[float, float]]]],
+        x_format:Callable[[float], str] = _format_number,
+        y_format:Callable[[float], str] = _format_number,
+        width:int = CHART_WIDTH, height:int = CHART_HEIGHT) -> str:
+    """
+    A minimal inline svg line chart, `series` is a list of (name, color, points).
+    """
+    points = [p for _, _, ps in series for p in ps]
+    if not points:
+        return ""
+
+    top, right, bottom, left = CHART_PADDING
+    plot_w = width - left - right
+    plot_h = height - top - bottom
+
+    x_min = min(p[0] for p in points)
+    x_max = max(p[0] for p in points)
+    y_min = min(0.0, min(p[1] for p in points))
+    y_max = max(p[1] for p in points)
+    if x_max == x_min:
+        x_max = x_min + 1
+    if y_max == y_min:
+        y_max = y_min + 1
+
+    def sx(x):
+        return left + (x - x_min) / (x_max - x_min) * plot_w
+
+    def sy(y):
+        return top + plot_h - (y - y_min) / (y_max - y_min) * plot_h
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">',
+        f'<line x1="{left}" y1="{top + plot_h}" x2="{left + plot_w}" y2="{top + plot_h}" stroke="#999"/>',
+        f'<line x1="{left}" y1="{top}" x2="{left}" y2="{top + plot_h}" stroke="#999"/>',
+    ]
+    for y in (y_min, (y_min + y_max) / 2, y_max):
+        parts.append(
+            f'<text x="{left - 4}" y="{sy(y) + 4:.1f}" text-anchor="end" font-size="10">{escape(y_format(y))}</text>'
+        )
+    for x, anchor in ((x_min, "start"), (x_max, "end")):
+        parts.append(
+            f'<text x="{sx(x):.1f}" y="{height - bottom + 14}" text-anchor="{anchor}" font-size="10">{escape(x_format(x))}</text>'
+        )
+
+    legend_x = left + 4
+    for name, color, ps in series:
+        if not ps:
+            continue
+        path = " ".join(f"{sx(x):.1f},{sy(y):.1f}" for x, y in ps)
+        parts.append(f'<polyline fill="none" stroke="{color}" stroke-width="1.5" points="{path}"/>')
+        if len(ps) == 1:
+            x, y = ps[0]
+            parts.append(f'<circle cx="{sx(x):.1f}" cy="{sy(y):.1f}" r="2.5" fill="{color}"/>')
+        if len(series) > 1:
+            parts.append(f'<text x="{legend_x}" y="{top + 10}" fill="{color}" font-size="10">{escape(name)}</text>')
+            legend_x += 8 * len(name) + 12
+
+    parts.append('</svg>')
+    return f'<div class="chart"><div>{escape(title)}</div>{"".join(parts)}</div>'
+
+
+def latency_cdf_points(run:HistoryRun) -> List[Tuple[float, float]]:
+    """
+    (latency in ms, cumulative percent), from the histogram when the engine
+    recorded one, otherwise from the percentiles.
+    """
+    if run.latency_histogram:
+        total = run.latency_histogram[-1][1]
+        if total > 0:
+            return [(le * 1000, count * 100.0 / total) for le, count in run.latency_histogram]
+
+    points = [(v * 1000, float(k)) for k, v in run.latency_percentiles.items()]
+    return sorted(points)
+
+def latency_histogram_points(run:HistoryRun) -> List[Tuple[float, float]]:
+    points = []
+    prev = 0
+    for le, count in run.latency_histogram:
+        points.append((le * 1000, count - prev))
+        prev = count
+    return points
+
+
+def _render_summary(api_names:List[str], descs:Dict[str, str],
+        latest:Dict[str, HistoryRun],
+        series:Dict[str, List[Tuple[float, float, Optional[float]]]]) -> str:
+    rows = [
+        '<table><tr><th class="name">API</th><th class="name">DESC</th><th>LAST RUN</th>'
+        '<th>RPS</th><th>CHANGE</th><th>P50(ms)</th><th>P99(ms)</th><th>ERRORS</th><th>RUNS</th></tr>'
+    ]
+    for name in api_names:
+        run = latest[name]
+        points = series.get(name, [])
+
+        change = ""
+        change_class = ""
+        if len(points) >= 2 and points[-2][1] > 0:
+            ratio = (points[-1][1] - points[-2][1]) / points[-2][1] * 100
+            change = "%+.1f%%" % ratio
+            change_class = "up" if ratio >= 0 else "down"
+
+        rows.append(
+            f'<tr><td class="name"><a href="#api-{escape(name)}">{escape(name)}</a></td>'
+            f'<td class="name">{escape(descs.get(name, ""))}</td>'
+            f'<td>{_format_time(run.timestamp)}</td>'
+            f'<td>{run.requests_per_sec:.2f}</td>'
+            f'<td class="{change_class}">{change}</td>'
+            f'<td>{_format_ms(run.p50)}</td>'
+            f'<td>{_format_ms(run.p99)}</td>'
+            f'<td>{run.errors}</td>'
+            f'<td>{len(points)}</td></tr>'
+        )
+    rows.append('</table>')
+    return "".join(rows)
+
+def _render_api(name:str, desc:str, run:HistoryRun,
+        points:List[Tuple[float, float, Optional[float]]]) -> str:
+    charts = []
+
+    charts.append(svg_line_chart(
+        "Latency CDF (% / ms)",
+        [("cdf", COLOR_LATENCY, latency_cdf_points(run))],
+    ))
+    if run.latency_histogram:
+        charts.append(svg_line_chart(
+            "Latency histogram (count / ms)",
+            [("count", COLOR_LATENCY, latency_histogram_points(run))],
+        ))
+    if run.samples:
+        charts.append(svg_line_chart(
+            "Throughput over time (req/s / s)",
+            [("rps", COLOR_RPS, [(s.t, s.requests_per_sec) for s in run.samples])],
+        ))
+
+    if points:
+        charts.append(svg_line_chart(
+            "Throughput trend (req/s)",
+            [("rps", COLOR_RPS, [(ts, rps) for ts, rps, _ in points])],
+            x_format=_format_time,
+        ))
+        p99_points = [(ts, p99 * 1000) for ts, _, p99 in points if p99 is not None]
+        if p99_points:
+            charts.append(svg_line_chart(
+                "P99 latency trend (ms)",
+                [("p99", COLOR_P99, p99_points)],
+                x_format=_format_time,
+            ))
+
+    meta = (
+        f"run {escape(run.run_id)} · engine {escape(run.engine)} · "
+        f"config {escape(run.config_hash)} · commit {escape(run.git_commit[:12])} · "
+        f"{run.requests} requests in {run.duration:.2f}s"
+    )
+    return (
+        f'<details open id="api-{escape(name)}"><summary><h2>{escape(name)}</h2> '
+        f'<span class="meta">{escape(desc)}</span></summary>'
+        f'<div class="meta">{meta}</div>'
+        f'<div class="charts">{"".join(c for c in charts if c)}</div></details>'
+    )
+
+def build_report(store:HistoryStore, api_names:List[str], descs:Dict[str, str],
+        tag:Optional[str] = None, max_runs:int = 100, title:str = "easywrk report") -> str:
+    """
+    Build a self-contained html report from the history store,
+    apis without any run are skipped.
+    """
+    latest = store.latest_runs(tag)
+    series = store.query_series(tag, limit=max_runs)
+
+    names = [name for name in api_names if name in latest]
+    names.extend(sorted(name for name in latest if name not in descs))
+
+    sections = [_render_api(name, descs.get(name, ""), latest[name], series.get(name, [])) for name in names]
+
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8">'
+        f'<title>{escape(title)}</title><style>{REPORT_CSS}</style></head><body>'
+        f'<h1>{escape(title)}</h1>'
+        f'<div class="meta">generated at {_format_time(time.time())}, {len(names)} apis</div>'
+        f'{_render_summary(names, descs, latest, series)}'
+        f'{"".join(sections)}'
+        '</body></html>\n'
+    )
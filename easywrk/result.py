@@ -0,0 +1,308 @@
+# coding:utf8
+
+import os
+import re
+import math
+import json
+import time
+import logging
+import subprocess
+
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import attr
+import cattr
+
+logger = logging.getLogger(__name__)
+
+RESULTS_DIR_NAME = "results"
+
+TIME_UNIT_MAP = {
+    'us': 0.000001,
+    'ms': 0.001,
+    's': 1.0,
+    'm': 60.0,
+    'h': 3600.0,
+}
+
+SIZE_UNIT_MAP = {
+    'B': 1,
+    'KB': 1024,
+    'MB': 1024 ** 2,
+    'GB': 1024 ** 3,
+    'TB': 1024 ** 4,
+}
+
+
+@attr.s
+class LatencyStats(object):
+    # 单位都是秒
+    avg = attr.ib(type=float, default=0.0)
+    stdev = attr.ib(type=float, default=0.0)
+    max = attr.ib(type=float, default=0.0)
+
+
+@attr.s
+class Sample(object):
+    # 距离开始压测的秒数
+    t = attr.ib(type=float, default=0.0)
+    requests_per_sec = attr.ib(type=float, default=0.0)
+    # 单位是秒
+    p99 = attr.ib(type=float, default=0.0)
+    errors = attr.ib(type=int, default=0)
+    # 按计划发送时，这一秒计划发送和实际发送的请求数
+    scheduled_per_sec = attr.ib(type=float, default=0.0)
+    sent_per_sec = attr.ib(type=float, default=0.0)
+
+
+@attr.s
+class BenchmarkResult(object):
+    api_name = attr.ib(type=str)
+    run_id = attr.ib(type=str, default="")
+    # unix 时间戳，压测开始时间
+    timestamp = attr.ib(type=float, default=0.0)
+    # wrk 或者其他压测引擎
+    engine = attr.ib(type=str, default="wrk")
+    # 实际压测时长，单位是秒
+    duration = attr.ib(type=float, default=0.0)
+    requests = attr.ib(type=int, default=0)
+    requests_per_sec = attr.ib(type=float, default=0.0)
+    # 单位是 bytes
+    transfer_per_sec = attr.ib(type=float, default=0.0)
+
+    latency = attr.ib(type=LatencyStats, factory=LatencyStats)
+    # key 是百分位，比如 "50", "99.9"; value 单位是秒
+    latency_percentiles = attr.ib(type=Dict[str, float], factory=dict)
+    # 累计直方图 [[le, count], ...], le 单位是秒
+    latency_histogram = attr.ib(type=List[List[float]], factory=list)
+
+    # connect, read, write, timeout, status
+    errors = attr.ib(type=Dict[str, int], factory=dict)
+    samples = attr.ib(type=List[Sample], factory=list)
+
+    labels = attr.ib(type=Dict[str, str], factory=dict)
+    wrk_config = attr.ib(type=Dict[str, Any], factory=dict)
+    git_commit = attr.ib(type=str, default="")
+    tag = attr.ib(type=str, default="")
+    # 压测相关配置的 hash，配置不变的结果才有可比性
+    config_hash = attr.ib(type=str, default="")
+
+    # 不同压测模式的附加数据
+    extra = attr.ib(type=Dict[str, Any], factory=dict)
+
+    def total_errors(self) -> int:
+        return sum(self.errors.values())
+
+
+def parse_time_value(text:str) -> float:
+    m = re.match(r'^([\d.]+)([a-z]+)$', text.strip())
+    if m is None:
+        raise ValueError(f"invalid time value [{text}]")
+
+    unit = TIME_UNIT_MAP.get(m.group(2))
+    if unit is None:
+        raise ValueError(f"invalid time unit [{text}]")
+
+    return float(m.group(1)) * unit
+
+def parse_size_value(text:str) -> float:
+    m = re.match(r'^([\d.]+)([A-Z]*B)$', text.strip())
+    if m is None:
+        raise ValueError(f"invalid size value [{text}]")
+
+    unit = SIZE_UNIT_MAP.get(m.group(2))
+    if unit is None:
+        raise ValueError(f"invalid size unit [{text}]")
+
+    return float(m.group(1)) * unit
+
+
+WRK_LATENCY_RE = re.compile(r'^\s*Latency\s+(\S+)\s+(\S+)\s+(\S+)')
+WRK_PERCENTILE_RE = re.compile(r'^\s*([\d.]+)%\s+(\S+)\s*$')
+WRK_REQUESTS_RE = re.compile(r'^\s*(\d+) requests in (\S+), (\S+) read')
+WRK_SOCKET_ERRORS_RE = re.compile(
+    r'^\s*Socket errors: connect (\d+), read (\d+), write (\d+), timeout (\d+)'
+)
+WRK_NON_2XX_RE = re.compile(r'^\s*Non-2xx or 3xx responses: (\d+)')
+WRK_RPS_RE = re.compile(r'^\s*Requests/sec:\s+([\d.]+)')
+WRK_TRANSFER_RE = re.compile(r'^\s*Transfer/sec:\s+(\S+)')
+
+
+def _format_percentile(value:str) -> str:
+    v = float(value)
+    if v.is_integer():
+        return str(int(v))
+    return str(v)
+
+def parse_wrk_output(api_name:str, text:str) -> BenchmarkResult:
+    result = BenchmarkResult(api_name=api_name, engine="wrk")
+    errors = {'connect': 0, 'read': 0, 'write': 0, 'timeout': 0, 'status': 0}
+
+    in_distribution = False
+    for line in text.splitlines():
+        if 'Latency Distribution' in line:
+            in_distribution = True
+            continue
+
+        if in_distribution:
+            m = WRK_PERCENTILE_RE.match(line)
+            if m is not None:
+                key = _format_percentile(m.group(1))
+                result.latency_percentiles[key] = parse_time_value(m.group(2))
+                continue
+            in_distribution = False
+
+        m = WRK_LATENCY_RE.match(line)
+        if m is not None:
+            result.latency = LatencyStats(
+                avg = parse_time_value(m.group(1)),
+                stdev = parse_time_value(m.group(2)),
+                max = parse_time_value(m.group(3)),
+            )
+            continue
+
+        m = WRK_REQUESTS_RE.match(line)
+        if m is not None:
+            result.requests = int(m.group(1))
+            result.duration = parse_time_value(m.group(2))
+            continue
+
+        m = WRK_SOCKET_ERRORS_RE.match(line)
+        if m is not None:
+            for idx, name in enumerate(('connect', 'read', 'write', 'timeout')):
+                errors[name] = int(m.group(idx + 1))
+            continue
+
+        m = WRK_NON_2XX_RE.match(line)
+        if m is not None:
+            errors['status'] = int(m.group(1))
+            continue
+
+        m = WRK_RPS_RE.match(line)
+        if m is not None:
+            result.requests_per_sec = float(m.group(1))
+            continue
+
+        m = WRK_TRANSFER_RE.match(line)
+        if m is not None:
+            result.transfer_per_sec = parse_size_value(m.group(1))
+            continue
+
+    result.errors = errors
+    return result
+
+
+def merge_results(api_name:str, results:List[BenchmarkResult]) -> BenchmarkResult:
+    """
+    Merge results of consecutive runs, like the windows of an auto duration
+    wrk run. Percentiles are averaged weighted by requests, which is an
+    approximation; every run becomes one sample.
+    """
+    first = results[0]
+    merged = BenchmarkResult(
+        api_name = api_name,
+        engine = first.engine,
+        timestamp = first.timestamp,
+    )
+
+    merged.duration = sum(r.duration for r in results)
+    merged.requests = sum(r.requests for r in results)
+    if merged.duration > 0:
+        merged.requests_per_sec = merged.requests / merged.duration
+        merged.transfer_per_sec = sum(r.transfer_per_sec * r.duration for r in results) / merged.duration
+
+    total = merged.requests
+    if total > 0:
+        avg = sum(r.latency.avg * r.requests for r in results) / total
+        # 合并方差: 组内方差加上组均值的偏差
+        variance = sum(
+            r.requests * (r.latency.stdev ** 2 + (r.latency.avg - avg) ** 2) for r in results
+        ) / total
+        merged.latency = LatencyStats(
+            avg = avg,
+            stdev = math.sqrt(variance),
+            max = max(r.latency.max for r in results),
+        )
+
+        keys = set(first.latency_percentiles)
+        for r in results[1:]:
+            keys &= set(r.latency_percentiles)
+        merged.latency_percentiles = {
+            k: sum(r.latency_percentiles[k] * r.requests for r in results) / total
+            for k in sorted(keys, key=float)
+        }
+
+    for r in results:
+        for k, v in r.errors.items():
+            merged.errors[k] = merged.errors.get(k, 0) + v
+
+    t = 0.0
+    for r in results:
+        t += r.duration
+        merged.samples.append(Sample(
+            t = t,
+            requests_per_sec = r.requests_per_sec,
+            p99 = r.latency_percentiles.get("99", 0.0),
+            errors = r.total_errors(),
+        ))
+
+    return merged
+
+def make_run_id(timestamp:float) -> str:
+    ms = int((timestamp - int(timestamp)) * 1000)
+    return time.strftime("%Y%m%dT%H%M%S", time.localtime(timestamp)) + f"-{ms:03d}"
+
+def get_git_commit(cwd:Path) -> str:
+    try:
+        output = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=str(cwd), stderr=subprocess.DEVNULL
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+    return output.decode('utf-8').strip()
+
+def get_results_dir(api_dir:Path) -> Path:
+    return api_dir.joinpath(RESULTS_DIR_NAME)
+
+def save_result(api_dir:Path, result:BenchmarkResult) -> Path:
+    if not result.timestamp:
+        result.timestamp = time.time()
+    if not result.run_id:
+        result.run_id = make_run_id(result.timestamp)
+
+    results_dir = get_results_dir(api_dir)
+    results_dir.mkdir(exist_ok=True, parents=True)
+
+    p = results_dir.joinpath(f"{result.run_id}.json")
+    tmp = p.with_suffix('.tmp')
+    with tmp.open('w') as f:
+        json.dump(cattr.unstructure(result), f, indent=2, ensure_ascii=False)
+    os.replace(str(tmp), str(p))
+
+    return p
+
+def load_result(fpath:Path) -> BenchmarkResult:
+    with fpath.open('r') as f:
+        data = json.load(f)
+
+    return cattr.structure(data, BenchmarkResult)
+
+def list_result_files(api_dir:Path) -> List[Path]:
+    results_dir = get_results_dir(api_dir)
+    if not results_dir.is_dir():
+        return []
+
+    return sorted(results_dir.glob('*.json'))
+
+def load_results(api_dir:Path) -> List[BenchmarkResult]:
+    return [load_result(p) for p in list_result_files(api_dir)]
+
+def load_latest_result(api_dir:Path) -> Optional[BenchmarkResult]:
+    files = list_result_files(api_dir)
+    if not files:
+        return None
+
+    return load_result(files[-1])
@@ -0,0 +1,174 @@
+# coding:utf8
+
+import math
+import random
+import logging
+
+from typing import List, Tuple, Iterator, Callable
+
+from .common import ArrivalConfig, RateStage
+from .engine import parse_duration
+
+logger = logging.getLogger(__name__)
+
+ARRIVAL_PROCESSES = ('poisson', 'fixed', 'bursty')
+RATE_STAGE_TYPES = ('constant', 'ramp', 'spike', 'diurnal')
+
+
+class ScheduleException(Exception):
+    def __init__(self, msg:str):
+        super().__init__(msg)
+
+
+def _stage_rate_func(stage:RateStage) -> Tuple[Callable[[float], float], float]:
+    """
+    (rate function of the time offset inside the stage, max rate of the stage)
+    """
+    if stage.type == 'constant':
+        return (lambda t: stage.rate), stage.rate
+
+    if stage.type == 'ramp':
+        duration = parse_duration(stage.duration)
+        delta = stage.target - stage.rate
+        return (lambda t: stage.rate + delta * min(t / duration, 1.0)), max(stage.rate, stage.target)
+
+    if stage.type == 'spike':
+        spike_at = parse_duration(stage.spike_at)
+        spike_end = spike_at + parse_duration(stage.spike_duration)
+        return (
+            (lambda t: stage.target if spike_at <= t < spike_end else stage.rate),
+            max(stage.rate, stage.target)
+        )
+
+    if stage.type == 'diurnal':
+        period = parse_duration(stage.period or stage.duration)
+        delta = stage.target - stage.rate
+        return (
+            (lambda t: stage.rate + delta * (1 - math.cos(2 * math.pi * t / period)) / 2),
+            max(stage.rate, stage.target)
+        )
+
+    raise ScheduleException(f"not support rate stage type [{stage.type}]")
+
+def _check_stage(idx:int, stage:RateStage) -> float:
+    """
+    Validate the idx-th stage before it is used, return its duration.
+    """
+    if stage.type not in RATE_STAGE_TYPES:
+        raise ScheduleException(f"not support type [{stage.type}] of rate stage {idx}")
+    duration = parse_duration(stage.duration)
+    if duration <= 0:
+        raise ScheduleException(f"duration of rate stage {idx} [{stage.type}] must be positive")
+    # 负的 rate 会让筛选概率没有意义
+    if stage.rate < 0 or stage.target < 0:
+        raise ScheduleException(f"rate and target of rate stage {idx} [{stage.type}] must not be negative")
+    if stage.type == 'diurnal' and parse_duration(stage.period or stage.duration) <= 0:
+        raise ScheduleException(f"period of rate stage {idx} [diurnal] must be positive")
+    if stage.type == 'spike' and parse_duration(stage.spike_duration) < 0:
+        raise ScheduleException(f"spike_duration of rate stage {idx} [spike] must not be negative")
+    return duration
+
+
+class RateSchedule(object):
+    """
+    Piecewise request rate over time, built from the stages of an arrival config.
+    """
+
+    def __init__(self, stages:List[RateStage]):
+        # (开始时间, 结束时间, rate 函数, 最大 rate)
+        self.stages = []
+        start = 0.0
+        for idx, stage in enumerate(stages):
+            duration = _check_stage(idx, stage)
+            func, max_rate = _stage_rate_func(stage)
+            self.stages.append((start, start + duration, func, max_rate))
+            start += duration
+
+        self.duration = start
+
+    @classmethod
+    def constant(cls, rate:float, duration:float) -> 'RateSchedule':
+        schedule = cls([])
+        schedule.stages = [(0.0, duration, lambda t: rate, rate)]
+        schedule.duration = duration
+        return schedule
+
+    def rate(self, t:float) -> float:
+        for start, end, func, _ in self.stages:
+            if start <= t < end:
+                return func(t - start)
+        return 0.0
+
+
+def _poisson_times(schedule:RateSchedule, rng:random.Random,
+        modulate:Callable[[float], float] = lambda t: 1.0, boost:float = 1.0) -> Iterator[float]:
+    # 非齐次泊松过程，按每段的最大 rate 生成再按比例筛选 (thinning)
+    for start, end, func, max_rate in schedule.stages:
+        max_rate = max_rate * boost
+        if max_rate <= 0:
+            continue
+
+        t = start
+        while True:
+            t += rng.expovariate(max_rate)
+            if t >= end:
+                break
+            rate = func(t - start) * modulate(t) * boost
+            if rng.random() * max_rate < rate:
+                yield t
+
+def _fixed_times(schedule:RateSchedule) -> Iterator[float]:
+    for start, end, func, max_rate in schedule.stages:
+        if max_rate <= 0:
+            continue
+
+        t = start
+        while t < end:
+            rate = func(t - start)
+            if rate <= 0:
+                # rate 为 0 的时候按最大 rate 的间隔往后找
+                t += 1.0 / max_rate
+                continue
+            yield t
+            t += 1.0 / rate
+
+def arrival_times(arrival:ArrivalConfig, default_duration:float) -> Iterator[float]:
+    """
+    Scheduled send times in seconds from the start of the run, ascending.
+    """
+    if arrival.process not in ARRIVAL_PROCESSES:
+        raise ScheduleException(f"not support arrival process [{arrival.process}]")
+
+    if arrival.stages:
+        schedule = RateSchedule(arrival.stages)
+    else:
+        if arrival.rate <= 0:
+            raise ScheduleException("arrival rate must be positive when no stages")
+        duration = parse_duration(arrival.duration) if arrival.duration else default_duration
+        schedule = RateSchedule.constant(arrival.rate, duration)
+
+    rng = random.Random(arrival.seed or None)
+
+    if arrival.process == 'fixed':
+        return _fixed_times(schedule)
+
+    if arrival.process == 'bursty':
+        on = parse_duration(arrival.on)
+        off = parse_duration(arrival.off)
+        if on <= 0 or off < 0:
+            raise ScheduleException("bursty arrival on must be positive and off must not be negative")
+        cycle = on + off
+        return _poisson_times(
+            schedule, rng,
+            modulate=lambda t: 1.0 if (t % cycle) < on else 0.0,
+            boost=cycle / on,
+        )
+
+    return _poisson_times(schedule, rng)
+
+def get_arrival_duration(arrival:ArrivalConfig, default_duration:float) -> float:
+    if arrival.stages:
+        return RateSchedule(arrival.stages).duration
+    if arrival.duration:
+        return parse_duration(arrival.duration)
+    return default_duration
@@ -0,0 +1,222 @@
+# coding:utf8
+
+import os
+import sys
+import time
+import select
+import struct
+import logging
+import ctypes
+import ctypes.util
+
+from pathlib import Path
+from typing import Dict, Set, Iterable, Optional, Tuple
+
+from jinja2 import Environment, FileSystemLoader, meta, TemplateError
+
+logger = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0)
+
+# 编辑器保存文件时经常是写临时文件再改名，所以监控目录
+IN_WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+    IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+
+INOTIFY_EVENT = struct.Struct('iIII')
+
+# 收到变化后再等一会，把一次保存产生的多个事件合并
+DEBOUNCE_SECONDS = 0.3
+
+
+def find_template_files(fpath:Path, loader_dir:Path) -> Set[Path]:
+    """
+    Templates included, imported or extended by the jinja template `fpath`, recursively.
+    """
+    env = Environment(loader=FileSystemLoader(str(loader_dir)))
+
+    found: Set[Path] = set()
+    pending = [fpath]
+    while pending:
+        p = pending.pop()
+        try:
+            with p.open('r') as f:
+                ast = env.parse(f.read())
+        except (OSError, TemplateError) as e:
+            logger.debug(f"parse template [{p}] failed: {e}")
+            continue
+
+        for name in meta.find_referenced_templates(ast):
+            # 动态的模板名没法分析
+            if name is None:
+                continue
+
+            include = loader_dir.joinpath(name).absolute()
+            if include not in found:
+                found.add(include)
+                pending.append(include)
+
+    return found
+
+
+class PollingWatcher(object):
+    """
+    Detect file changes by comparing mtime and size.
+    """
+
+    def __init__(self, interval:float = 1.0):
+        self.interval = interval
+        self.files: Dict[Path, Optional[Tuple[int, int]]] = {}
+
+    def _stat(self, p:Path):
+        try:
+            st = p.stat()
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def set_paths(self, paths:Iterable[Path]):
+        files = {}
+        for p in paths:
+            p = p.absolute()
+            files[p] = self.files[p] if p in self.files else self._stat(p)
+        self.files = files
+
+    def _changed(self) -> Set[Path]:
+        changed = set()
+        for p, old in self.files.items():
+            new = self._stat(p)
+            if new != old:
+                self.files[p] = new
+                changed.add(p)
+        return changed
+
+    def wait(self, timeout:Optional[float] = None) -> Set[Path]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = self._changed()
+            if changed:
+                return changed
+
+            if deadline is None:
+                time.sleep(self.interval)
+                continue
+
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return set()
+            time.sleep(min(self.interval, left))
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """
+    Detect file changes with linux inotify, by watching the parent directories.
+    """
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        self.files: Set[Path] = set()
+        # wd -> 目录
+        self.dirs: Dict[int, Path] = {}
+
+    def set_paths(self, paths:Iterable[Path]):
+        self.files = set(p.absolute() for p in paths)
+        dirs = set(p.parent for p in self.files)
+
+        for wd, d in list(self.dirs.items()):
+            if d not in dirs:
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.dirs[wd]
+
+        watched = set(self.dirs.values())
+        for d in dirs - watched:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(str(d)), IN_WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                logger.warning(f"watch directory [{d}] failed: {os.strerror(errno)}")
+                continue
+            self.dirs[wd] = d
+
+    def _read_events(self) -> Set[Path]:
+        changed: Set[Path] = set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return changed
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    changed.update(self.files)
+                    continue
+
+                d = self.dirs.get(wd)
+                if d is None or not name:
+                    continue
+
+                p = d.joinpath(os.fsdecode(name))
+                if p in self.files:
+                    changed.add(p)
+
+    def wait(self, timeout:Optional[float] = None) -> Set[Path]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            left = None if deadline is None else max(0.0, deadline - time.monotonic())
+            readable, _, _ = select.select([self.fd], [], [], left)
+            if not readable:
+                return set()
+
+            changed = self._read_events()
+            if changed:
+                return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def create_watcher(use_polling:bool = False, interval:float = 1.0):
+    if not use_polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError) as e:
+            logger.info(f"inotify is not available, fallback to polling: {e}")
+
+    return PollingWatcher(interval)
+
+def wait_changes(watcher, timeout:Optional[float] = None) -> Set[Path]:
+    changed = watcher.wait(timeout)
+    if not changed:
+        return changed
+
+    while True:
+        more = watcher.wait(DEBOUNCE_SECONDS)
+        if not more:
+            return changed
+        changed.update(more)
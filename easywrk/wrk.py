@@ -1,14 +1,18 @@
 # coding:utf8
 
+import sys
 import logging
 
 from pathlib import Path
 from typing import List
 import subprocess
+from urllib.parse import urlsplit
 
 from attr.validators import instance_of
 
 from .common import WrkConfig
+from .profiling import TaskCpuSampler
+from .corpus import INDEX_FILE_NAME, DATA_FILE_NAME
 
 logger = logging.getLogger(__name__)
 
@@ -38,25 +42,10 @@ class Wrk(object):
         else:
             self.body = body
 
+        # 最近一次运行 wrk 时的 CPU 使用率，参见 TaskCpuSampler.stats
+        self.cpu_stats = {}
 
-    def make_cmd_list(self, api_dir:Path, other_args:List[str]):
-        connections = self.wrk_config.thread_connections * self.wrk_config.threads
-        logger.info(
-            "total connections: %d", connections
-            )
-        cmd_list = [
-            self.wrk_bin, 
-            '-c', str(connections), 
-            '-t', str(self.wrk_config.threads),
-        ]
-
-        if self.wrk_config.duration:
-            cmd_list.extend(("-d", self.wrk_config.duration))
-        cmd_list.append(self.url)
-
-        if self.wrk_config.latency:
-            cmd_list.append('--latency')
-
+    def write_script(self, api_dir:Path) -> Path:
         body_file = api_dir.joinpath('wrk.body')
         lua_file = api_dir.joinpath('wrk.lua')
         with lua_file.open('w') as f:
@@ -75,6 +64,27 @@ class Wrk(object):
             with body_file.open('wb') as f:
                 f.write(self.body)
 
+        return lua_file
+
+    def make_cmd_list(self, api_dir:Path, other_args:List[str]):
+        connections = self.wrk_config.thread_connections * self.wrk_config.threads
+        logger.info(
+            "total connections: %d", connections
+            )
+        cmd_list = [
+            self.wrk_bin, 
+            '-c', str(connections), 
+            '-t', str(self.wrk_config.threads),
+        ]
+
+        if self.wrk_config.duration:
+            cmd_list.extend(("-d", self.wrk_config.duration))
+        cmd_list.append(self.url)
+
+        if self.wrk_config.latency:
+            cmd_list.append('--latency')
+
+        lua_file = self.write_script(api_dir)
         cmd_list.extend(
             ('--script', str(lua_file))
         )
@@ -85,14 +95,153 @@ class Wrk(object):
         return cmd_list
 
     
-    def run(self, api_dir:Path, other_args:List[str], dry_run=False):
+    def run(self, api_dir:Path, other_args:List[str], dry_run=False, echo=True):
         cmd_list = self.make_cmd_list(
             api_dir, other_args
         )
         cmd = ' '.join(cmd_list)
         logger.info("wrk commd: %s \n", cmd)
 
-        if not dry_run:
-            logger.info("start benchmark...")
+        if dry_run:
+            return None
+
+        logger.info("start benchmark...")
+
+        # wrk 的输出既要打印出来，也要用来解析压测结果
+        output = []
+        with subprocess.Popen(
+            cmd_list, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True) as p:
+            # 记录 wrk 每个线程的 CPU 使用率，用来判断瓶颈是否在压测端
+            with TaskCpuSampler(p.pid) as sampler:
+                for line in p.stdout:
+                    if echo:
+                        sys.stdout.write(line)
+                        sys.stdout.flush()
+                    output.append(line)
+        self.cpu_stats = sampler.stats()
+
+        if p.returncode != 0:
+            raise subprocess.CalledProcessError(p.returncode, cmd_list)
+
+        return "".join(output)
+
+
+lua_replay_template="""
+local index_path = "%(index_path)s"
+local data_path = "%(data_path)s"
+local base_path = "%(base_path)s"
+local count = %(count)d
+local speedup = %(speedup)s
+local timing = %(timing)s
+local connections = %(connections)d
+local thread_count = %(threads)d
+local record_size = 32
+
+local thread_id = 0
+
+function setup(thread)
+  thread:set("id", thread_id)
+  thread_id = thread_id + 1
+end
+
+local function u32(s, i)
+  local a, b, c, d = s:byte(i, i + 3)
+  return a + b * 256 + c * 65536 + d * 16777216
+end
+
+local function u64(s, i)
+  return u32(s, i) + u32(s, i + 4) * 4294967296
+end
+
+local index_file, data_file
+local pos, step
+local current_arrival
+
+local function read_record(i)
+  index_file:seek("set", i * record_size)
+  local r = index_file:read(record_size)
+  return u64(r, 1), u64(r, 9), u32(r, 17), u32(r, 21), u32(r, 25), r:byte(29) + r:byte(30) * 256
+end
+
+function init(args)
+  index_file = assert(io.open(index_path, "rb"))
+  data_file = assert(io.open(data_path, "rb"))
+  step = thread_count
+  pos = id
+end
+
+function request()
+  -- 每个线程按线程数间隔取请求，读到结尾后从头开始
+  if pos >= count then
+    pos = pos %% count
+  end
+  local arrival, offset, url_len, headers_len, body_len, method_len = read_record(pos)
+  current_arrival = arrival
+  pos = pos + step
+
+  data_file:seek("set", offset)
+  local method = data_file:read(method_len)
+  local path = base_path .. data_file:read(url_len)
+  local headers = {}
+  if headers_len > 0 then
+    local text = data_file:read(headers_len)
+    for k, v in text:gmatch("([^:\\r\\n]+): ([^\\r\\n]*)\\r\\n") do
+      headers[k] = v
+    end
+  end
+  local body = nil
+  if body_len > 0 then
+    body = data_file:read(body_len)
+  end
+  return wrk.format(method, path, headers, body)
+end
+
+if timing then
+  function delay()
+    -- 每个连接顺序发送，按照连接数放大间隔，近似还原线程内的到达速率
+    local next_pos = pos
+    if next_pos >= count then
+      return 0
+    end
+    local arrival = read_record(next_pos)
+    local gap = (arrival - current_arrival) / 1000 / speedup * connections
+    if gap < 0 then
+      return 0
+    end
+    return gap
+  end
+end
+"""
+
+class ReplayWrk(Wrk):
+    """
+    Replay a request corpus with wrk, the generated lua script reads
+    requests from the corpus files directly.
+    """
+
+    def __init__(self, wrk_config: WrkConfig, wrk_bin, base_url, corpus_dir:Path,
+            count:int, speedup:float = 1.0, timing:bool = True):
+        super().__init__(wrk_config, wrk_bin, base_url, "GET", None, None)
+        self.corpus_dir = corpus_dir
+        self.count = count
+        self.speedup = speedup
+        self.timing = timing
+
+    def write_script(self, api_dir:Path) -> Path:
+        lua_file = api_dir.joinpath('wrk.lua')
+        params = {
+            'index_path': self.corpus_dir.joinpath(INDEX_FILE_NAME).absolute(),
+            'data_path': self.corpus_dir.joinpath(DATA_FILE_NAME).absolute(),
+            # 和内置引擎一致，请求路径接在 BASE_URL 的路径之后
+            'base_path': urlsplit(self.url).path.rstrip('/'),
+            'count': self.count,
+            'speedup': repr(float(self.speedup)),
+            'timing': 'true' if self.timing else 'false',
+            'connections': self.wrk_config.thread_connections,
+            'threads': self.wrk_config.threads,
+        }
+        with lua_file.open('w') as f:
+            f.write(lua_replay_template % params)
 
-            subprocess.check_call(cmd_list)
+        return lua_file
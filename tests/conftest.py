@@ -0,0 +1,100 @@
+# coding:utf8
+
+import threading
+
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from tomlkit import parse
+
+from easywrk.common import create_easywrk_context
+
+DEFAULT_WRK_CONFIG = """
+[wrk]
+threads=1
+thread_connections=2
+latency=true
+duration="1s"
+"""
+
+API_CONFIG = """
+[[apis]]
+name="get"
+path="/get"
+method="GET"
+body=""
+    [[apis.params]]
+    name="a"
+    value="1"
+
+[[apis]]
+name="post"
+path="/post"
+method="POST"
+body=":json"
+    [[apis.fields]]
+    name="age"
+    value="18"
+    type="int"
+
+[[apis]]
+name="open"
+path="/get"
+method="GET"
+body=""
+    [apis.arrival]
+    process="fixed"
+    rate=20
+    duration="1s"
+
+[[apis]]
+name="connect"
+path="/get"
+method="GET"
+body=""
+    [apis.connect]
+    mode="tcp"
+"""
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _reply
+    do_POST = _reply
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def make_context(tmp_path):
+    """
+    Create an EasyWrkContext from toml text in a temp config dir.
+    """
+    def _make(text:str, base_url:str = "http://127.0.0.1:8080"):
+        if "[wrk]" not in text:
+            text = DEFAULT_WRK_CONFIG + text
+        tmp_path.joinpath("easywrk.toml").write_text(text)
+        return create_easywrk_context(base_url, Path(tmp_path), parse(text))
+    return _make
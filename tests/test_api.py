@@ -0,0 +1,79 @@
+# coding:utf8
+
+import asyncio
+
+import pytest
+
+from easywrk import ConfigException, build_prepared_request, run_benchmark, run_benchmarks_async
+from easywrk.api import select_engine, get_api_config, to_engine_request
+from easywrk.history import HistoryStore
+from easywrk.result import load_results
+
+from conftest import API_CONFIG
+
+
+def test_select_engine(make_context):
+    context = make_context(API_CONFIG)
+    assert select_engine(get_api_config(context, "get")) == 'wrk'
+    assert select_engine(get_api_config(context, "get"), 'builtin') == 'builtin'
+    assert select_engine(get_api_config(context, "open"), 'wrk') == 'builtin'
+    assert select_engine(get_api_config(context, "connect")) == 'connect'
+    with pytest.raises(ConfigException):
+        select_engine(get_api_config(context, "get"), 'ab')
+    with pytest.raises(ConfigException):
+        get_api_config(context, "missing")
+
+
+def test_build_prepared_request(make_context):
+    context = make_context(API_CONFIG)
+    req = build_prepared_request(context, "post")
+    assert req.body == b'{"age": 18}'
+
+    base_url, engine_req = to_engine_request(build_prepared_request(context, "get"))
+    assert base_url == "http://127.0.0.1:8080"
+    assert engine_req.url == "/get?a=1"
+
+
+def test_build_prepared_request_invalid_value(make_context):
+    context = make_context(API_CONFIG.replace('value="18"', 'value="abc"'))
+    with pytest.raises(ConfigException):
+        build_prepared_request(context, "post")
+
+
+def test_dry_run(make_context):
+    context = make_context(API_CONFIG)
+    assert run_benchmark(context, "get", dry_run=True) is None
+    assert context.config_file_dir.joinpath("benchmark", "get", "wrk.lua").is_file()
+    assert run_benchmark(context, "open", dry_run=True) is None
+
+
+def test_run_builtin(make_context, server_url):
+    context = make_context(API_CONFIG, base_url=server_url)
+    result = run_benchmark(context, "post", engine='builtin', tag="t1")
+
+    assert result.engine == 'builtin'
+    assert result.requests > 0
+    assert sum(result.errors.values()) == 0
+    assert result.config_hash
+
+    saved = load_results(context.get_api_dir("post"))
+    assert [r.run_id for r in saved] == [result.run_id]
+    with HistoryStore(context.get_history_file()) as store:
+        assert [r.tag for r in store.query_runs("post")] == ["t1"]
+
+
+def test_run_open_model(make_context, server_url):
+    context = make_context(API_CONFIG, base_url=server_url)
+    result = run_benchmark(context, "open", save=False)
+
+    assert result.requests == 20
+    assert result.extra['arrival']['rate'] == 20
+    assert not context.config_file_dir.joinpath("benchmark", "open").exists()
+
+
+def test_run_benchmarks_async(make_context, server_url):
+    context = make_context(API_CONFIG, base_url=server_url)
+    results = asyncio.run(run_benchmarks_async(
+        context, ["get", "post"], max_concurrency=1, engine='builtin', save=False
+    ))
+    assert [r.api_name for r in results] == ["get", "post"]
@@ -0,0 +1,159 @@
+# coding:utf8
+
+import os
+import ssl
+import shutil
+import socket
+import threading
+import subprocess
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from easywrk.engine import EngineRequest
+from easywrk.connect import ConnectEngine, ConnectException
+from easywrk.connect import SESSION_FULL, SESSION_RESUMED, SESSION_NONE
+from easywrk.engine import STATUS_READ_ERROR
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def cert_files(tmp_path_factory):
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl is not installed")
+
+    cert_dir = tmp_path_factory.mktemp("cert")
+    cert_file = cert_dir.joinpath("cert.pem")
+    key_file = cert_dir.joinpath("key.pem")
+    subprocess.run([
+        "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+        "-keyout", str(key_file), "-out", str(cert_file), "-days", "1",
+        "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost",
+    ], check=True, capture_output=True)
+    return cert_file, key_file
+
+
+@pytest.fixture
+def https_server(cert_files):
+    cert_file, key_file = cert_files
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(str(cert_file), str(key_file))
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    yield f"https://localhost:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def _run(engine, count=6):
+    requests = [EngineRequest(method="GET", url="/", headers={}) for _ in range(count)]
+    return engine.run(requests)
+
+
+def test_resumption_both(https_server, cert_files):
+    engine = ConnectEngine(https_server, 1, ca_file=str(cert_files[0]), resumption="both")
+    run = _run(engine)
+
+    # 交替完整握手和复用
+    assert list(run.recorder.sessions) == [SESSION_FULL, SESSION_RESUMED] * 3
+    assert list(run.recorder.statuses) == [200] * 6
+
+    result = run.to_result("connect")
+    connect = result.extra['connect']
+    assert connect['resumption_tried'] == 3
+    assert connect['resumption_ratio'] == 1.0
+    assert connect['phases']['tls_handshake_full']['count'] == 3
+    assert connect['phases']['tls_handshake_resumed']['count'] == 3
+    assert connect['phases']['first_request']['count'] == 6
+
+
+def test_resumption_off(https_server, cert_files):
+    engine = ConnectEngine(https_server, 2, ca_file=str(cert_files[0]), resumption="off")
+    run = _run(engine)
+
+    assert list(run.recorder.sessions) == [SESSION_FULL] * 6
+    assert run.to_result("connect").extra['connect']['resumption_tried'] == 0
+
+
+def test_tcp_mode(https_server, cert_files):
+    engine = ConnectEngine(https_server, 1, ca_file=str(cert_files[0]), mode="tcp")
+    run = _run(engine, 3)
+
+    assert list(run.recorder.sessions) == [SESSION_NONE] * 3
+    assert list(run.recorder.statuses) == [0] * 3
+    assert list(run.to_result("connect").extra['connect']['phases']) == ['tcp_connect']
+
+
+def test_verify_failed(https_server):
+    # 没有指定自签名证书时握手失败
+    engine = ConnectEngine(https_server, 1, mode="tls")
+    run = _run(engine, 2)
+    assert run.errors()['tls'] == 2
+
+
+def test_invalid_mode():
+    with pytest.raises(ConnectException):
+        ConnectEngine("http://127.0.0.1:1", mode="tls")
+    with pytest.raises(ConnectException):
+        ConnectEngine("https://127.0.0.1:1", mode="udp")
+
+
+@pytest.fixture
+def garbage_server(cert_files):
+    """
+    Complete the TLS handshake, then answer the request with bytes that are
+    not TLS records.
+    """
+    cert_file, key_file = cert_files
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(str(cert_file), str(key_file))
+
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+
+    def serve():
+        while True:
+            try:
+                sock, _ = listener.accept()
+            except OSError:
+                return
+            try:
+                with context.wrap_socket(sock, server_side=True) as tls:
+                    tls.recv(4096)
+                    os.write(tls.fileno(), b"not a tls record" * 8)
+            except OSError:
+                pass
+
+    t = threading.Thread(target=serve, daemon=True)
+    t.start()
+    yield f"https://localhost:{listener.getsockname()[1]}"
+    listener.close()
+
+
+def test_ssl_error_after_handshake(garbage_server):
+    engine = ConnectEngine(garbage_server, 1, tls_verify=False, resumption="off")
+    run = _run(engine, 2)
+
+    # 握手已经完成，之后的 SSLError 不算 TLS 错误
+    assert list(run.recorder.statuses) == [STATUS_READ_ERROR] * 2
+    assert list(run.recorder.sessions) == [SESSION_FULL] * 2
+    errors = run.errors()
+    assert errors['tls'] == 0 and errors['read'] == 2
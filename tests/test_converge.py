@@ -0,0 +1,146 @@
+# coding:utf8
+
+import math
+import logging
+
+import pytest
+
+from easywrk.common import WrkConfig
+from easywrk.converge import ConvergenceMonitor, RecorderWindows, t_quantile, relative_ci, is_auto_duration
+from easywrk.converge import STOP_CONVERGED, STOP_MAX_DURATION
+from easywrk.engine import EngineRecorder
+
+
+def test_is_auto_duration():
+    assert is_auto_duration(" Auto ")
+    assert not is_auto_duration("10s")
+
+
+def test_t_quantile():
+    # 和 t 分布表比较
+    assert t_quantile(0.95, 10) == pytest.approx(2.228, abs=0.01)
+    assert t_quantile(0.99, 4) == pytest.approx(4.604, abs=0.1)
+    assert t_quantile(0.95, 100000) == pytest.approx(1.96, abs=0.001)
+    assert t_quantile(0.95, 0) == math.inf
+    with pytest.raises(KeyError):
+        t_quantile(0.5, 10)
+
+
+def test_relative_ci():
+    assert relative_ci([5.0], 0.95) == (5.0, math.inf)
+    assert relative_ci([2.0, 2.0, 2.0], 0.95) == (2.0, 0.0)
+    assert relative_ci([0.0, 0.0], 0.95) == (0.0, 0.0)
+    assert relative_ci([-1.0, 1.0], 0.95)[1] == math.inf
+
+    mean, ci = relative_ci([9.0, 10.0, 11.0], 0.95)
+    assert mean == 10.0
+    assert ci == pytest.approx(t_quantile(0.95, 2) / math.sqrt(3) / 10)
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(confidence=0.5),
+    dict(window=0),
+    dict(windows=1),
+    dict(min_duration=20, max_duration=10),
+])
+def test_monitor_invalid(kwargs):
+    args = dict(min_duration=1, max_duration=10, window=1)
+    args.update(kwargs)
+    with pytest.raises(ValueError):
+        ConvergenceMonitor(**args)
+
+
+def test_monitor_from_config():
+    monitor = ConvergenceMonitor.from_config(WrkConfig(
+        duration="auto", min_duration="5s", max_duration="1m", window="2s",
+        converge_windows=3, tolerance=0.1, confidence=0.9,
+    ))
+    assert (monitor.min_duration, monitor.max_duration, monitor.window) == (5, 60, 2)
+    assert (monitor.windows, monitor.tolerance, monitor.confidence) == (3, 0.1, 0.9)
+
+
+def test_monitor_converged():
+    monitor = ConvergenceMonitor(3, 100, 1, windows=3, tolerance=0.05)
+    # 第一个预热窗口不参与计算
+    monitor.add_window(1, 10.0, 0.5)
+    assert not monitor.check(1)
+    for t in (2, 3):
+        monitor.add_window(t, 100.0, 0.010)
+        assert not monitor.check(t)
+    monitor.add_window(4, 101.0, 0.0101)
+    assert monitor.check(4)
+
+    stats = monitor.stats()
+    assert stats['stop_reason'] == STOP_CONVERGED
+    assert stats['converged'] and stats['p99_checked']
+    assert stats['stop_time'] == 4
+    assert stats['requests_per_sec_mean'] == pytest.approx(100.33, abs=0.01)
+
+
+def test_monitor_max_duration():
+    monitor = ConvergenceMonitor(1, 3, 1, windows=2)
+    for t, rps in ((1, 10.0), (2, 50.0), (3, 100.0)):
+        monitor.add_window(t, rps, 0.01)
+    assert monitor.check(3)
+    assert monitor.stop_reason == STOP_MAX_DURATION
+    assert not monitor.stats()['converged']
+
+
+def test_monitor_missing_p99(caplog):
+    monitor = ConvergenceMonitor(1, 100, 1, windows=2)
+    with caplog.at_level(logging.WARNING, logger="easywrk.converge"):
+        for t in (1, 2, 3):
+            monitor.add_window(t, 100.0, None)
+
+    # 只提示一次，没有 p99 时一直运行到 max_duration
+    assert len([r for r in caplog.records if "no p99" in r.message]) == 1
+    assert not monitor.check(3)
+    monitor.add_window(100, 100.0, 0.01)
+    assert monitor.check(100)
+
+    stats = monitor.stats()
+    assert stats['stop_reason'] == STOP_MAX_DURATION
+    assert not stats['p99_checked']
+
+
+def test_monitor_stalled():
+    monitor = ConvergenceMonitor(1, 10, 1, windows=2)
+    monitor.add_window(1, 100.0, 0.01)
+    # 目标卡住之后没有完成的请求
+    for t in range(2, 10):
+        monitor.add_window(t, 0.0, None)
+        assert not monitor.check(t)
+    monitor.add_window(10, 0.0, None)
+    assert monitor.check(10)
+
+    stats = monitor.stats()
+    assert stats['stop_reason'] == STOP_MAX_DURATION
+    assert not stats['converged'] and not stats['p99_checked']
+
+
+def test_recorder_windows():
+    monitor = ConvergenceMonitor(2, 100, 1, windows=2, tolerance=0.05)
+    windows = RecorderWindows(monitor)
+    recorders = [EngineRecorder(), EngineRecorder()]
+
+    def fill(start, count):
+        for i in range(count):
+            rec = recorders[i % 2]
+            rec.add(start + i / count, 0.001, 200, 10, None)
+
+    fill(0.0, 50)
+    assert not windows(1.0, recorders)
+    assert monitor.samples == [(1.0, 50.0, pytest.approx(0.001))]
+
+    # 已经写入文件并删除的记录不会重复统计
+    for rec in recorders:
+        rec.drop(len(rec))
+    fill(1.0, 100)
+    fill(2.0, 100)
+    assert not windows(2.5, recorders)
+    assert [s[1] for s in monitor.samples] == [50.0, 100.0]
+
+    fill(3.0, 100)
+    assert windows(4.0, recorders)
+    assert [s[1] for s in monitor.samples] == [50.0, 100.0, 100.0, 100.0]
+    assert monitor.stop_reason == STOP_CONVERGED
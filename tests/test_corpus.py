@@ -0,0 +1,164 @@
+# coding:utf8
+
+import json
+import base64
+
+import pytest
+
+from easywrk.common import WrkConfig
+from easywrk.corpus import Corpus, CorpusException, import_corpus, guess_format
+from easywrk.wrk import ReplayWrk
+
+NGINX_LOG = (
+    '10.0.0.1 - - [10/Jan/2021:08:00:00 +0000] "GET /a?x=1 HTTP/1.1" 200 12 "-" "curl/7.68"\n'
+    'not a log line\n'
+    '10.0.0.2 - - [10/Jan/2021:08:00:02 +0000] "POST /b HTTP/1.1" 201 3 "http://x/" "curl/7.68"\n'
+)
+
+
+def _import(tmp_path, name, text, fmt=""):
+    source = tmp_path.joinpath(name)
+    source.write_text(text)
+    corpus_dir = tmp_path.joinpath("corpus", name)
+    count = import_corpus(source, corpus_dir, fmt)
+    return count, corpus_dir
+
+
+def test_guess_format(tmp_path):
+    assert guess_format(tmp_path.joinpath("x.HAR")) == "har"
+    assert guess_format(tmp_path.joinpath("x.ndjson")) == "jsonl"
+    assert guess_format(tmp_path.joinpath("access.log")) == "nginx"
+
+
+def test_import_nginx(tmp_path):
+    count, corpus_dir = _import(tmp_path, "access.log", NGINX_LOG)
+    assert count == 2
+
+    with Corpus(corpus_dir) as corpus:
+        assert len(corpus) == 2
+        assert corpus.duration == 2.0
+
+        arrival, req = corpus.get(0)
+        assert arrival == 0.0
+        assert (req.method, req.url, req.body) == ("GET", "/a?x=1", None)
+        assert req.headers == {"User-Agent": "curl/7.68"}
+
+        arrival, req = corpus.get(1)
+        assert arrival == 2.0
+        assert req.method == "POST"
+        assert req.headers["Referer"] == "http://x/"
+
+
+def test_import_har(tmp_path):
+    har = {"log": {"entries": [
+        {
+            "startedDateTime": "2021-01-10T08:00:00.5Z",
+            "request": {
+                "method": "POST",
+                "url": "https://example.com/api/x?a=1",
+                "headers": [
+                    {"name": "Content-Type", "value": "application/json"},
+                    {"name": "Host", "value": "example.com"},
+                ],
+                "postData": {"text": '{"a": 1}'},
+            },
+        },
+        {
+            "startedDateTime": "2021-01-10T08:00:01.75Z",
+            "request": {
+                "method": "PUT",
+                "url": "https://example.com/bin",
+                "postData": {"text": base64.b64encode(b"\x00\x01").decode(), "encoding": "base64"},
+            },
+        },
+    ]}}
+    count, corpus_dir = _import(tmp_path, "x.har", json.dumps(har))
+    assert count == 2
+
+    with Corpus(corpus_dir) as corpus:
+        arrival, req = corpus.get(0)
+        assert (req.method, req.url, req.body) == ("POST", "/api/x?a=1", b'{"a": 1}')
+        # Host 由客户端重新生成
+        assert req.headers == {"Content-Type": "application/json"}
+
+        arrival, req = corpus.get(1)
+        assert arrival == pytest.approx(1.25)
+        assert req.body == b"\x00\x01"
+
+
+def test_import_jsonl(tmp_path):
+    lines = [
+        {"ts": 100.0, "method": "POST", "url": "/x", "headers": {"A": "1"}, "body": "hi"},
+        {"ts": 100.5, "url": "/y", "headers": [["B", "2"]]},
+    ]
+    text = "\n".join(json.dumps(line) for line in lines) + "\n\n"
+    count, corpus_dir = _import(tmp_path, "x.jsonl", text)
+    assert count == 2
+
+    with Corpus(corpus_dir) as corpus:
+        _, req = corpus.get(0)
+        assert (req.method, req.url, req.headers, req.body) == ("POST", "/x", {"A": "1"}, b"hi")
+        arrival, req = corpus.get(1)
+        assert arrival == 0.5
+        assert (req.method, req.headers) == ("GET", {"B": "2"})
+
+
+def test_import_invalid(tmp_path):
+    with pytest.raises(CorpusException):
+        _import(tmp_path, "x.jsonl", "{bad json\n")
+    with pytest.raises(CorpusException):
+        _import(tmp_path, "x.har", '{"log": {}}')
+    with pytest.raises(CorpusException):
+        _import(tmp_path, "x.log", NGINX_LOG, fmt="csv")
+
+
+def test_iter_requests(tmp_path):
+    _, corpus_dir = _import(tmp_path, "access.log", NGINX_LOG)
+
+    with Corpus(corpus_dir) as corpus:
+        scheduled = [req.scheduled for req in corpus.iter_requests(speedup=2.0)]
+        assert scheduled == [0.0, 1.0]
+
+        untimed = list(corpus.iter_requests(timing=False))
+        assert [req.scheduled for req in untimed] == [None, None]
+
+        # 循环回放接在上一轮之后
+        looped = corpus.iter_requests(speedup=2.0, loop=True)
+        scheduled = [next(looped).scheduled for _ in range(4)]
+        assert scheduled == [0.0, 1.0, 1.0, 2.0]
+
+        with pytest.raises(CorpusException):
+            next(corpus.iter_requests(speedup=0))
+
+
+def test_empty_corpus(tmp_path):
+    count, corpus_dir = _import(tmp_path, "empty.jsonl", "")
+    assert count == 0
+
+    with Corpus(corpus_dir) as corpus:
+        assert len(corpus) == 0
+        assert list(corpus.iter_requests(loop=True)) == []
+
+
+def test_replay_wrk_base_path(tmp_path):
+    _, corpus_dir = _import(tmp_path, "access.log", NGINX_LOG)
+
+    wrk = ReplayWrk(WrkConfig(threads=1, thread_connections=2), "wrk",
+        "http://127.0.0.1:8080/prefix/", corpus_dir, 2)
+    lua = wrk.write_script(tmp_path).read_text()
+    assert 'local base_path = "/prefix"' in lua
+    assert "local count = 2" in lua
+
+
+def test_has_result_name(make_context):
+    context = make_context("""
+[[apis]]
+name = "a"
+method = "GET"
+path = "/a"
+""")
+    assert context.has_result_name("a")
+    assert not context.has_result_name("replay-x")
+    context.get_api_dir("replay-x")
+    assert context.has_result_name("replay-x")
+    assert not context.has_result_name("b")
@@ -0,0 +1,114 @@
+# coding:utf8
+
+import threading
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from easywrk.result import BenchmarkResult, LatencyStats
+from easywrk.exporter import to_openmetrics, to_prometheus_text, to_line_protocol
+from easywrk.exporter import push_to_gateway, make_labels, ExportException, PROMETHEUS_CONTENT_TYPE
+
+
+def make_result(timestamp:float = 1000.0) -> BenchmarkResult:
+    return BenchmarkResult(
+        api_name = "get",
+        timestamp = timestamp,
+        duration = 10.0,
+        requests = 1000,
+        requests_per_sec = 100.0,
+        latency = LatencyStats(avg=0.01, stdev=0.002, max=0.05),
+        latency_percentiles = {"50": 0.009, "99": 0.03},
+        latency_histogram = [[0.01, 600], [0.1, 1000]],
+        errors = {'read': 2, 'timeout': 0},
+        wrk_config = {'threads': 2, 'thread_connections': 10, 'duration': "10s"},
+        labels = {'env-name': "test"},
+    )
+
+
+def test_make_labels():
+    labels = make_labels(make_result())
+    assert labels['api'] == "get"
+    assert labels['threads'] == "2"
+    assert labels['env_name'] == "test"
+
+
+def test_openmetrics():
+    text = to_openmetrics([make_result(2000.0), make_result(1000.0)])
+    lines = text.splitlines()
+    assert lines[-1] == "# EOF"
+    assert "# TYPE easywrk_requests counter" in lines
+    totals = [line for line in lines if line.startswith("easywrk_requests_total{")]
+    # 按时间排序
+    assert [line.split()[-1] for line in totals] == ["1000", "2000"]
+    assert any('quantile="0.99"' in line for line in lines)
+    assert any('le="+Inf"' in line for line in lines)
+
+
+def test_prometheus_text_counter_type():
+    text = to_prometheus_text([make_result()])
+    lines = text.splitlines()
+    assert "# TYPE easywrk_requests_total counter" in lines
+    assert "# TYPE easywrk_errors_total counter" in lines
+    assert "# TYPE easywrk_requests counter" not in lines
+    assert "# EOF" not in lines
+    # 没有时间戳
+    total = [line for line in lines if line.startswith("easywrk_requests_total{")][0]
+    assert total.endswith("} 1000")
+
+
+def test_line_protocol():
+    text = to_line_protocol([make_result()])
+    lines = text.splitlines()
+    assert lines[0].startswith("easywrk,api=get,engine=wrk")
+    assert "requests=1000i" in lines[0]
+    assert "errors_read=2i" in lines[0]
+    assert lines[0].endswith(" 1000000000000")
+    assert len([line for line in lines if line.startswith("easywrk_latency_bucket")]) == 2
+
+
+class _GatewayHandler(BaseHTTPRequestHandler):
+    status = 200
+
+    def do_PUT(self):
+        length = int(self.headers['Content-Length'])
+        self.server.requests.append((
+            self.path, self.headers['Content-Type'], self.rfile.read(length).decode('utf-8')
+        ))
+        self.send_response(self.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def gateway():
+    server = HTTPServer(('127.0.0.1', 0), _GatewayHandler)
+    server.requests = []
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_push_to_gateway(gateway):
+    url = f"http://127.0.0.1:{gateway.server_port}/"
+    push_to_gateway(url, "easy wrk", [make_result()])
+
+    path, content_type, body = gateway.requests[0]
+    assert path == "/metrics/job/easy%20wrk"
+    assert content_type == PROMETHEUS_CONTENT_TYPE
+    assert body == to_prometheus_text([make_result()])
+
+
+def test_push_to_gateway_error(gateway):
+    _GatewayHandler.status = 400
+    try:
+        with pytest.raises(ExportException):
+            push_to_gateway(f"http://127.0.0.1:{gateway.server_port}", "easywrk", [make_result()])
+    finally:
+        _GatewayHandler.status = 200
@@ -0,0 +1,134 @@
+# coding:utf8
+
+import os
+import time
+
+import pytest
+
+from easywrk.result import BenchmarkResult, LatencyStats, Sample, save_result
+from easywrk.history import HistoryStore, DAY_SECONDS, local_bucket
+
+
+def make_result(ts:float, rps:float = 100.0, p99:float = 0.01, run_id:str = "",
+        api_name:str = "get", tag:str = "") -> BenchmarkResult:
+    return BenchmarkResult(
+        api_name = api_name,
+        run_id = run_id or str(ts),
+        timestamp = ts,
+        requests = int(rps * 10),
+        requests_per_sec = rps,
+        duration = 10.0,
+        tag = tag,
+        latency = LatencyStats(avg=p99 / 2, max=p99 * 2),
+        latency_percentiles = {"50": p99 / 2, "99": p99},
+        errors = {'read': 1},
+        samples = [Sample(t=1.0, requests_per_sec=rps, p99=p99)],
+    )
+
+
+@pytest.fixture
+def store(tmp_path):
+    with HistoryStore(tmp_path.joinpath("history.db")) as s:
+        yield s
+
+
+@pytest.fixture
+def local_tz():
+    """
+    A timezone far from UTC, so local and UTC days differ.
+    """
+    old = os.environ.get('TZ')
+    os.environ['TZ'] = "Etc/GMT+10"
+    time.tzset()
+    yield
+    if old is None:
+        del os.environ['TZ']
+    else:
+        os.environ['TZ'] = old
+    time.tzset()
+
+
+def test_add_and_query(store):
+    assert store.add_result(make_result(1000.0))
+    assert not store.add_result(make_result(1000.0))
+    store.add_results([make_result(2000.0, tag="x"), make_result(3000.0, api_name="post")])
+
+    runs = store.query_runs("get")
+    assert [r.timestamp for r in runs] == [2000.0, 1000.0]
+    assert runs[0].p99 == 0.01
+    assert runs[0].samples[0].requests_per_sec == 100.0
+    assert [r.timestamp for r in store.query_runs("get", tag="x")] == [2000.0]
+    assert store.list_apis() == ["get", "post"]
+    assert store.latest_runs()["get"].timestamp == 2000.0
+
+
+def test_latest_runs_same_time_tags(store):
+    store.add_results([
+        make_result(1000.0, run_id="a", tag="x"),
+        make_result(1000.0, run_id="b", tag="y"),
+        make_result(500.0, run_id="c", tag="x", api_name="post"),
+    ])
+
+    assert store.latest_runs("x")["get"].run_id == "a"
+    assert store.latest_runs("y")["get"].run_id == "b"
+    assert list(store.latest_runs("y")) == ["get"]
+    assert sorted(r.run_id for r in store.latest_runs().values()) == ["b", "c"]
+
+
+def test_import_dir(store, tmp_path):
+    benchmark_dir = tmp_path.joinpath("benchmark")
+    save_result(benchmark_dir.joinpath("get"), make_result(1000.0, run_id="a"))
+    save_result(benchmark_dir.joinpath("get"), make_result(2000.0, run_id="b"))
+    assert store.import_dir(benchmark_dir) == 2
+    assert store.import_dir(benchmark_dir) == 0
+
+
+def test_trend_buckets_by_local_day(store, local_tz):
+    # UTC-10 的同一天，跨了 UTC 的两天
+    day = time.mktime((2026, 3, 10, 0, 0, 0, 0, 0, -1))
+    store.add_results([
+        make_result(day + 3600, rps=100.0),
+        make_result(day + 20 * 3600, rps=300.0),
+        make_result(day + DAY_SECONDS + 3600, rps=50.0),
+    ])
+
+    points = store.trend("get")
+    assert len(points) == 2
+    assert points[0].timestamp == day
+    assert time.localtime(points[0].timestamp)[:3] == (2026, 3, 10)
+    assert points[0].runs == 2
+    assert points[0].requests_per_sec == 200.0
+    assert points[0].rps_min == 100.0
+    assert points[0].rps_max == 300.0
+    assert local_bucket(day + 20 * 3600) == day
+
+
+def test_compact_keeps_trend(store, local_tz):
+    day = time.mktime((2026, 3, 10, 0, 0, 0, 0, 0, -1))
+    store.add_results([
+        make_result(day + 3600, rps=100.0),
+        make_result(day + 20 * 3600, rps=300.0),
+        make_result(day + 2 * DAY_SECONDS, rps=50.0),
+    ])
+    before = store.trend("get")
+
+    assert store.compact(day + DAY_SECONDS) == 2
+    assert [r.timestamp for r in store.query_runs("get")] == [day + 2 * DAY_SECONDS]
+    assert store.trend("get") == before
+
+    # 压缩之前的结果不再导入
+    assert not store.add_result(make_result(day + 7200, run_id="late"))
+
+
+def test_query_series_includes_summaries_and_limit(store):
+    store.add_results([make_result(1000.0 + i * DAY_SECONDS, rps=100.0 + i) for i in range(5)])
+    store.compact(1000.0 + 2 * DAY_SECONDS)
+
+    series = store.query_series()
+    points = series["get"]
+    assert [rps for _, rps, _ in points] == [100.0, 101.0, 102.0, 103.0, 104.0]
+    assert points[0][0] == local_bucket(1000.0)
+    assert points[0][2] == 0.01
+
+    limited = store.query_series(limit=2)["get"]
+    assert [rps for _, rps, _ in limited] == [103.0, 104.0]
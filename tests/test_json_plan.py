@@ -0,0 +1,78 @@
+# coding:utf8
+
+import os
+
+import pytest
+
+from easywrk.common import ApiField, JsonBodyPlan, BuildRequestException, get_json_plan
+
+
+def test_build_nested_json(tmp_path):
+    plan = JsonBodyPlan(tmp_path, [
+        ApiField(name="user/name", value="tom"),
+        ApiField(name="user/age", value="18", type="int"),
+        ApiField(name="tags/0", value="a"),
+        ApiField(name="tags/1", value="b"),
+        ApiField(name="score", value="1.5", type="float"),
+    ])
+    assert plan.build() == {
+        'user': {'name': "tom", 'age': 18},
+        'tags': ["a", "b"],
+        'score': 1.5,
+    }
+
+
+def test_build_with_values_does_not_change_defaults(tmp_path):
+    plan = JsonBodyPlan(tmp_path, [
+        ApiField(name="user/age", value="18", type="int"),
+    ])
+    assert plan.build({'user/age': "20"}) == {'user': {'age': 20}}
+    assert plan.build() == {'user': {'age': 18}}
+    assert list(plan.build_many([{'user/age': "1"}, {}])) == [
+        {'user': {'age': 1}}, {'user': {'age': 18}},
+    ]
+
+    with pytest.raises(BuildRequestException):
+        plan.build({'missing': "1"})
+
+
+@pytest.mark.parametrize("fields", [
+    [ApiField(name="a", value="1"), ApiField(name="a/b", value="2")],
+    [ApiField(name="a/b", value="1"), ApiField(name="a", value="2")],
+    [ApiField(name="a/0", value="1"), ApiField(name="a/2", value="2")],
+    [ApiField(name="/a", value="1")],
+    [ApiField(name="a//b", value="1")],
+    [ApiField(name="a", value="1", type="bool")],
+])
+def test_invalid_fields(tmp_path, fields):
+    with pytest.raises(BuildRequestException):
+        JsonBodyPlan(tmp_path, fields)
+
+
+def test_file_field_plan_rebuilt_on_change(tmp_path, make_context):
+    tmp_path.joinpath("name.txt").write_text("tom")
+    context = make_context("""
+[[apis]]
+name="post"
+path="/post"
+method="POST"
+body=":json"
+    [[apis.fields]]
+    name="name"
+    value="@name.txt"
+""")
+    api_config = context.api_config_map["post"]
+    plan = get_json_plan(context.config_file_dir, api_config)
+    assert plan.build() == {'name': "tom"}
+    assert get_json_plan(context.config_file_dir, api_config) is plan
+
+    # 文件字段在编译时读取，文件变化后重新编译
+    fpath = tmp_path.joinpath("name.txt")
+    fpath.write_text("jerry")
+    st = fpath.stat()
+    os.utime(fpath, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000))
+    assert plan.is_stale()
+    new_plan = get_json_plan(context.config_file_dir, api_config)
+    assert new_plan is not plan
+    assert new_plan.build() == {'name': "jerry"}
+    assert not new_plan.is_stale()
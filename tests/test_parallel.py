@@ -0,0 +1,165 @@
+# coding:utf8
+
+import sys
+
+import pytest
+
+from easywrk.common import ConfigException
+from easywrk.parallel import RunAllJob, RunAllScheduler, MAX_BACKFILL_SKIPS, plan_jobs, get_target, get_api_cpus, get_cpu_list
+
+CONFIG = """
+[wrk]
+threads=2
+thread_connections=2
+latency=true
+duration="1s"
+
+[[groups]]
+name="user"
+base_url="http://user.local:8000/api"
+cpus=3
+
+[[groups]]
+name="order"
+base_url="https://order.local"
+
+[[apis]]
+name="a"
+path="/a"
+method="GET"
+group="user"
+
+[[apis]]
+name="b"
+path="/b"
+method="GET"
+group="user"
+cpus=1
+
+[[apis]]
+name="c"
+path="/c"
+method="GET"
+group="order"
+
+[[apis]]
+name="d"
+path="/d"
+method="GET"
+    [apis.arrival]
+    rate=10
+"""
+
+
+def test_get_target():
+    assert get_target("http://x.local/api") == "x.local:80"
+    assert get_target("https://x.local") == "x.local:443"
+    assert get_target("http://x.local:8080") == "x.local:8080"
+
+
+def test_groups(make_context):
+    context = make_context(CONFIG)
+    api_config = context.api_config_map["a"]
+    assert context.get_group(api_config).name == "user"
+    assert context.get_base_url(api_config) == "http://user.local:8000/api"
+    assert context.get_base_url(context.api_config_map["d"]) == "http://127.0.0.1:8080"
+
+
+def test_undefined_group(make_context):
+    with pytest.raises(ConfigException):
+        make_context(CONFIG.replace('group="order"', 'group="pay"'))
+
+
+@pytest.mark.parametrize("name", ["", "a b"])
+def test_invalid_group_name(make_context, name):
+    with pytest.raises(ConfigException):
+        make_context(CONFIG.replace('name="order"', f'name="{name}"'))
+
+
+def test_get_api_cpus(make_context):
+    context = make_context(CONFIG)
+    m = context.api_config_map
+    assert get_api_cpus(context, m["a"], 'wrk') == 3
+    assert get_api_cpus(context, m["b"], 'wrk') == 1
+    # 没有配置时 wrk 按线程数，python 引擎用一个核
+    assert get_api_cpus(context, m["c"], 'wrk') == 2
+    assert get_api_cpus(context, m["d"], 'builtin') == 1
+
+
+def test_plan_jobs(make_context):
+    context = make_context(CONFIG)
+    jobs = plan_jobs(context, context.api_config_list)
+
+    assert [(j.api_name, j.engine, j.target, j.cpus) for j in jobs] == [
+        ("a", 'wrk', "user.local:8000", 3),
+        ("b", 'wrk', "user.local:8000", 1),
+        ("c", 'wrk', "order.local:443", 2),
+        ("d", 'builtin', "127.0.0.1:8080", 1),
+    ]
+
+    context = make_context(CONFIG, base_url="")
+    with pytest.raises(ValueError):
+        plan_jobs(context, context.api_config_list)
+
+
+def test_scheduler_plan(make_context):
+    context = make_context(CONFIG)
+    jobs = plan_jobs(context, context.api_config_list)
+
+    # 同一目标不同时压测，CPU 不够时等下一轮
+    waves = RunAllScheduler(jobs, cpu_list=[0, 1, 2, 3]).plan()
+    assert [[j.api_name for j in wave] for wave in waves] == [["a", "d"], ["b", "c"]]
+
+    waves = RunAllScheduler(jobs, cpu_list=[0, 1, 2, 3, 4, 5], max_parallel=1).plan()
+    assert [[j.api_name for j in wave] for wave in waves] == [["a"], ["b"], ["c"], ["d"]]
+
+
+def test_scheduler_stops_backfill(tmp_path):
+    def job(name, cpus):
+        return RunAllJob(name, 'builtin', f"{name}.local:80", cpus, tmp_path.joinpath(name))
+
+    big = job("big", 2)
+    small = [job(f"s{i}", 1) for i in range(MAX_BACKFILL_SKIPS + 2)]
+    scheduler = RunAllScheduler([job("long", 1), big] + small, cpu_list=[0, 1])
+    skipped = {id(j): 0 for j in scheduler.jobs}
+
+    # long 一直占着一个 CPU，小任务每次插队后马上结束
+    pending = [big] + small
+    started = []
+    for _ in range(MAX_BACKFILL_SKIPS + 1):
+        selected = scheduler._select(pending, 1, {"long.local:80"}, 1, skipped)
+        for j in selected:
+            pending.remove(j)
+        started.extend(j.api_name for j in selected)
+
+    assert started == [f"s{i}" for i in range(MAX_BACKFILL_SKIPS)]
+    assert skipped[id(big)] == MAX_BACKFILL_SKIPS
+    # CPU 都空出来后 big 先运行
+    assert scheduler._select(pending, 2, set(), 0, skipped) == [big]
+
+
+def test_scheduler_clamps_cpus(make_context):
+    context = make_context(CONFIG)
+    jobs = plan_jobs(context, context.api_config_list[:1])
+    RunAllScheduler(jobs, cpu_list=[0, 1])
+    assert jobs[0].cpus == 2
+
+
+def test_scheduler_run(make_context):
+    context = make_context(CONFIG)
+    jobs = plan_jobs(context, context.api_config_list)
+    cpu_list = get_cpu_list()[:1]
+
+    def make_cmd(job):
+        code = 0 if job.api_name != "c" else 3
+        return [sys.executable, "-c", f"print('{job.api_name}'); raise SystemExit({code})"]
+
+    RunAllScheduler(jobs, cpu_list=cpu_list).run(make_cmd)
+
+    assert [j.returncode for j in jobs] == [0, 0, 3, 0]
+    for job in jobs:
+        assert job.cpu_set == cpu_list
+        assert job.log_file.read_text().strip() == job.api_name
+    # 只有一个 CPU 时按顺序运行
+    for prev, job in zip(jobs, jobs[1:]):
+        assert prev.end_time <= job.start_time
@@ -0,0 +1,107 @@
+# coding:utf8
+
+import os
+import time
+import threading
+
+import pytest
+
+from easywrk.profiling import read_task_times, TaskCpuSampler, SamplingProfiler, diagnose
+
+linux_only = pytest.mark.skipif(not os.path.isdir("/proc/self/task"), reason="needs /proc")
+
+
+def _spin(stop:threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+@linux_only
+def test_read_task_times():
+    times = read_task_times(os.getpid())
+    assert threading.get_native_id() in times
+    name, ticks = times[threading.get_native_id()]
+    assert name and ticks >= 0
+
+    assert read_task_times(-1) == {}
+
+
+@linux_only
+def test_task_cpu_sampler():
+    stop = threading.Event()
+    t = threading.Thread(target=_spin, args=(stop,), name="busy")
+    t.start()
+    try:
+        with TaskCpuSampler(os.getpid(), interval=0.1) as sampler:
+            time.sleep(0.5)
+    finally:
+        stop.set()
+        t.join()
+
+    stats = sampler.stats()
+    assert stats['interval'] == 0.1
+    assert stats['thread_count'] >= 2
+    assert stats['process_avg'] > 0.3
+    assert stats['threads'][0]['avg'] >= stats['threads'][-1]['avg']
+
+
+def test_task_cpu_sampler_no_process():
+    with TaskCpuSampler(-1, interval=0.05) as sampler:
+        time.sleep(0.1)
+    assert sampler.stats() == {}
+
+
+def _cpu(process_avg, busy=0, cpu_count=4, thread_count=4):
+    return {
+        'cpu_count': cpu_count,
+        'process_avg': process_avg,
+        'busy_threads': busy,
+        'thread_count': thread_count,
+    }
+
+
+def test_diagnose():
+    assert diagnose({}, 'wrk') == {}
+
+    assert diagnose(_cpu(3.8), 'wrk')['client_bound']
+    # python 引擎最多用满一个核
+    assert diagnose(_cpu(0.95), 'builtin')['client_bound']
+    assert not diagnose(_cpu(0.95), 'wrk')['client_bound']
+
+    d = diagnose(_cpu(1.0, busy=1), 'wrk')
+    assert d['client_bound'] and "idle cpus" in d['recommendation']
+    d = diagnose(_cpu(3.5, busy=2), 'wrk')
+    assert d['client_bound'] and "no idle cpus" in d['recommendation']
+
+    d = diagnose(_cpu(0.5), 'wrk')
+    assert not d['client_bound'] and "headroom" in d['recommendation']
+
+
+def test_sampling_profiler(tmp_path):
+    stop = threading.Event()
+    t = threading.Thread(target=_spin, args=(stop,), name="easywrk-test-0")
+    t.start()
+    try:
+        with SamplingProfiler(interval=0.005, thread_prefix="easywrk-test") as profiler:
+            time.sleep(0.3)
+    finally:
+        stop.set()
+        t.join()
+
+    assert profiler.samples > 0
+    # 只采样了指定前缀的线程
+    assert all("_spin" in stack for stack in profiler.stacks)
+
+    top = profiler.top(3)
+    assert 0 < len(top) <= 3
+    assert sum(p for _, p in profiler.top()) == pytest.approx(100.0)
+
+    fpath = tmp_path.joinpath("profile.folded")
+    profiler.dump(fpath)
+    lines = fpath.read_text().splitlines()
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == profiler.samples
+
+
+def test_sampling_profiler_empty():
+    profiler = SamplingProfiler()
+    assert profiler.top() == []
@@ -0,0 +1,195 @@
+# coding:utf8
+
+import math
+
+import pytest
+
+from easywrk import records as records_module
+from easywrk.api import run_benchmark
+from easywrk.cli import cli
+from easywrk.converge import ConvergenceMonitor, RecorderWindows
+from easywrk.engine import EngineRecorder, EngineRun, snapshot_counts
+from easywrk.records import RecordStream, RecordFile, RecordException, LogHistogram
+from easywrk.records import REQUEST_FORMAT, SAMPLE_FORMAT, query_requests, query_ranges
+
+from conftest import API_CONFIG
+
+# (send, latency, scheduled, size, status)
+REQUESTS = [
+    (0.1, 0.01, 0.1, 100, 200),
+    (0.2, 2.5, 0.15, 100, 200),
+    (0.5, 0.002, math.nan, 10, 500),
+    (1.2, 0.03, 1.25, 100, 200),
+    (1.5, 0.0005, math.nan, 0, -1),
+    (2.1, 0.2, 2.0, 100, 200),
+    (2.9, 0.05, math.nan, 100, 404),
+    (3.3, 0.004, 3.0, 100, 200),
+]
+
+
+def _write_records(tmp_path):
+    """
+    Stream REQUESTS through a RecordStream like the engine does, the slow
+    second request only completes after its sample was written.
+    """
+    stream = RecordStream(tmp_path, "run", 1000.0)
+    rec = EngineRecorder()
+
+    def add(rows):
+        for send, latency, scheduled, size, status in rows:
+            rec.add(send, latency, status, size, None if math.isnan(scheduled) else scheduled)
+
+    fast = [r for r in REQUESTS if r[1] < 1]
+    add(fast[:4])
+    stream(2.05, [rec])
+    add([REQUESTS[1]] + fast[4:5])
+    stream(3.05, [rec])
+    add(fast[5:])
+
+    run = EngineRun(1000.0, 4.0, rec, 1)
+    return stream, stream.finish(run)
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(records_module, "np", None)
+    return request.param
+
+
+def _stats_values(stats):
+    return {
+        'count': stats.count,
+        'size': stats.size,
+        'latency': stats.latency_stats(),
+        'percentiles': [stats.latencies.percentile(p) for p in (50, 90, 99, 99.9)],
+        'histogram': stats.latency_histogram(),
+        'statuses': stats.statuses,
+        'errors': stats.errors(),
+        'schedule': stats.schedule_stats(),
+    }
+
+
+def test_record_files(tmp_path, backend):
+    stream, recorded = _write_records(tmp_path)
+    assert stream.info()['requests'] == len(REQUESTS)
+
+    requests = RecordFile(tmp_path.joinpath("run.requests.bin"), REQUEST_FORMAT)
+    assert requests.start_time == 1000.0
+    assert sorted(requests.rows(), key=lambda r: r[0])[0] == (0.1, 0.01, 0.1, 100, 200)
+
+    samples = RecordFile(tmp_path.joinpath("run.samples.bin"), SAMPLE_FORMAT).rows()
+    # 每秒一条记录，慢请求的发送计数加到已经写入的第 0 秒
+    assert [row[0] for row in samples] == [1.0, 2.0, 3.0, 4.0]
+    assert [row[1] for row in samples] == [2.0, 2.0, 3.0, 1.0]
+    assert [row[3] for row in samples] == [1, 1, 1, 0]
+    assert [row[4] for row in samples] == [2.0, 1.0, 1.0, 1.0]
+    assert [row[5] for row in samples] == [2.0, 1.0, 1.0, 1.0]
+
+    with pytest.raises(RecordException):
+        RecordFile(tmp_path.joinpath("run.requests.bin"), SAMPLE_FORMAT)
+
+    result = recorded.to_result("get")
+    assert result.requests == len(REQUESTS)
+    assert result.errors == {'connect': 1, 'read': 0, 'write': 0, 'timeout': 0, 'status': 2}
+    assert len(result.samples) == 4
+
+
+def test_numpy_and_python_are_identical(tmp_path, monkeypatch):
+    pytest.importorskip("numpy")
+    _, recorded = _write_records(tmp_path)
+
+    ranges = [(None, 1.0), (1.0, 2.5), (2.5, None)]
+    with_numpy = [_stats_values(query_requests(recorded.requests))]
+    with_numpy += [_stats_values(s) for s in query_ranges(recorded.requests, ranges)]
+
+    monkeypatch.setattr(records_module, "np", None)
+    with_python = [_stats_values(query_requests(recorded.requests))]
+    with_python += [_stats_values(s) for s in query_ranges(recorded.requests, ranges)]
+
+    assert with_numpy == with_python
+
+
+def test_query_requests(tmp_path, backend):
+    _, recorded = _write_records(tmp_path)
+    stats = query_requests(recorded.requests)
+
+    assert stats.count == len(REQUESTS)
+    assert stats.size == sum(r[3] for r in REQUESTS)
+    assert stats.statuses == {200: 5, 500: 1, -1: 1, 404: 1}
+    assert stats.latencies.max == 2.5
+    assert stats.latencies.percentile(50) == pytest.approx(0.01, rel=0.01)
+    assert stats.latency_histogram()[-1][1] == len(REQUESTS)
+
+    schedule = stats.schedule_stats()
+    assert schedule['scheduled_requests'] == 5
+    # 提前发送的按 0 计算
+    assert schedule['lag_avg'] == pytest.approx((0.05 + 0.1 + 0.3) / 5)
+
+    # 按完成时间过滤
+    assert query_requests(recorded.requests, 1.0, 3.0).count == 5
+
+
+@pytest.mark.parametrize("ranges", [
+    [(None, 1.0), (1.0, 2.5), (2.5, None)],
+    [(0.0, 1.0), (2.0, 3.0)],
+    [(1.0, 1.0), (0.0, 4.0)],
+    [(0.0, 3.0), (1.0, None)],
+])
+def test_query_ranges(tmp_path, backend, ranges):
+    _, recorded = _write_records(tmp_path)
+
+    stats = query_ranges(recorded.requests, ranges)
+    expected = [query_requests(recorded.requests, start, end) for start, end in ranges]
+    assert [_stats_values(s) for s in stats] == [_stats_values(s) for s in expected]
+
+
+def test_log_histogram(backend):
+    h = LogHistogram()
+    assert h.percentile(99) == 0.0
+
+    h.add([0.001 * i for i in range(1, 101)])
+    assert h.count == 100
+    assert h.percentile(50) == pytest.approx(0.05, rel=0.01)
+    assert h.percentile(100) == pytest.approx(0.1)
+
+
+def test_windows_and_stream_share_counts(tmp_path):
+    monitor = ConvergenceMonitor(100, 100, 1, windows=2)
+    windows = RecorderWindows(monitor)
+    stream = RecordStream(tmp_path, "run", 0.0)
+    rec = EngineRecorder()
+
+    for i in range(10):
+        rec.add(i * 0.1, 0.01, 200, 1, None)
+    counts = snapshot_counts([rec])
+    # 快照之后 worker 又追加的记录下次再读
+    for i in range(10, 15):
+        rec.add(i * 0.1, 0.01, 200, 1, None)
+    windows(1.2, [rec], counts)
+    stream(1.2, [rec], counts)
+    assert len(rec) == 5
+
+    windows(2.0, [rec])
+    stream(2.0, [rec])
+    assert monitor.samples == [(1.0, 10.0, pytest.approx(0.01)), (2.0, 5.0, pytest.approx(0.01))]
+    assert stream.requests.count == 15
+
+
+def test_records_command(make_context, server_url, capsys):
+    context = make_context(API_CONFIG, base_url=server_url)
+    result = run_benchmark(context, "get", engine='builtin', record=True)
+    assert result.extra['records']['requests'] == result.requests
+
+    config_file = str(context.config_file_dir.joinpath("easywrk.toml"))
+    env_file = str(context.config_file_dir.joinpath(".env"))
+    cli(["records", "get", "-c", config_file, "-f", env_file, "--interval", "0.5s", "-p", "99"], None)
+    out = capsys.readouterr().out
+    assert "P99(ms)" in out
+    assert out.count(result.run_id) == 2
+
+    for args in (["--interval", "-1s"], ["-p", "abc"], ["-p", "0"]):
+        with pytest.raises(SystemExit):
+            cli(["records", "get", "-c", config_file, "-f", env_file] + args, None)
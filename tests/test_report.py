@@ -0,0 +1,41 @@
+# coding:utf8
+
+from easywrk.history import HistoryStore, DAY_SECONDS
+from easywrk.report import build_report, svg_line_chart, latency_cdf_points
+
+from test_history import make_result
+
+
+def test_svg_line_chart():
+    svg = svg_line_chart("rps", [("rps", "#000", [(0, 1), (1, 2), (2, 3)])])
+    assert "<svg" in svg and "polyline" in svg
+    assert svg_line_chart("empty", [("rps", "#000", [])]) == ""
+
+
+def test_build_report_with_compacted_history(tmp_path):
+    with HistoryStore(tmp_path.joinpath("history.db")) as store:
+        store.add_results([
+            make_result(1000.0 + i * DAY_SECONDS, rps=100.0 + i, run_id=str(i)) for i in range(4)
+        ])
+        store.add_result(make_result(2000.0, api_name="post"))
+        store.compact(1000.0 + 2 * DAY_SECONDS)
+
+        html = build_report(store, ["get", "post"], {'get': "get <api>"}, max_runs=3)
+        latest = store.latest_runs()
+
+    assert html.startswith("<!DOCTYPE html>")
+    assert 'id="api-get"' in html
+    assert "get &lt;api&gt;" in html
+    # post 的运行全部被压缩，只有汇总数据
+    assert 'id="api-post"' not in html
+    assert "Throughput trend" in html
+    # 两个汇总点和两次运行，保留最新的 3 个
+    assert "<td>3</td></tr>" in html
+    assert latest["get"].run_id == "3"
+
+
+def test_latency_cdf_from_percentiles(tmp_path):
+    with HistoryStore(tmp_path.joinpath("history.db")) as store:
+        store.add_result(make_result(1000.0))
+        run = store.query_runs("get")[0]
+    assert latency_cdf_points(run) == [(5.0, 50.0), (10.0, 99.0)]
@@ -0,0 +1,83 @@
+# coding:utf8
+
+import pytest
+
+from easywrk.result import BenchmarkResult, LatencyStats
+from easywrk.result import parse_wrk_output, parse_time_value, parse_size_value
+from easywrk.result import save_result, load_result, list_result_files, load_latest_result, merge_results
+
+WRK_OUTPUT = """Running 10s test @ http://127.0.0.1:8080/api/get
+  2 threads and 10 connections
+  Thread Stats   Avg      Stdev     Max   +/- Stdev
+    Latency     1.50ms    0.50ms  20.00ms   90.00%
+    Req/Sec     3.00k   100.00     3.20k    70.00%
+  Latency Distribution
+     50%    1.20ms
+     75%    1.80ms
+     90%    2.50ms
+     99%    5.00ms
+  60000 requests in 10.00s, 7.50MB read
+  Socket errors: connect 1, read 2, write 3, timeout 4
+  Non-2xx or 3xx responses: 5
+Requests/sec:   6000.00
+Transfer/sec:    768.00KB
+"""
+
+
+def test_parse_time_and_size():
+    assert parse_time_value("1.5ms") == pytest.approx(0.0015)
+    assert parse_time_value("2m") == 120
+    assert parse_size_value("1.5KB") == 1536
+    with pytest.raises(ValueError):
+        parse_time_value("1.5x")
+    with pytest.raises(ValueError):
+        parse_size_value("abc")
+
+
+def test_parse_wrk_output():
+    result = parse_wrk_output("get", WRK_OUTPUT)
+    assert result.requests == 60000
+    assert result.duration == 10
+    assert result.requests_per_sec == 6000
+    assert result.transfer_per_sec == 768 * 1024
+    assert result.latency.avg == pytest.approx(0.0015)
+    assert result.latency.max == pytest.approx(0.02)
+    assert list(result.latency_percentiles) == ["50", "75", "90", "99"]
+    assert result.latency_percentiles["99"] == pytest.approx(0.005)
+    assert result.errors == {'connect': 1, 'read': 2, 'write': 3, 'timeout': 4, 'status': 5}
+    assert result.total_errors() == 15
+
+
+def test_save_and_load(tmp_path):
+    first = parse_wrk_output("get", WRK_OUTPUT)
+    first.timestamp = 1000.0
+    second = parse_wrk_output("get", WRK_OUTPUT)
+    second.timestamp = 2000.0
+    second.extra['x'] = {'a': 1}
+
+    p = save_result(tmp_path, first)
+    save_result(tmp_path, second)
+    assert load_result(p) == first
+    assert len(list_result_files(tmp_path)) == 2
+    assert load_latest_result(tmp_path) == second
+
+
+def test_merge_results():
+    a = BenchmarkResult(
+        api_name="get", duration=1.0, requests=100, requests_per_sec=100.0,
+        latency=LatencyStats(avg=0.01, stdev=0.0, max=0.02),
+        latency_percentiles={"99": 0.02}, errors={'read': 1},
+    )
+    b = BenchmarkResult(
+        api_name="get", duration=1.0, requests=300, requests_per_sec=300.0,
+        latency=LatencyStats(avg=0.03, stdev=0.0, max=0.05),
+        latency_percentiles={"99": 0.04}, errors={'read': 2},
+    )
+    merged = merge_results("get", [a, b])
+    assert merged.requests == 400
+    assert merged.requests_per_sec == 200
+    assert merged.latency.avg == pytest.approx(0.025)
+    assert merged.latency.max == 0.05
+    assert merged.latency_percentiles["99"] == pytest.approx(0.035)
+    assert merged.errors == {'read': 3}
+    assert [s.t for s in merged.samples] == [1.0, 2.0]
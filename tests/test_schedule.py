@@ -0,0 +1,86 @@
+# coding:utf8
+
+import pytest
+
+from easywrk.common import ArrivalConfig, RateStage
+from easywrk.schedule import RateSchedule, ScheduleException, arrival_times, get_arrival_duration
+
+
+def test_rate_schedule_stages():
+    schedule = RateSchedule([
+        RateStage(type="constant", duration="2s", rate=10),
+        RateStage(type="ramp", duration="4s", rate=10, target=50),
+        RateStage(type="spike", duration="3s", rate=5, target=100, spike_at="1s", spike_duration="1s"),
+        RateStage(type="diurnal", duration="4s", rate=0, target=20),
+    ])
+    assert schedule.duration == 13.0
+
+    assert schedule.rate(1.0) == 10
+    assert schedule.rate(4.0) == pytest.approx(30)
+    assert schedule.rate(6.5) == 5
+    assert schedule.rate(7.5) == 100
+    assert schedule.rate(8.5) == 5
+    assert schedule.rate(11.0) == pytest.approx(20)
+    assert schedule.rate(13.0) == 0.0
+
+
+@pytest.mark.parametrize("stage", [
+    RateStage(type="unknown"),
+    RateStage(type="constant", duration="0s", rate=1),
+    RateStage(type="constant", rate=-1),
+    RateStage(type="ramp", rate=1, target=-5),
+    RateStage(type="diurnal", rate=1, target=5, period="0s"),
+    RateStage(type="spike", rate=1, target=5, spike_duration="-1s"),
+])
+def test_rate_schedule_invalid(stage):
+    with pytest.raises(ScheduleException) as e:
+        RateSchedule([RateStage(rate=1), stage])
+    assert "stage 1" in str(e.value)
+
+
+def test_fixed_arrival():
+    times = list(arrival_times(ArrivalConfig(process="fixed", rate=4), 1.0))
+    assert times == [0.0, 0.25, 0.5, 0.75]
+
+    # rate 为 0 的阶段不发送请求
+    arrival = ArrivalConfig(process="fixed", stages=[
+        RateStage(type="spike", duration="2s", rate=0, target=2, spike_at="1s", spike_duration="1s"),
+    ])
+    assert list(arrival_times(arrival, 10.0)) == [1.0, 1.5]
+
+
+def test_poisson_arrival():
+    arrival = ArrivalConfig(process="poisson", rate=1000, duration="2s", seed=7)
+    times = list(arrival_times(arrival, 10.0))
+
+    assert times == sorted(times)
+    assert 0 <= times[0] and times[-1] < 2.0
+    assert len(times) == pytest.approx(2000, rel=0.1)
+    # 固定种子结果可以复现
+    assert times == list(arrival_times(arrival, 10.0))
+
+
+def test_bursty_arrival():
+    arrival = ArrivalConfig(process="bursty", rate=500, duration="4s", on="1s", off="1s", seed=3)
+    times = list(arrival_times(arrival, 10.0))
+
+    # 静默期间没有请求，平均 rate 不变
+    assert all((t % 2.0) < 1.0 for t in times)
+    assert len(times) == pytest.approx(2000, rel=0.1)
+
+
+@pytest.mark.parametrize("arrival", [
+    ArrivalConfig(process="uniform", rate=1),
+    ArrivalConfig(process="poisson", rate=0),
+    ArrivalConfig(process="bursty", rate=1, on="0s"),
+])
+def test_arrival_invalid(arrival):
+    with pytest.raises(ScheduleException):
+        arrival_times(arrival, 1.0)
+
+
+def test_get_arrival_duration():
+    stages = [RateStage(duration="2s", rate=1), RateStage(duration="0.5s", rate=1)]
+    assert get_arrival_duration(ArrivalConfig(stages=stages, duration="9s"), 1.0) == 2.5
+    assert get_arrival_duration(ArrivalConfig(rate=1, duration="3s"), 1.0) == 3.0
+    assert get_arrival_duration(ArrivalConfig(rate=1), 7.0) == 7.0
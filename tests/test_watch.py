@@ -0,0 +1,127 @@
+# coding:utf8
+
+import os
+import sys
+import argparse
+import time
+
+import pytest
+
+from easywrk.common import get_api_files
+from easywrk.commands import _load_watch_context, _watch_snapshot
+from easywrk.watch import PollingWatcher, InotifyWatcher, find_template_files, wait_changes
+
+
+def _touch(p, text):
+    p.write_text(text)
+    # 保证 mtime 变化能被轮询发现
+    st = p.stat()
+    os.utime(p, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000))
+
+
+def test_find_template_files(tmp_path):
+    tmp_path.joinpath("main.toml").write_text('{% include "a.toml" %}{% import "b.j2" as b %}')
+    tmp_path.joinpath("a.toml").write_text('{% extends "base.toml" %}')
+    tmp_path.joinpath("b.j2").write_text('')
+    tmp_path.joinpath("base.toml").write_text('')
+
+    found = find_template_files(tmp_path.joinpath("main.toml"), tmp_path)
+    assert found == {
+        tmp_path.joinpath(name).absolute() for name in ("a.toml", "b.j2", "base.toml")
+    }
+
+
+def test_get_api_files(make_context, tmp_path):
+    context = make_context("""
+[[apis]]
+name="json"
+path="/"
+method="POST"
+body=":json"
+    [[apis.fields]]
+    name="a"
+    value="@a.txt"
+    [[apis.fields]]
+    name="b"
+    value="@@not-a-file"
+
+[[apis]]
+name="render"
+path="/"
+method="POST"
+body=":render:body.j2"
+""")
+    assert get_api_files(tmp_path, context.api_config_map["json"]) == [tmp_path.joinpath("a.txt").absolute()]
+    assert get_api_files(tmp_path, context.api_config_map["render"]) == [tmp_path.joinpath("body.j2").absolute()]
+
+
+def test_polling_watcher(tmp_path):
+    p = tmp_path.joinpath("a.txt")
+    p.write_text("1")
+    watcher = PollingWatcher(0.01)
+    watcher.set_paths([p, tmp_path.joinpath("missing.txt")])
+    assert watcher.wait(0.05) == set()
+
+    _touch(p, "22")
+    assert watcher.wait(0.5) == {p.absolute()}
+
+    tmp_path.joinpath("missing.txt").write_text("")
+    assert watcher.wait(0.5) == {tmp_path.joinpath("missing.txt").absolute()}
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="inotify only works on linux")
+def test_inotify_watcher_rename(tmp_path):
+    p = tmp_path.joinpath("a.txt")
+    p.write_text("1")
+    watcher = InotifyWatcher()
+    try:
+        watcher.set_paths([p])
+        # 编辑器先写临时文件再改名
+        tmp = tmp_path.joinpath("a.txt.tmp")
+        tmp.write_text("2")
+        os.replace(str(tmp), str(p))
+        start = time.monotonic()
+        assert wait_changes(watcher, 1.0) == {p.absolute()}
+        assert time.monotonic() - start < 1.0
+        assert watcher.wait(0.05) == set()
+    finally:
+        watcher.close()
+
+
+def test_watch_snapshot_base_url(tmp_path, monkeypatch):
+    monkeypatch.delenv("BASE_URL", raising=False)
+    config_file = tmp_path.joinpath("easywrk.toml")
+    config_file.write_text("""
+[wrk]
+threads=1
+thread_connections=1
+duration="1s"
+
+[[groups]]
+name="user"
+base_url="http://user.local"
+
+[[apis]]
+name="a"
+path="/a"
+method="GET"
+
+[[apis]]
+name="b"
+path="/b"
+method="GET"
+group="user"
+""")
+    env_file = tmp_path.joinpath(".env")
+    env_file.write_text('BASE_URL="http://127.0.0.1:8080"\n')
+    args = argparse.Namespace(config_file=str(config_file), env_file=str(env_file))
+
+    before = _watch_snapshot(_load_watch_context(args), ["a", "b"])
+    env_file.write_text('BASE_URL="http://127.0.0.1:9090"\n')
+    after = _watch_snapshot(_load_watch_context(args), ["a", "b"])
+    # 只有使用 BASE_URL 的 api 受影响
+    assert before["a"] != after["a"]
+    assert before["b"] == after["b"]
+
+    config_file.write_text(config_file.read_text().replace("user.local", "user2.local"))
+    assert _watch_snapshot(_load_watch_context(args), ["a", "b"])["b"] != after["b"]